@@ -0,0 +1,186 @@
+# asgi.py
+# ASGI entry point. Compare requests spend most of their time waiting on the
+# LLM, so they are served natively async: model inference is offloaded to a
+# bounded pool and the LLM call is awaited, so in-flight compares cost no
+# threads. They get the same request id, access log, in-flight count,
+# periodic metrics and CORS headers as the Flask routes; a request asking for
+# a profile (X-Profile) is handed to Flask, whose middleware profiles it.
+# Every other route, generate-tests included, is passed to the Flask app
+# through a WSGI adapter and runs on its pool of WSGI_THREADS threads.
+#
+# Run with:  uvicorn asgi:app --host 0.0.0.0 --port 8000
+# or preforked:  ASGI=1 gunicorn -c gunicorn.conf.py
+
+import io
+import os
+import time
+import uuid
+import logging
+import orjson
+from werkzeug.wrappers import Request
+from a2wsgi import WSGIMiddleware
+
+from main import (app as flask_app, RESULTS, RESULTS_LOCK, request_middleware,
+                  CORS_METHODS, CORS_ALLOW_HEADERS, CORS_EXPOSE_HEADERS)
+from compare_service import handle_compare_async
+from logger import should_log_access
+from responses import compress_body
+
+access_logger = logging.getLogger('access')
+
+MAX_BODY_BYTES = flask_app.config['MAX_CONTENT_LENGTH']
+# Threads running the Flask routes
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 10))
+
+# Same CORS policy as flask-cors in main.py; preflight requests go to Flask
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-methods', ', '.join(CORS_METHODS).encode('latin-1')),
+    (b'access-control-allow-headers', ', '.join(CORS_ALLOW_HEADERS).encode('latin-1')),
+    (b'access-control-expose-headers', ', '.join(CORS_EXPOSE_HEADERS).encode('latin-1')),
+]
+
+# (method, path) -> async handler(form, results_dict, results_lock)
+ASYNC_ROUTES = {
+    ('POST', '/api/similarity-matcher/compare'): handle_compare_async,
+    ('POST', '/api/teacher-assistant/compare'): handle_compare_async,
+}
+
+
+class AsyncApp:
+    """
+    ASGI application serving ASYNC_ROUTES directly and delegating the rest
+    of the API to the Flask app.
+    """
+    def __init__(self, wsgi_app):
+        """
+        Args:
+            wsgi_app: The Flask application
+        """
+        self.wsgi = WSGIMiddleware(wsgi_app, workers=WSGI_THREADS)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] == 'http':
+            handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+            if handler is not None and not self._header(scope, b'x-profile'):
+                await self._handle(handler, scope, receive, send)
+                return
+        await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _handle(self, handler, scope, receive, send):
+        # The async counterpart of RequestMiddleware's hooks
+        start_time = time.time()
+        request_id = str(uuid.uuid4())
+        request_middleware.profiler.request_started()
+        try:
+            if access_logger.isEnabledFor(logging.DEBUG):
+                access_logger.debug("Request received", extra={
+                    'method': scope['method'],
+                    'path': scope['path'],
+                    'request_id': request_id
+                })
+
+            values = None
+            body = await self._read_body(receive)
+            if body is None:
+                payload, status = {'error': 'Request body too large.'}, 413
+            else:
+                try:
+                    values = self._parse_values(scope, body)
+                    payload, status = await handler(values, RESULTS, RESULTS_LOCK)
+                except Exception as e:
+                    logging.exception(f"Unhandled exception: {e}", extra={"request_id": request_id})
+                    payload, status = {'error': 'Internal server error.'}, 500
+
+            await self._send_json(send, payload, status, self._header(scope, b'accept-encoding'))
+
+            if should_log_access(scope['path'], status):
+                client = scope.get('client') or (None, None)
+                access_logger.info("Request completed", extra={
+                    'method': scope['method'],
+                    'path': scope['path'],
+                    'status': status,
+                    'duration': time.time() - start_time,
+                    'ip': client[0],
+                    'user_agent': self._header(scope, b'user-agent'),
+                    'user_id': values.get('user_id', 'anonymous') if values is not None else 'anonymous',
+                    'request_id': request_id
+                })
+            request_middleware.collect_metrics_if_due()
+        finally:
+            request_middleware.profiler.request_finished()
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                break
+        return b''.join(chunks)
+
+    @staticmethod
+    def _header(scope, name):
+        for key, value in scope['headers']:
+            if key.lower() == name:
+                return value.decode('latin-1')
+        return ''
+
+    @staticmethod
+    def _parse_values(scope, body):
+        # Reuse Werkzeug's parser for urlencoded and multipart bodies; the
+        # result combines the form with the query arguments
+        headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'CONTENT_TYPE': headers.get('content-type', ''),
+            'CONTENT_LENGTH': str(len(body)),
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+        }
+        return Request(environ).values
+
+    @staticmethod
+    async def _send_json(send, payload, status, accept_encoding):
+        body = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+        body, encoding = compress_body(body, accept_encoding)
+        headers = [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('latin-1')),
+            (b'vary', b'Accept-Encoding'),
+        ] + CORS_HEADERS
+        if encoding:
+            headers.append((b'content-encoding', encoding.encode('latin-1')))
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': headers,
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+app = AsyncApp(flask_app)
@@ -0,0 +1,284 @@
+# batch_compare.py
+# This module scores many queries against one project in a single call.
+# Queries come as a JSON list or an uploaded CSV. They are encoded in large
+# batches on the bulk encoding lane, searched with multi-vector queries,
+# optionally refined with LLM prompts that score several queries at once,
+# and streamed back as NDJSON or CSV while later batches are still being
+# computed. Refined results go through the same result cache as /compare.
+
+import io
+import os
+import csv
+import json
+import logging
+from flask import Response, jsonify
+import orjson
+from responses import parse_fields, select_fields, MATCH_FIELDS
+from project_catalog import get_project_catalog
+from result_cache import compare_cache_key
+from llm import calculate_semantic_similarity_batch
+from compare_service import (TOP_K, parse_compare_filter, search_project_batch, apply_refined_scores, sort_matches,
+                             cached_result, remember_result)
+
+# Queries accepted per call
+BATCH_COMPARE_MAX_QUERIES = int(os.environ.get('BATCH_COMPARE_MAX_QUERIES', 10000))
+# Queries encoded together; results are streamed once per batch
+BATCH_ENCODE_SIZE = int(os.environ.get('BATCH_ENCODE_SIZE', 512))
+# Query embeddings sent to the project per search call
+BATCH_SEARCH_SIZE = int(os.environ.get('BATCH_SEARCH_SIZE', 64))
+# Queries whose matches one LLM prompt scores
+BATCH_LLM_QUERIES = int(os.environ.get('BATCH_LLM_QUERIES', 4))
+# Upper bound on results per query
+BATCH_COMPARE_MAX_K = int(os.environ.get('BATCH_COMPARE_MAX_K', 100))
+
+OUTPUT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def _truthy(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def read_query_csv(file, query_column='query', id_column=None):
+    """
+    Reads the queries of an uploaded CSV file.
+
+    Args:
+        file: Uploaded file (a binary stream)
+        query_column (str): Column holding the query text
+        id_column (str): Optional column holding a caller-side id per query
+
+    Returns:
+        list: {'id', 'query'} dicts, rows with an empty query left out
+
+    Raises:
+        ValueError: If a named column is missing
+    """
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+    missing = [c for c in (query_column, id_column) if c and c not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"Columns {missing} not found in the CSV; it has {reader.fieldnames}")
+    return [
+        {'id': row[id_column] if id_column else None, 'query': row[query_column].strip()}
+        for row in reader if (row.get(query_column) or '').strip()
+    ]
+
+
+def _json_queries(values):
+    queries = []
+    for value in values:
+        if isinstance(value, str):
+            queries.append({'id': None, 'query': value.strip()})
+        elif isinstance(value, dict) and isinstance(value.get('query'), str):
+            queries.append({'id': value.get('id'), 'query': value['query'].strip()})
+        else:
+            raise ValueError("Each query must be a string or an object with a 'query' string")
+    return [q for q in queries if q['query']]
+
+
+def parse_batch_request(request):
+    """
+    Reads a batch compare request: a JSON body, or a form with a
+    'queries_file' CSV upload.
+
+    Returns:
+        dict: project_name, queries, k, refine, where, fields and format
+
+    Raises:
+        ValueError: If the request is incomplete or invalid
+    """
+    if request.is_json:
+        values = request.get_json(silent=True)
+        if not isinstance(values, dict):
+            raise ValueError("The JSON body must be an object")
+        if not isinstance(values.get('queries'), list):
+            raise ValueError("'queries' must be a list")
+        queries = _json_queries(values['queries'])
+        if isinstance(values.get('fields'), list):
+            values = {**values, 'fields': ','.join(values['fields'])}
+        if isinstance(values.get('where'), dict):
+            values = {**values, 'where': json.dumps(values['where'])}
+    else:
+        values = request.values
+        if 'queries_file' not in request.files:
+            raise ValueError("Send a JSON body with 'queries' or a 'queries_file' CSV upload")
+        queries = read_query_csv(request.files['queries_file'].stream,
+                                 (values.get('query_column') or 'query').strip(),
+                                 (values.get('id_column') or '').strip() or None)
+
+    project_name = (values.get('project_name') or '').strip()
+    if not project_name:
+        raise ValueError('Project name is required.')
+    if get_project_catalog().get_project(project_name) is None:
+        raise ValueError(f"Project '{project_name}' does not exist.")
+    if not queries:
+        raise ValueError('No queries given.')
+    if len(queries) > BATCH_COMPARE_MAX_QUERIES:
+        raise ValueError(f"At most {BATCH_COMPARE_MAX_QUERIES} queries per call, got {len(queries)}")
+    try:
+        k = int(values.get('k') or TOP_K)
+    except (TypeError, ValueError):
+        raise ValueError("'k' must be an integer")
+    if not 1 <= k <= BATCH_COMPARE_MAX_K:
+        raise ValueError(f"'k' must be between 1 and {BATCH_COMPARE_MAX_K}")
+    output_format = (values.get('format') or 'ndjson').strip().lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown format '{output_format}'. Use one of {list(OUTPUT_FORMATS)}.")
+    fields, error = parse_fields(values)
+    if error:
+        raise ValueError(error)
+    where, error = parse_compare_filter(values, project_name)
+    if error:
+        raise ValueError(error)
+
+    for index, query in enumerate(queries):
+        query['index'] = index
+    return {
+        'project_name': project_name,
+        'queries': queries,
+        'k': k,
+        'refine': _truthy(values.get('refine')),
+        'where': where,
+        'fields': fields,
+        'format': output_format,
+    }
+
+
+def encode_queries(texts):
+    # Imported here: the bulk encoder loads the model
+    from bulk_encoder import encode_bulk
+    return encode_bulk(texts).tolist()
+
+
+def refine_batch(queries, matches):
+    """
+    Refines the matches of several queries with batched LLM prompts.
+
+    Returns:
+        list: Per query, whether its matches were refined
+    """
+    refined = []
+    for start in range(0, len(queries), BATCH_LLM_QUERIES):
+        items = [(queries[i]['query'], matches[i]) for i in range(start, min(start + BATCH_LLM_QUERIES, len(queries)))]
+        for top_matches, scores in zip(matches[start:start + len(items)], calculate_semantic_similarity_batch(items)):
+            if scores is not None:
+                apply_refined_scores(top_matches, scores)
+            refined.append(scores is not None)
+    return refined
+
+
+def compare_batch(project_name, queries, k=TOP_K, where=None, refine=False):
+    """
+    Computes the matches of every query, one encoding batch at a time.
+
+    Args:
+        project_name (str): Project to search
+        queries (list): {'index', 'id', 'query'} dicts
+        k (int): Results per query
+        where (dict): Optional metadata filter
+        refine (bool): Refine the scores with the LLM
+
+    Yields:
+        tuple: (query, top_matches) in input order
+    """
+    project = get_project_catalog().get_project(project_name)
+    for start in range(0, len(queries), BATCH_ENCODE_SIZE):
+        batch = queries[start:start + BATCH_ENCODE_SIZE]
+        # Only refined results are cached, so unrefined calls neither read nor fill the cache
+        keys = [compare_cache_key(project, q['query'], k, where) for q in batch] if refine else [None] * len(batch)
+        results = [cached_result(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            embeddings = encode_queries([batch[i]['query'] for i in missing])
+            matches = []
+            for offset in range(0, len(missing), BATCH_SEARCH_SIZE):
+                matches.extend(search_project_batch(project_name, embeddings[offset:offset + BATCH_SEARCH_SIZE],
+                                                    k, where))
+            refined = refine_batch([batch[i] for i in missing], matches) if refine else [False] * len(missing)
+            for i, embedding, top_matches, was_refined in zip(missing, embeddings, matches, refined):
+                sort_matches(top_matches)
+                if was_refined:
+                    remember_result(keys[i], [embedding], top_matches, llm_refined=was_refined)
+                results[i] = top_matches
+        logging.info(f"Batch compare on '{project_name}': {start + len(batch)}/{len(queries)} queries, "
+                     f"{len(batch) - len(missing)} from cache")
+        yield from zip(batch, results)
+
+
+def ndjson_lines(results, fields):
+    for query, top_matches in results:
+        yield orjson.dumps({
+            'index': query['index'],
+            'id': query['id'],
+            'query': query['query'],
+            'top_matches': select_fields(top_matches, fields),
+        }, option=orjson.OPT_SERIALIZE_NUMPY) + b'\n'
+
+
+def _csv_columns(fields):
+    return [f for f in MATCH_FIELDS if fields is None or f in fields]
+
+
+def csv_lines(results, fields):
+    columns = _csv_columns(fields)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writerow(['query_index', 'query_id', 'query', 'rank'] + columns)
+    yield flush()
+    for query, top_matches in results:
+        for rank, match in enumerate(top_matches, start=1):
+            writer.writerow([query['index'], query['id'], query['query'], rank] + [
+                json.dumps(match.get(c)) if c == 'metadata' else match.get(c) for c in columns
+            ])
+        yield flush()
+
+
+def csv_error_line(message, fields):
+    """
+    Returns:
+        str: A trailing row reporting a failure: 'error' as the query index
+            and the message in the query column, the other columns empty
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(['error', '', message, ''] + [''] * len(_csv_columns(fields)))
+    return buffer.getvalue()
+
+
+def handle_batch_compare(request):
+    """
+    Endpoint handler for batch compare.
+
+    Returns:
+        Response: NDJSON (one line per query) or CSV (one row per match),
+            streamed as batches complete; a JSON error with status 400 if the
+            request is invalid. A failure while streaming ends the body with
+            an error line (NDJSON) or error row (CSV)
+    """
+    try:
+        batch = parse_batch_request(request)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    results = compare_batch(batch['project_name'], batch['queries'], batch['k'], batch['where'], batch['refine'])
+    lines = ndjson_lines if batch['format'] == 'ndjson' else csv_lines
+
+    def stream():
+        try:
+            yield from lines(results, batch['fields'])
+        except Exception as e:
+            # Headers are already sent: the failure can only be reported in the body
+            logging.exception(f"Batch compare on '{batch['project_name']}' failed: {e}")
+            if batch['format'] == 'ndjson':
+                yield orjson.dumps({'error': f'Batch compare failed: {e}'}) + b'\n'
+            else:
+                yield csv_error_line(f'Batch compare failed: {e}', batch['fields'])
+
+    return Response(stream(), mimetype=OUTPUT_FORMATS[batch['format']])
@@ -0,0 +1,167 @@
+# bulk_encoder.py
+# This module encodes large batches of documents for ingestion. Texts are
+# sorted by token length so padded batches hold texts of similar length,
+# batch sizes are picked from a memory budget instead of a fixed count, and
+# the embeddings are returned in the original order. On many-core hosts the
+# work can be spread over a sentence-transformers multi-process pool.
+# Encoding runs in the compute scheduler's bulk lane, behind query encodes,
+# in batches small enough that a query never waits long for one to end.
+
+import os
+import time
+import atexit
+import logging
+import threading
+import numpy as np
+from embeddings import get_embedding_model
+from compute_scheduler import get_compute_scheduler, deprioritise_processes
+
+# Activation memory one encode batch may use
+ENCODE_MEMORY_BUDGET_MB = float(os.environ.get('ENCODE_MEMORY_BUDGET_MB', 256))
+ENCODE_MAX_BATCH_SIZE = int(os.environ.get('ENCODE_MAX_BATCH_SIZE', 512))
+# Padded tokens (texts x longest text) of one in-process batch. A query
+# arriving mid-batch competes with it for the cores until it ends, so this
+# bounds the extra query latency an upload causes to one such batch; the
+# bulk lane's max_task_seconds in the metrics shows its length on the host.
+# Larger batches encode somewhat faster.
+BULK_BATCH_MAX_TOKENS = int(os.environ.get('BULK_BATCH_MAX_TOKENS', 4096))
+# Worker processes for bulk encoding; 0 encodes in the calling process
+ENCODE_PROCESSES = int(os.environ.get('ENCODE_PROCESSES', 0))
+# Smaller jobs are encoded in-process even when a pool is configured; starting and feeding it costs more
+ENCODE_POOL_MIN_DOCUMENTS = int(os.environ.get('ENCODE_POOL_MIN_DOCUMENTS', 5000))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _sequence_bytes(seq_len):
+    """
+    Rough peak activation memory of one sequence in a transformer layer,
+    float32: hidden states, the feed-forward expansion and the attention scores.
+    """
+    config = get_embedding_model()[0].auto_model.config
+    hidden = config.hidden_size
+    intermediate = getattr(config, 'intermediate_size', 4 * hidden)
+    heads = getattr(config, 'num_attention_heads', 12)
+    return 4 * seq_len * (4 * hidden + intermediate + heads * seq_len)
+
+
+def token_lengths(texts):
+    """
+    Returns:
+        list: Token count of every text, capped at the model's max sequence length
+    """
+    model = get_embedding_model()
+    encoded = model.tokenizer(list(texts), truncation=True, max_length=model.max_seq_length,
+                              return_length=True, return_attention_mask=False, return_token_type_ids=False)
+    return encoded['length']
+
+
+def plan_batches(lengths, budget_bytes=None, max_batch_size=ENCODE_MAX_BATCH_SIZE, max_tokens=None):
+    """
+    Groups texts, shortest first, into batches that fit the memory budget.
+    A batch is padded to its longest text, so its cost is size x that length.
+
+    Args:
+        lengths (list): Token length of every text
+        budget_bytes (float): Activation memory per batch
+        max_batch_size (int): Upper bound on texts per batch
+        max_tokens (int): Upper bound on padded tokens per batch, if any
+
+    Returns:
+        tuple: (order, batches) - order sorts the texts by length, batches are
+            (start, end) slices of that order
+    """
+    budget_bytes = budget_bytes or ENCODE_MEMORY_BUDGET_MB * 1024 * 1024
+    order = np.argsort(np.asarray(lengths), kind='stable')
+    batches = []
+    start = 0
+    while start < len(order):
+        end = start + 1
+        while end < len(order) and end - start < max_batch_size:
+            # Sorted ascending, so the candidate text is the longest of the batch
+            if (end + 1 - start) * _sequence_bytes(lengths[order[end]]) > budget_bytes:
+                break
+            if max_tokens and (end + 1 - start) * lengths[order[end]] > max_tokens:
+                break
+            end += 1
+        batches.append((start, end))
+        start = end
+    return order, batches
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = get_embedding_model().start_multi_process_pool(target_devices=['cpu'] * ENCODE_PROCESSES)
+                # The pool is bulk work: let query encoding in the web workers win contended cores
+                deprioritise_processes([p.pid for p in _pool['processes']])
+                atexit.register(stop_pool)
+    return _pool
+
+
+def stop_pool():
+    """
+    Stops the encoding worker processes, if they were started.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            get_embedding_model().stop_multi_process_pool(_pool)
+            _pool = None
+
+
+def encode_bulk(texts):
+    """
+    Encodes texts for ingestion, in length-sorted, memory-budgeted batches.
+    In-process batches run in the scheduler's bulk lane, one at a time,
+    held back while queries are being encoded and capped at
+    BULK_BATCH_MAX_TOKENS so a running one ends soon. Throughput is logged as docs/sec.
+
+    Args:
+        texts (list): Texts to encode
+
+    Returns:
+        np.ndarray: One embedding row per text, in the input order
+    """
+    model = get_embedding_model()
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+    started = time.perf_counter()
+    lengths = token_lengths(texts)
+    use_pool = ENCODE_PROCESSES > 1 and len(texts) >= ENCODE_POOL_MIN_DOCUMENTS
+    # Pool processes are niced and do not hold up queries, so their batches need no token cap
+    order, batches = plan_batches(lengths, max_tokens=None if use_pool else BULK_BATCH_MAX_TOKENS)
+    sorted_texts = [texts[i] for i in order]
+
+    if use_pool:
+        # The pool takes one batch size; use the one planned for the typical text
+        batch_size = int(np.median([end - start for start, end in batches]))
+        sorted_embeddings = model.encode_multi_process(sorted_texts, _get_pool(), batch_size=max(1, batch_size))
+    else:
+        scheduler = get_compute_scheduler()
+        parts = []
+        for start, end in batches:
+            with scheduler.bulk():
+                parts.append(model.encode(sorted_texts[start:end], batch_size=end - start,
+                                          convert_to_numpy=True, show_progress_bar=False))
+        sorted_embeddings = np.vstack(parts)
+
+    embeddings = np.empty_like(sorted_embeddings)
+    embeddings[order] = sorted_embeddings
+
+    elapsed = time.perf_counter() - started
+    logging.info(
+        f"Encoded {len(texts)} documents in {elapsed:.2f}s ({len(texts) / max(elapsed, 1e-9):.1f} docs/sec)",
+        extra={
+            "documents": len(texts),
+            "batches": len(batches),
+            "processes": ENCODE_PROCESSES if use_pool else 1,
+            "docs_per_sec": round(len(texts) / max(elapsed, 1e-9), 1),
+        }
+    )
+    return embeddings
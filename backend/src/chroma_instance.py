@@ -1,18 +1,210 @@
 import os
-from chromadb.config import Settings
+import re
+import time
+import threading
+
+# Get the directory where this script is located
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(SCRIPT_DIR, "database")
+
+# The cached collection list is re-read after this many seconds, so collections
+# created or deleted by another worker process are picked up
+COLLECTION_CACHE_TTL = float(os.environ.get('CHROMA_COLLECTION_CACHE_TTL', 30))
+# Number of ids checked per round trip when looking up which candidates already exist
+ID_LOOKUP_BATCH_SIZE = int(os.environ.get('CHROMA_ID_LOOKUP_BATCH_SIZE', 1000))
+
+# Suffixes of collections that belong to a project without being one: extra
+# shards, and the temporary copies used to rebuild or measure an index.
+# Scratch copies also carry a random id, so concurrent measurements do not collide.
+SHARD_SUFFIX = '__shard'
+REBUILD_SUFFIX = '__rebuild'
+SCRATCH_SUFFIX = '__scratch'
+SCRATCH_ID_LENGTH = 8
+_INTERNAL_COLLECTION = re.compile(
+    rf'({re.escape(SHARD_SUFFIX)}\d+|{re.escape(REBUILD_SUFFIX)}|{re.escape(SCRATCH_SUFFIX)}[0-9a-f]*)$'
+)
+_OWNED_SUFFIXES = re.compile(
+    rf'({re.escape(SHARD_SUFFIX)}\d+)?({re.escape(REBUILD_SUFFIX)}|{re.escape(SCRATCH_SUFFIX)}[0-9a-f]*)?$'
+)
+# Chroma accepts names of up to 63 characters; project names leave room for
+# the longest suffix added to them, '__shard<NN>__rebuild'
+MAX_PROJECT_NAME_LENGTH = 63 - len(f"{SHARD_SUFFIX}00{REBUILD_SUFFIX}")
+
+
+def is_internal_collection(name):
+    """
+    Returns:
+        bool: True for shard and temporary collections, which are not projects of their own
+    """
+    return bool(_INTERNAL_COLLECTION.search(name))
+
+
+def owning_project(name):
+    """
+    Returns:
+        str: The project a collection belongs to: the name without its shard,
+            rebuild or scratch suffix
+    """
+    return _OWNED_SUFFIXES.sub('', name, count=1)
+
+
+def validate_project_name(name):
+    """
+    Raises:
+        ValueError: If name cannot be used for a new project: it would be
+            taken for a shard or temporary collection, or is too long to
+            carry their suffixes
+    """
+    if is_internal_collection(name):
+        raise ValueError(f"Project name '{name}' ends with a reserved suffix "
+                         f"({SHARD_SUFFIX}<n>, {REBUILD_SUFFIX}, {SCRATCH_SUFFIX}).")
+    if len(name) > MAX_PROJECT_NAME_LENGTH:
+        raise ValueError(f"Project name '{name}' is longer than {MAX_PROJECT_NAME_LENGTH} characters.")
+
 
 class ChromaClient:
+    """
+    Process-wide data-access layer over the Chroma PersistentClient.
+    Collection handles and the collection name list are cached, so routes
+    go straight to query instead of making metadata round trips to the
+    SQLite-backed store on every request. Creating or deleting a collection
+    through this class updates the cache; all access is thread-safe.
+    Client methods not defined here are passed through to PersistentClient.
+    """
     _instance = None
+    _instance_lock = threading.Lock()
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
-            from chromadb import PersistentClient
-            # Get the directory where this script is located
-            SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-            DB_PATH = os.path.join(SCRIPT_DIR, "database")
-            cls._instance = PersistentClient(path=DB_PATH, settings=Settings(anonymized_telemetry=False), *args, **kwargs)
+            with cls._instance_lock:
+                if cls._instance is None:
+                    from chromadb import PersistentClient
+                    from chromadb.config import Settings
+                    instance = super().__new__(cls)
+                    instance.client = PersistentClient(path=DB_PATH, settings=Settings(anonymized_telemetry=False), *args, **kwargs)
+                    instance._lock = threading.RLock()
+                    instance._collections = {}
+                    instance._names = None
+                    instance._names_loaded_at = 0.0
+                    cls._instance = instance
         return cls._instance
 
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _load_names(self):
+        # Caller holds self._lock
+        collections = self.client.list_collections()
+        self._names = {c.name for c in collections}
+        self._names_loaded_at = time.monotonic()
+        # Drop handles of collections that no longer exist
+        for name in list(self._collections):
+            if name not in self._names:
+                del self._collections[name]
+        return collections
+
+    def list_collection_names(self):
+        """
+        Returns:
+            list: Names of all collections, from cache when fresh
+        """
+        with self._lock:
+            if self._names is None or time.monotonic() - self._names_loaded_at > COLLECTION_CACHE_TTL:
+                self._load_names()
+            return sorted(self._names)
+
+    def list_collections(self):
+        """
+        Lists collection objects from the store and refreshes the name cache.
+        """
+        with self._lock:
+            return self._load_names()
+
+    def has_collection(self, name):
+        with self._lock:
+            if name in self.list_collection_names():
+                return True
+            # Not in the cache: re-read, another worker process may have created it
+            self._load_names()
+            return name in self._names
+
+    def get_collection(self, name):
+        """
+        Returns a cached collection handle, fetching it on first use.
+        """
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                collection = self.client.get_collection(name=name)
+                self._collections[name] = collection
+                if self._names is not None:
+                    self._names.add(name)
+            return collection
+
+    def create_collection(self, name, **kwargs):
+        with self._lock:
+            collection = self.client.create_collection(name=name, **kwargs)
+            self._collections[name] = collection
+            if self._names is not None:
+                self._names.add(name)
+            return collection
+
+    def delete_collection(self, name):
+        with self._lock:
+            try:
+                self.client.delete_collection(name=name)
+            finally:
+                self.invalidate(name)
+
+    def invalidate(self, name=None):
+        """
+        Drops cached state for one collection, or everything when name is None.
+        Used when a cached handle turns out to be stale.
+        """
+        with self._lock:
+            if name is None:
+                self._collections.clear()
+                self._names = None
+                return
+            self._collections.pop(name, None)
+            if self._names is not None:
+                self._names.discard(name)
+
+    @classmethod
+    def reset(cls):
+        """
+        Drops the process-wide client so the next call opens a fresh one.
+        Used after fork: the native handles of a client opened in the parent
+        process must not be used by its children.
+        """
+        cls._instance = None
+        try:
+            from chromadb.api.shared_system_client import SharedSystemClient
+            SharedSystemClient.clear_system_cache()
+        except ImportError:
+            pass
+
 
 def get_chroma_client():
-    return ChromaClient()
\ No newline at end of file
+    return ChromaClient()
+
+
+def find_existing_ids(collection, candidate_ids, batch_size=ID_LOOKUP_BATCH_SIZE):
+    """
+    Returns which of the candidate ids are already stored in a collection.
+    Ids are looked up in bounded batches without fetching documents or
+    embeddings, so the cost scales with the candidates, not the collection.
+
+    Args:
+        collection: The Chroma collection
+        candidate_ids (list): Ids about to be added
+        batch_size (int): Ids per lookup
+
+    Returns:
+        set: The candidate ids that already exist
+    """
+    existing = set()
+    for start in range(0, len(candidate_ids), batch_size):
+        batch = candidate_ids[start:start + batch_size]
+        existing.update(collection.get(ids=batch, include=[])['ids'])
+    return existing
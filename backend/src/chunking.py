@@ -0,0 +1,157 @@
+# chunking.py
+# This module splits long documents into token-budgeted windows before they
+# are embedded. MiniLM only sees its first max_seq_length tokens, so encoding
+# a long text whole pays for tokenizing all of it and embeds only the start.
+# Each window is stored as its own vector linked to the parent document; a
+# query over a chunked project returns the best window per parent. The link
+# lives in metadata keys under CHUNK_METADATA_PREFIX, which project schemas
+# may not use and compare strips from the metadata it returns.
+
+import os
+from embeddings import get_embedding_model
+
+# Tokens per window; 0 means the model's max sequence length minus [CLS]/[SEP]
+CHUNK_MAX_TOKENS = int(os.environ.get('CHUNK_MAX_TOKENS', 0))
+# Tokens shared by consecutive windows, so a sentence cut at a border is seen whole once
+CHUNK_OVERLAP_TOKENS = int(os.environ.get('CHUNK_OVERLAP_TOKENS', 32))
+# Extra results fetched per requested match on chunked projects, before keeping one window per parent
+CHUNK_QUERY_OVERSAMPLE = int(os.environ.get('CHUNK_QUERY_OVERSAMPLE', 4))
+
+# Separates the parent id from the window number in window ids; window 0 keeps the parent id
+WINDOW_ID_SEPARATOR = '#'
+
+# Prefix of the metadata keys linking a window to its parent, reserved for them
+CHUNK_METADATA_PREFIX = '_chunk_'
+CHUNK_PARENT_KEY = CHUNK_METADATA_PREFIX + 'parent_id'
+CHUNK_INDEX_KEY = CHUNK_METADATA_PREFIX + 'index'
+CHUNK_COUNT_KEY = CHUNK_METADATA_PREFIX + 'count'
+
+
+def window_budget():
+    """
+    Returns:
+        int: Maximum number of text tokens per window
+    """
+    if CHUNK_MAX_TOKENS > 0:
+        return CHUNK_MAX_TOKENS
+    return get_embedding_model().max_seq_length - 2
+
+
+def split_text(texts, max_tokens=None, overlap=CHUNK_OVERLAP_TOKENS):
+    """
+    Splits texts into windows of at most max_tokens tokens using the model's
+    fast tokenizer. The whole batch is tokenized in one call and windows are
+    cut from the character offsets, so texts are never decoded back from ids.
+
+    Args:
+        texts (list): Texts to split
+        max_tokens (int): Tokens per window, defaults to window_budget()
+        overlap (int): Tokens shared by consecutive windows
+
+    Returns:
+        list: One list of window texts per input text
+    """
+    if not texts:
+        return []
+    max_tokens = max_tokens or window_budget()
+    stride = max(1, max_tokens - max(0, overlap))
+    tokenizer = get_embedding_model().tokenizer
+    encoded = tokenizer(list(texts), add_special_tokens=False, return_offsets_mapping=True,
+                        return_attention_mask=False, return_token_type_ids=False)
+
+    windows = []
+    for text, offsets in zip(texts, encoded['offset_mapping']):
+        if len(offsets) <= max_tokens:
+            windows.append([text])
+            continue
+        parts = []
+        for start in range(0, len(offsets), stride):
+            end = min(start + max_tokens, len(offsets))
+            parts.append(text[offsets[start][0]:offsets[end - 1][1]])
+            if end == len(offsets):
+                break
+        windows.append(parts)
+    return windows
+
+
+def window_id(parent_id, index):
+    return parent_id if index == 0 else f"{parent_id}{WINDOW_ID_SEPARATOR}{index}"
+
+
+def split_documents(ids, documents, metadatas, max_tokens=None, overlap=CHUNK_OVERLAP_TOKENS):
+    """
+    Expands documents into window records ready for collection.add/upsert.
+    Every window carries its parent's metadata; windows of a document split
+    in several also carry CHUNK_PARENT_KEY, CHUNK_INDEX_KEY and
+    CHUNK_COUNT_KEY, while a document that fits one window is stored as is.
+    The first window keeps the parent id, so existence checks on parent ids
+    keep working.
+
+    Args:
+        ids (list): Parent ids
+        documents (list): Parent texts
+        metadatas (list): Parent metadata dicts
+        max_tokens (int): Tokens per window, defaults to window_budget()
+        overlap (int): Tokens shared by consecutive windows
+
+    Returns:
+        tuple: (window_ids, window_documents, window_metadatas, chunked) -
+            chunked is True if any document needed more than one window
+    """
+    window_ids, window_documents, window_metadatas = [], [], []
+    chunked = False
+    for parent_id, parts, metadata in zip(ids, split_text(documents, max_tokens, overlap), metadatas):
+        chunked = chunked or len(parts) > 1
+        for index, part in enumerate(parts):
+            window_ids.append(window_id(parent_id, index))
+            window_documents.append(part)
+            if len(parts) > 1:
+                window_metadatas.append({**metadata, CHUNK_PARENT_KEY: parent_id, CHUNK_INDEX_KEY: index,
+                                         CHUNK_COUNT_KEY: len(parts)})
+            else:
+                window_metadatas.append(metadata)
+    return window_ids, window_documents, window_metadatas, chunked
+
+
+def parent_of(record_id, metadata):
+    """
+    Returns:
+        str: The parent document id of a stored record
+    """
+    return (metadata or {}).get(CHUNK_PARENT_KEY) or record_id
+
+
+def strip_chunk_metadata(metadata):
+    """
+    Returns:
+        dict: The metadata without the window keys, as it was given at ingestion
+    """
+    if not metadata:
+        return metadata
+    return {k: v for k, v in metadata.items() if not k.startswith(CHUNK_METADATA_PREFIX)}
+
+
+def best_window_per_parent(results, n_results):
+    """
+    Keeps the closest window of every parent in a single-query Chroma result.
+    Results come ordered by distance, so the first window seen per parent is its best.
+
+    Args:
+        results (dict): Chroma query result for one query embedding
+        n_results (int): Number of parents to keep
+
+    Returns:
+        list: Indexes into the result lists, at most n_results of them
+    """
+    ids = results['ids'][0]
+    metadatas = results['metadatas'][0] if results.get('metadatas') else None
+    seen, keep = set(), []
+    for i, record_id in enumerate(ids):
+        parent = parent_of(record_id, metadatas[i] if metadatas else None)
+        if parent in seen:
+            continue
+        seen.add(parent)
+        keep.append(i)
+        if len(keep) == n_results:
+            break
+    return keep
@@ -4,97 +4,343 @@ import hashlib
 import os
 import re
 from flask import request, jsonify
-from chroma_instance import get_chroma_client
-from sentence_transformers import SentenceTransformer
-from llm import calculate_semantic_similarity
+from embeddings import get_embedding_model
+from executors import run_inference, run_io
+from compute_scheduler import get_compute_scheduler
+from responses import json_response, parse_fields, select_fields
+from llm import calculate_semantic_similarity, calculate_semantic_similarity_async
+from project_catalog import get_project_catalog
+from project_schema import parse_where
+from chunking import best_window_per_parent, parent_of, strip_chunk_metadata, CHUNK_QUERY_OVERSAMPLE
+from search_engines import query_project
+from result_cache import get_result_cache, get_semantic_cache, compare_cache_key
+from single_flight import get_single_flight, get_async_single_flight
 
-# Get the directory where this script is located
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-MODEL_PATH = os.path.join(SCRIPT_DIR, "models", "all-MiniLM-L6-v2")
-
-model = SentenceTransformer(MODEL_PATH)
+TOP_K = 5
 
 def make_id(text):
     return hashlib.md5(text.encode('utf-8')).hexdigest()
 
+def validate_compare_form(form):
+    """
+    Checks the required compare fields.
+
+    Returns:
+        str: Error message, or None if the form is valid
+    """
+    if 'query' not in form:
+        return 'New inquiry is required.'
+    if 'project_name' not in form:
+        return 'Project name is required.'
+    return None
+
+def parse_compare_filter(form, project_name):
+    """
+    Reads the optional `where` metadata filter, checked against the project schema.
+
+    Returns:
+        tuple: (where, error) - where is None when no filter was given
+    """
+    if not form.get('where'):
+        return None, None
+    project = get_project_catalog().get_project(project_name)
+    schema = project['settings'].get('schema') if project else None
+    try:
+        return parse_where(form['where'], schema), None
+    except ValueError as e:
+        return None, str(e)
+
+def result_key(project_name, query, where=None, k=TOP_K):
+    """
+    Returns:
+        tuple: Result cache key of a compare call, or None if the project does not exist
+    """
+    project = get_project_catalog().get_project(project_name)
+    return compare_cache_key(project, query, k, where) if project else None
+
+def cached_result(key):
+    """
+    Returns:
+        list: The cached matches of the same query, or None on a miss
+    """
+    return get_result_cache().get(key) if key else None
+
+def similar_result(key, query_embedding):
+    """
+    Returns:
+        list: The cached matches of a near-duplicate query, or None on a miss
+    """
+    return get_semantic_cache().get(key[:-1], query_embedding[0]) if key else None
+
+def remember_result(key, query_embedding, top_matches, llm_refined):
+    # key[:-1] is the search context shared by every query of the call's project, k and filter
+    get_result_cache().put(key, top_matches)
+    get_semantic_cache().put(key[:-1], query_embedding[0], top_matches, llm_refined=llm_refined)
+
+def encode_query(query):
+    # Interactive lane: bulk ingestion batches pause while this runs
+    with get_compute_scheduler().interactive():
+        return get_embedding_model().encode([query]).tolist()
+
+class EncodeError(Exception):
+    """
+    Raised by compute_matches when the query cannot be encoded.
+    """
+
+def search_project(project_name, query_embedding, n_results=TOP_K, where=None):
+    """
+    Queries a project with its search engine and returns the initial MiniLM
+    matches, optionally restricted by a metadata filter. On chunked projects
+    the best window of each parent document is returned, under the parent id.
+    """
+    return search_project_batch(project_name, query_embedding, n_results, where)[0]
+
+def search_project_batch(project_name, query_embeddings, n_results=TOP_K, where=None):
+    """
+    search_project for several query embeddings, answered by one query to the project.
+
+    Returns:
+        list: The matches of each query embedding, in order
+    """
+    project = get_project_catalog().get_project(project_name)
+    chunked = bool(project and project['settings'].get('chunked'))
+    n_fetch = n_results * CHUNK_QUERY_OVERSAMPLE if chunked else n_results
+
+    results = query_project(project_name, query_embeddings, n_fetch, where, project=project)
+
+    all_matches = []
+    for q in range(len(results["ids"])):
+        # The result of query q alone, in the single-query shape the chunk helpers read
+        result = {field: [results[field][q]] if results.get(field) is not None else None
+                  for field in ('ids', 'documents', 'metadatas', 'distances')}
+        ids = result["ids"][0]
+        metadatas = result["metadatas"][0] if result["metadatas"] else None
+        keep = best_window_per_parent(result, n_results) if chunked else range(len(ids))
+        all_matches.append([
+            {
+                'id': parent_of(ids[i], metadatas[i] if metadatas else None) if ids else None,
+                'content': result["documents"][0][i],
+                'metadata': strip_chunk_metadata(metadatas[i]) if metadatas else None,
+                'match': result["distances"][0][i],
+                'project_name': project_name
+            }
+            for i in keep
+        ])
+    return all_matches
+
+def apply_refined_scores(top_matches, refined_scores):
+    """
+    Combines MiniLM and LLM scores (weighted average: 40% MiniLM, 60% LLM).
+    """
+    for match in top_matches:
+        content = match.get('content', '')
+        if content in refined_scores:
+            miniLM_score = match['match']
+            llm_score = refined_scores[content]
+            # Weighted combination for better accuracy
+            combined_score = (miniLM_score * 0.4) + (llm_score * 0.6)
+            match['match'] = combined_score
+            logging.debug(f"Combined score: MiniLM={miniLM_score:.2f}, LLM={llm_score:.2f}, Final={combined_score:.2f}")
+
+def sort_matches(top_matches):
+    # Sort top_matches by match score in descending order (highest similarity first)
+    top_matches.sort(key=lambda x: x['match'] if x['match'] is not None else 0, reverse=True)
+
+def store_result(results_dict, results_lock, request_id, result):
+    with results_lock:
+        results_dict[request_id] = result
+
+def compute_matches(project_name, query, where, cache_key):
+    """
+    Encodes the query, then reuses the result of a near-duplicate query or
+    searches the project and refines the matches with the LLM. Refined
+    results are remembered under cache_key.
+
+    Returns:
+        list: The matches, best first
+
+    Raises:
+        EncodeError: If the query cannot be encoded
+    """
+    try:
+        query_embedding = encode_query(query)
+    except Exception as encode_error:
+        raise EncodeError(str(encode_error)) from encode_error
+    # A reworded repeat of a recent query reuses its result
+    top_matches = similar_result(cache_key, query_embedding)
+    if top_matches is not None:
+        return top_matches
+
+    # Initial matches from MiniLM
+    top_matches = search_project(project_name, query_embedding, where=where)
+
+    # Use LLM to refine similarity percentages for more accuracy
+    refined_scores = calculate_semantic_similarity(query, top_matches)
+    refined = refined_scores is not None
+    if refined:
+        apply_refined_scores(top_matches, refined_scores)
+        logging.info("Successfully refined similarity scores with LLM")
+    # Otherwise the original MiniLM scores are kept
+
+    sort_matches(top_matches)
+    # Results without LLM refinement are not cached, so the next call tries again
+    if cache_key and refined:
+        remember_result(cache_key, query_embedding, top_matches, llm_refined=refined)
+    return top_matches
+
+async def compute_matches_async(project_name, query, where, cache_key):
+    """
+    Async counterpart of compute_matches.
+    """
+    try:
+        query_embedding = await run_inference(encode_query, query)
+    except Exception as encode_error:
+        raise EncodeError(str(encode_error)) from encode_error
+    top_matches = similar_result(cache_key, query_embedding)
+    if top_matches is not None:
+        return top_matches
+
+    # Initial matches from MiniLM
+    top_matches = await run_io(search_project, project_name, query_embedding, TOP_K, where)
+
+    # Use LLM to refine similarity percentages for more accuracy
+    refined_scores = await calculate_semantic_similarity_async(query, top_matches)
+    refined = refined_scores is not None
+    if refined:
+        apply_refined_scores(top_matches, refined_scores)
+        logging.info("Successfully refined similarity scores with LLM")
+    # Otherwise the original MiniLM scores are kept
+
+    sort_matches(top_matches)
+    if cache_key and refined:
+        remember_result(cache_key, query_embedding, top_matches, llm_refined=refined)
+    return top_matches
+
 def handle_compare(request, _, results_dict, results_lock):
     user_id = request.form.get('user_id', 'anonymous')
     logging.info(f"User {user_id}: compare_query called")
 
-    if 'query' not in request.form:
-        return jsonify({'error': 'New inquiry is required.'}), 400
+    error = validate_compare_form(request.form)
+    if error:
+        return jsonify({'error': error}), 400
+
+    # Optional selector, e.g. fields=id,match,project_name to leave out content and metadata
+    fields, error = parse_fields(request.values)
+    if error:
+        return jsonify({'error': error}), 400
 
-    if 'project_name' not in request.form:
-        return jsonify({'error': 'Project name is required.'}), 400
-    
     project_name = request.form['project_name'].strip()
     query = request.form['query']
     request_id = str(uuid.uuid4())
 
-    try:
-        client = get_chroma_client()
-        collection = client.get_collection(name=project_name)
+    # Optional metadata filter, e.g. where={"category": "shoes"}
+    where, error = parse_compare_filter(request.form, project_name)
+    if error:
+        return jsonify({'error': error}), 400
 
-        try:
-            query_embedding = model.encode([query]).tolist()
-        except Exception as encode_error:
-            print(f"embedding error {encode_error}")
-            return jsonify({'error':'encode error'}),500
-            
+    # Keyed by the write version read before searching: a write made meanwhile leaves the result under a stale key
+    cache_key = result_key(project_name, query, where)
+    top_matches = cached_result(cache_key)
 
-        results = collection.query(query_embeddings=query_embedding, n_results=5)
+    try:
+        if top_matches is None:
+            try:
+                if cache_key:
+                    # Identical calls arriving while this one runs wait for its result
+                    top_matches = get_single_flight().do(
+                        cache_key, compute_matches, project_name, query, where, cache_key)
+                else:
+                    top_matches = compute_matches(project_name, query, where, cache_key)
+            except EncodeError as encode_error:
+                print(f"embedding error {encode_error}")
+                return jsonify({'error':'encode error'}),500
+        top_matches = select_fields(top_matches, fields)
 
-        # Initial matches from MiniLM
-        top_matches = [
-            {
-                'id': results["ids"][0][i] if results["ids"][0] else None,
-                'content': text,
-                'metadata': results["metadatas"][0][i] if results["metadatas"][0] else None,
-                'match':  dist,
-                'project_name': project_name
-            }
-            for i, (text, dist) in enumerate(zip(results["documents"][0], results["distances"][0]))
-        ]
-
-        # Use LLM to refine similarity percentages for more accuracy
-        try:
-            refined_scores = calculate_semantic_similarity(query, top_matches)
-            # Combine MiniLM and LLM scores (weighted average: 40% MiniLM, 60% LLM)
-            for match in top_matches:
-                content = match.get('content', '')
-                if content in refined_scores:
-                    miniLM_score = match['match']
-                    llm_score = refined_scores[content]
-                    # Weighted combination for better accuracy
-                    combined_score = (miniLM_score * 0.4) + (llm_score * 0.6)
-                    match['match'] = combined_score
-                    logging.debug(f"Combined score: MiniLM={miniLM_score:.2f}, LLM={llm_score:.2f}, Final={combined_score:.2f}")
-            logging.info("Successfully refined similarity scores with LLM")
-        except Exception as llm_error:
-            logging.warning(f"LLM refinement failed, using MiniLM scores: {llm_error}")
-            # Keep original MiniLM scores if LLM fails
-
-        # Sort top_matches by match score in descending order (highest similarity first)
-        top_matches.sort(key=lambda x: x['match'] if x['match'] is not None else 0, reverse=True)
-
-        with results_lock:
-            results_dict[request_id] = {
-                'status': 'completed',
-                'top_matches': top_matches
-            }
+        store_result(results_dict, results_lock, request_id, {
+            'status': 'completed',
+            'top_matches': top_matches
+        })
 
-        return jsonify({
+        return json_response({
             'request_id': request_id,
             'status': 'completed',
             'top_matches': top_matches,
             'project_name': project_name,
-        }), 200
+        }, 200)
 
     except Exception as e:
         logging.exception(f"Error processing compare_query: {e}")
-        with results_lock:
-            results_dict[request_id] = {
-                'status': 'failed',
-                'error': str(e)
-            }
+        store_result(results_dict, results_lock, request_id, {
+            'status': 'failed',
+            'error': str(e)
+        })
         return jsonify({'error': 'Invalid CSV format or internal error.'}), 400
+
+async def handle_compare_async(form, results_dict, results_lock):
+    """
+    Async counterpart of handle_compare used by the ASGI server.
+    Encoding runs on the bounded inference pool, vector-store and results
+    I/O on the I/O pool, and the LLM call is awaited without holding a thread.
+
+    Args:
+        form: The parsed request form and query arguments
+        results_dict: Shared results store
+        results_lock: Lock guarding results_dict
+
+    Returns:
+        tuple: (response_dict, http_status_code)
+    """
+    user_id = form.get('user_id', 'anonymous')
+    logging.info(f"User {user_id}: compare_query called")
+
+    error = validate_compare_form(form)
+    if error:
+        return {'error': error}, 400
+
+    fields, error = parse_fields(form)
+    if error:
+        return {'error': error}, 400
+
+    project_name = form['project_name'].strip()
+    query = form['query']
+    request_id = str(uuid.uuid4())
+
+    where, error = await run_io(parse_compare_filter, form, project_name)
+    if error:
+        return {'error': error}, 400
+
+    cache_key = await run_io(result_key, project_name, query, where)
+    top_matches = cached_result(cache_key)
+
+    try:
+        if top_matches is None:
+            try:
+                if cache_key:
+                    top_matches = await get_async_single_flight().do(
+                        cache_key, compute_matches_async, project_name, query, where, cache_key)
+                else:
+                    top_matches = await compute_matches_async(project_name, query, where, cache_key)
+            except EncodeError as encode_error:
+                logging.error(f"embedding error {encode_error}")
+                return {'error': 'encode error'}, 500
+        top_matches = select_fields(top_matches, fields)
+
+        await run_io(store_result, results_dict, results_lock, request_id, {
+            'status': 'completed',
+            'top_matches': top_matches
+        })
+
+        return {
+            'request_id': request_id,
+            'status': 'completed',
+            'top_matches': top_matches,
+            'project_name': project_name,
+        }, 200
+
+    except Exception as e:
+        logging.exception(f"Error processing compare_query: {e}")
+        await run_io(store_result, results_dict, results_lock, request_id, {
+            'status': 'failed',
+            'error': str(e)
+        })
+        return {'error': 'Invalid CSV format or internal error.'}, 400
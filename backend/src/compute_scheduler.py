@@ -0,0 +1,227 @@
+# compute_scheduler.py
+# This module partitions the CPU between interactive query encoding and bulk
+# ingestion encoding within a process. Both lanes share the torch thread
+# count capped once per process at startup (configure_torch_threads); torch's
+# thread setting is process-global, so changing it per batch would also
+# throttle the interactive encodes running at the same time. Priority comes
+# from scheduling instead: interactive encodes run at once, bulk batches run
+# BULK_CONCURRENCY at a time and do not start while interactive encodes are
+# in flight. A batch that has started is not interrupted, so a query
+# arriving meanwhile shares the cores with it until it ends; bulk_encoder
+# caps in-process batches at BULK_BATCH_MAX_TOKENS padded tokens to bound
+# that wait (the bulk lane's max_task_seconds shows what it is on the host).
+# Full isolation comes from encoding bulk work in separate, lower-priority
+# processes (ENCODE_PROCESSES). Both lanes report their utilisation.
+
+import os
+import time
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+from executors import INFERENCE_WORKERS
+
+# Bulk batches allowed to run at the same time across all ingestions in the process
+BULK_CONCURRENCY = int(os.environ.get('BULK_CONCURRENCY', 1))
+# Bulk work resumes only after interactive encodes have been idle this long
+BULK_RESUME_DELAY_SECONDS = float(os.environ.get('BULK_RESUME_DELAY_SECONDS', 0.05))
+# Longest a bulk batch waits for interactive load to stop, so ingestion cannot starve
+BULK_MAX_PAUSE_SECONDS = float(os.environ.get('BULK_MAX_PAUSE_SECONDS', 2.0))
+# Niceness applied to bulk encoding worker processes
+BULK_PROCESS_NICE = int(os.environ.get('BULK_PROCESS_NICE', 10))
+# Length of the window utilisation is measured over
+UTILISATION_WINDOW_SECONDS = float(os.environ.get('COMPUTE_UTILISATION_WINDOW_SECONDS', 60))
+
+
+class ComputeLane:
+    """
+    Tracks the work done in one lane: tasks in flight, tasks completed,
+    and busy time as a share of the lane's capacity over the last window.
+    """
+    def __init__(self, name, slots):
+        """
+        Args:
+            name (str): Lane name used in stats
+            slots (int): Tasks the lane can run at once, the capacity utilisation is measured against
+        """
+        self.name = name
+        self.slots = max(1, slots)
+        self.active = 0
+        self.completed = 0
+        self.paused_seconds = 0.0
+        self.max_task_seconds = 0.0
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_busy = 0.0
+        self._last_utilisation = 0.0
+        self._task_starts = {}
+        self._tokens = itertools.count()
+
+    def _roll_window(self, now):
+        # Caller holds self._lock
+        elapsed = now - self._window_start
+        if elapsed >= UTILISATION_WINDOW_SECONDS:
+            # Tasks still running count up to the window end and continue in the next one
+            busy = self._window_busy + sum(now - max(s, self._window_start) for s in self._task_starts.values())
+            self._last_utilisation = min(1.0, busy / (elapsed * self.slots))
+            self._window_start = now
+            self._window_busy = 0.0
+
+    def begin(self):
+        """
+        Returns:
+            int: Token to pass to end()
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._roll_window(now)
+            self.active += 1
+            token = next(self._tokens)
+            self._task_starts[token] = now
+        return token
+
+    def end(self, token):
+        now = time.monotonic()
+        with self._lock:
+            self._roll_window(now)
+            started = self._task_starts.pop(token)
+            self._window_busy += now - max(started, self._window_start)
+            self.max_task_seconds = max(self.max_task_seconds, now - started)
+            self.active -= 1
+            self.completed += 1
+
+    def record_pause(self, seconds):
+        with self._lock:
+            self.paused_seconds += seconds
+
+    def stats(self):
+        """
+        Returns:
+            dict: Current and last-window utilisation of the lane, and its longest task
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._roll_window(now)
+            elapsed = max(now - self._window_start, 1e-9)
+            busy = self._window_busy + sum(now - max(s, self._window_start) for s in self._task_starts.values())
+            return {
+                'active': self.active,
+                'slots': self.slots,
+                'completed': self.completed,
+                'utilisation': round(min(1.0, busy / (elapsed * self.slots)), 3),
+                'last_window_utilisation': round(self._last_utilisation, 3),
+                'paused_seconds': round(self.paused_seconds, 3),
+                'max_task_seconds': round(self.max_task_seconds, 3),
+            }
+
+
+class ComputeScheduler:
+    """
+    Gives interactive encodes priority over bulk encodes in this process.
+    """
+    def __init__(self, interactive_slots=1):
+        """
+        Args:
+            interactive_slots (int): Interactive encodes expected to run at once,
+                used as the capacity of the interactive lane
+        """
+        self.interactive_lane = ComputeLane('interactive', interactive_slots)
+        self.bulk_lane = ComputeLane('bulk', BULK_CONCURRENCY)
+        self._bulk_semaphore = threading.BoundedSemaphore(max(1, BULK_CONCURRENCY))
+        self._idle = threading.Condition()
+        self._interactive_active = 0
+        self._interactive_idle_since = time.monotonic()
+
+    @contextmanager
+    def interactive(self):
+        """
+        Wraps an interactive (query) encode. It starts at once; bulk batches
+        hold back while it runs.
+        """
+        with self._idle:
+            self._interactive_active += 1
+        token = self.interactive_lane.begin()
+        try:
+            yield
+        finally:
+            self.interactive_lane.end(token)
+            with self._idle:
+                self._interactive_active -= 1
+                if self._interactive_active == 0:
+                    self._interactive_idle_since = time.monotonic()
+                    self._idle.notify_all()
+
+    def _wait_for_interactive_idle(self):
+        """
+        Blocks until interactive encodes have been idle for BULK_RESUME_DELAY_SECONDS,
+        or BULK_MAX_PAUSE_SECONDS have passed.
+        """
+        started = time.monotonic()
+        deadline = started + BULK_MAX_PAUSE_SECONDS
+        with self._idle:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                if self._interactive_active == 0:
+                    quiet_for = now - self._interactive_idle_since
+                    if quiet_for >= BULK_RESUME_DELAY_SECONDS:
+                        break
+                    self._idle.wait(min(BULK_RESUME_DELAY_SECONDS - quiet_for, deadline - now))
+                else:
+                    self._idle.wait(deadline - now)
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            self.bulk_lane.record_pause(waited)
+
+    @contextmanager
+    def bulk(self):
+        """
+        Wraps one bulk (ingestion) encode batch. The batch waits for a bulk
+        slot and for interactive load to pause before it runs.
+        """
+        with self._bulk_semaphore:
+            self._wait_for_interactive_idle()
+            token = self.bulk_lane.begin()
+            try:
+                yield
+            finally:
+                self.bulk_lane.end(token)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Utilisation of the interactive and bulk lanes
+        """
+        return {
+            'interactive': self.interactive_lane.stats(),
+            'bulk': self.bulk_lane.stats(),
+        }
+
+
+def deprioritise_processes(pids):
+    """
+    Lowers the CPU priority of bulk encoding worker processes so the
+    interactive lane wins when cores are contended.
+
+    Args:
+        pids (list): Process ids of the workers
+    """
+    for pid in pids:
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, BULK_PROCESS_NICE)
+        except (AttributeError, OSError) as e:
+            logging.warning(f"Could not lower priority of encoding process {pid}: {e}")
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_compute_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = ComputeScheduler(INFERENCE_WORKERS)
+    return _scheduler
@@ -0,0 +1,49 @@
+# embeddings.py
+# This module owns the single SentenceTransformer instance shared by the
+# compare, ingestion and teacher-assistant code paths. Loading it once per
+# process (and before forking in production) keeps one copy of the weights
+# in memory instead of one per importing module.
+
+import os
+import threading
+
+# Get the directory where this script is located
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_NAME = "all-MiniLM-L6-v2"
+MODEL_PATH = os.path.join(SCRIPT_DIR, "models", MODEL_NAME)
+# Recorded with every project so stored vectors can be matched to the model that made them
+MODEL_VERSION = MODEL_NAME
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_embedding_model():
+    """
+    Returns the shared embedding model, loading it on first use.
+
+    Returns:
+        SentenceTransformer: The all-MiniLM-L6-v2 model
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                # Imported here: torch and sentence-transformers take seconds to import
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(MODEL_PATH)
+                model.eval()
+                _model = model
+    return _model
+
+
+def configure_torch_threads(num_threads):
+    """
+    Limits the intra-op threads torch uses in this process, so several worker
+    processes on one host do not oversubscribe the cores.
+
+    Args:
+        num_threads (int): Number of threads for this process
+    """
+    import torch
+    torch.set_num_threads(max(1, int(num_threads)))
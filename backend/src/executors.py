@@ -0,0 +1,67 @@
+# executors.py
+# This module provides the bounded thread pools used by the async (ASGI)
+# serving path. Blocking work is offloaded here so the event loop only
+# waits: model inference gets a small pool sized to the cores, and calls
+# into the synchronous vector store or results store get an I/O pool.
+
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+INFERENCE_WORKERS = int(os.environ.get('ASGI_INFERENCE_WORKERS', 2))
+IO_WORKERS = int(os.environ.get('ASGI_IO_WORKERS', 16))
+# Threads reads and writes of sharded projects fan out on
+SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', os.cpu_count() or 4))
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _get_executor(name, max_workers):
+    # Pools are created on first use, so a preforked master never owns their threads
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-pool")
+            _executors[name] = executor
+        return executor
+
+
+def get_shard_executor():
+    """
+    Returns:
+        ThreadPoolExecutor: The pool shard reads and writes run on, shared by
+            the sync and async serving paths
+    """
+    return _get_executor('shard', SHARD_WORKERS)
+
+
+async def run_inference(func, *args):
+    """
+    Runs a model inference call on the bounded inference pool.
+
+    Args:
+        func: The blocking function to run
+        *args: Arguments for func
+
+    Returns:
+        The return value of func
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor('inference', INFERENCE_WORKERS), func, *args)
+
+
+async def run_io(func, *args):
+    """
+    Runs a blocking vector-store or results-store call on the I/O pool.
+
+    Args:
+        func: The blocking function to run
+        *args: Arguments for func
+
+    Returns:
+        The return value of func
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor('io', IO_WORKERS), func, *args)
@@ -1,10 +1,8 @@
 
 from flask import jsonify
-from chroma_instance import get_chroma_client
+from project_catalog import get_project_catalog
 
 
 def get_projects():
-    chroma_client= get_chroma_client()
-    collections = chroma_client.list_collections()
-    project_names = [collection.name for collection in collections]
-    return jsonify({"projects": project_names}), 200
\ No newline at end of file
+    project_names = [project['name'] for project in get_project_catalog().list_projects()]
+    return jsonify({"projects": project_names}), 200
@@ -0,0 +1,42 @@
+# gunicorn.conf.py
+# Production server configuration. The master process imports main.py once
+# (preload_app) and warms up before forking: it loads the embedding model and
+# opens the Chroma database; worker processes are then forked from it and
+# share the model weights copy-on-write. The first encode, which starts
+# torch's thread pool, runs in each worker after fork. Each worker serves requests with a
+# thread pool, or with an event loop when ASGI=1 (see asgi.py).
+
+import os
+import gc
+import multiprocessing
+
+# Status results must be visible to every worker process
+os.environ.setdefault('RESULTS_BACKEND', 'sqlite')
+# Warm up in the master before forking; a background thread would not survive the fork
+os.environ.setdefault('WARMUP_MODE', 'sync')
+# Workers share the log files opened by the master; each rotating them would
+# leave the others writing to the renamed file, so rotate with logrotate instead
+os.environ.setdefault('LOG_ROTATION', 'external')
+
+ASGI = os.environ.get('ASGI') == '1'
+
+wsgi_app = 'asgi:app' if ASGI else 'main:app'
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'uvicorn.workers.UvicornWorker' if ASGI else 'gthread'
+preload_app = True
+# Compare waits on the LLM and ingestion embeds whole files
+timeout = int(os.environ.get('WEB_TIMEOUT', 300))
+graceful_timeout = 30
+
+
+def when_ready(server):
+    # Move everything loaded so far out of the GC's reach, so collections in
+    # the workers do not touch (and copy) the inherited pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import main
+    main.post_fork(server.cfg.workers)
@@ -0,0 +1,164 @@
+# index_calibration.py
+# This module tunes a project's search engine. It samples stored embeddings
+# as queries, measures recall@k against exact search and latency for every
+# point of a parameter grid, and writes the fastest setting that reaches
+# the target recall back to the project. Build-time parameters (HNSW M and
+# construction_ef, IVF-PQ nlist and pq_m) are measured on scratch copies of
+# the index, so the live project keeps serving unchanged until the chosen
+# setting is applied.
+#
+# Usage, from backend/src:
+#   python index_calibration.py <project_name> [--k 10] [--sample 200] [--target-recall 0.95]
+#       [--grid search_ef=16,32,64,128 --grid M=16,32] [--dry-run]
+
+import sys
+import json
+import logging
+import argparse
+import itertools
+from project_catalog import get_project_catalog
+from shards import get_project_collection
+from search_engines import (ChromaEngine, project_engine, project_index_params, ground_truth, measure_engine,
+                            measured_index, set_project_engine, latency_percentiles)
+
+# Values tried for the query-time parameters when no grid is given; build-time
+# parameters default to the values the project runs with
+DEFAULT_QUERY_GRIDS = {
+    'search_ef': [10, 20, 40, 80, 160, 320],
+    'nprobe': [1, 2, 4, 8, 16, 32, 64, 128],
+    'rerank_factor': [2, 5, 10, 20, 40],
+}
+DEFAULT_TARGET_RECALL = 0.95
+
+
+def parse_grid(values):
+    """
+    Args:
+        values (list): 'name=v1,v2,...' strings
+
+    Returns:
+        dict: Parameter name -> list of integer values
+
+    Raises:
+        ValueError: If an entry is malformed
+    """
+    grid = {}
+    for value in values or []:
+        name, _, listed = value.partition('=')
+        if not name or not listed:
+            raise ValueError(f"Grid entry '{value}' must look like name=v1,v2")
+        grid[name.strip()] = [int(v) for v in listed.split(',') if v.strip()]
+    return grid
+
+
+def choose(results, target_recall, recall_key):
+    """
+    Picks the setting with the lowest median latency among those reaching
+    target_recall, or the one with the best recall if none does.
+    """
+    reaching = [r for r in results if r[recall_key] >= target_recall]
+    if reaching:
+        return min(reaching, key=lambda r: (r['latency_ms']['p50'], -r[recall_key]))
+    return max(results, key=lambda r: (r[recall_key], -r['latency_ms']['p50']))
+
+
+def calibrate(project_name, grid=None, k=10, sample_size=200, target_recall=DEFAULT_TARGET_RECALL, apply=True, seed=0):
+    """
+    Measures the project's engine over a parameter grid and, unless apply is
+    False, stores the chosen parameters on the project (rebuilding its index
+    if a build-time parameter changed).
+
+    Args:
+        project_name (str): Project to calibrate
+        grid (dict): Parameter name -> values to try; unnamed parameters keep the project's value
+        k (int): Results per query
+        sample_size (int): Number of sampled queries
+        target_recall (float): Recall@k the chosen setting must reach
+        apply (bool): Write the chosen parameters back to the project
+        seed (int): Sampling seed
+
+    Returns:
+        dict: Every measured setting, the chosen one and whether it was applied
+
+    Raises:
+        ValueError: If the project does not exist or the grid names unknown parameters
+    """
+    project = get_project_catalog().get_project(project_name)
+    if project is None:
+        raise ValueError(f"Project '{project_name}' does not exist.")
+    engine = project_engine(project)
+    grid = dict(grid or {})
+    unknown = [name for name in grid if name not in engine.params]
+    if unknown:
+        raise ValueError(f"Unknown parameters {unknown} for engine '{engine.name}'; use {list(engine.params)}")
+
+    collection = get_project_collection(project_name, project)
+    stored = project_index_params(project)
+    live = engine.collection_params(collection, stored) if isinstance(engine, ChromaEngine) else engine.resolve_params(stored)
+    build_names = [name for name in engine.params if name not in engine.query_params]
+    query_names = list(engine.query_params)
+    for name in build_names:
+        grid.setdefault(name, [live[name]])
+    for name in query_names:
+        grid.setdefault(name, DEFAULT_QUERY_GRIDS.get(name, [live[name]]))
+
+    truth = ground_truth(project_name, collection, k, sample_size, seed)
+    recall_key = f'recall_at_{k}'
+    results = []
+    for build_values in itertools.product(*(grid[name] for name in build_names)):
+        build_params = {**live, **dict(zip(build_names, build_values))}
+        if isinstance(engine, ChromaEngine):
+            # Chroma keeps search_ef in the collection, so its grid always runs on a copy
+            index = engine.scratch(project_name, collection, build_params)
+        else:
+            index = measured_index(engine, project_name, collection, True, stored, build_params)
+        with index as (index_key, measured):
+            for query_values in itertools.product(*(grid[name] for name in query_names)):
+                params = {**build_params, **dict(zip(query_names, query_values))}
+                engine.apply_query_params(measured, params)
+                recall, latency = measure_engine(engine, index_key, measured, truth, k, params)
+                results.append({'params': params, recall_key: recall, 'latency_ms': latency})
+                logging.info(f"Calibration of '{project_name}': {params} -> recall@{k} {recall}, p50 {latency.get('p50')} ms")
+
+    chosen = choose(results, target_recall, recall_key)
+    if apply:
+        set_project_engine(project_name, engine.name, chosen['params'])
+    return {
+        'project_name': project_name,
+        'engine': engine.name,
+        'k': k,
+        'queries': len(truth['query_ids']),
+        'documents': truth['documents'],
+        'target_recall': target_recall,
+        'exact_latency_ms': latency_percentiles(truth['exact_ms']),
+        'results': results,
+        'chosen': chosen,
+        'applied': apply,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate a project's search engine for recall@k and latency.")
+    parser.add_argument('project_name')
+    parser.add_argument('--k', type=int, default=10, help='results per query')
+    parser.add_argument('--sample', type=int, default=200, help='number of sampled queries')
+    parser.add_argument('--target-recall', type=float, default=DEFAULT_TARGET_RECALL)
+    parser.add_argument('--grid', action='append', default=[], metavar='NAME=V1,V2',
+                        help='values to try for one parameter; repeat for several parameters')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dry-run', action='store_true', help='measure only, do not change the project')
+    args = parser.parse_args(argv)
+
+    try:
+        report = calibrate(args.project_name, parse_grid(args.grid), args.k, args.sample, args.target_recall,
+                           apply=not args.dry_run, seed=args.seed)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -28,7 +28,7 @@ def generate_test_with_modified_problems(problems):
     Important: Base your test ONLY on the problems provided above. Modify numbers and contexts but keep the problem types similar.
     """
     try:
-        response = client.chat.completions.create(
+        response = get_client().chat.completions.create(
             messages=[
                 {
                     "role": "system",
@@ -67,7 +67,7 @@ def generate_student_test(chapter_text, related_chapters):
     3. A grading rubric for each level.
     """
     try:
-        response = client.chat.completions.create(
+        response = get_client().chat.completions.create(
             messages=[
                 {
                     "role": "system",
@@ -88,9 +88,10 @@ def generate_student_test(chapter_text, related_chapters):
         return response.choices[0].message.content.strip()
     except Exception as e:
         return f"[ERROR] OpenRouter test generation failed: {e}"
-import httpx
 import os
-from openai import OpenAI
+import re
+import logging
+import threading
 from dotenv import load_dotenv
 load_dotenv()
 openrouter_token = os.getenv("OPENROUTER_API_KEY")
@@ -103,11 +104,45 @@ openrouter_endpoint = "https://openrouter.ai/api/v1"
 openrouter_model = "meta-llama/llama-3.2-3b-instruct:free"
 proxy_url = os.getenv("PROXY_URL")
 
-client = OpenAI(
-    base_url=openrouter_endpoint,
-    api_key=openrouter_token,
-    http_client=httpx.Client(proxy=proxy_url) if proxy_url else None
-)
+# Async client used by the ASGI server. One event loop can keep many LLM calls
+# in flight, bounded by the connection pool size.
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 1000))
+
+# The clients are created on first use; importing openai adds noticeably to startup
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client():
+    if 'sync' not in _clients:
+        with _clients_lock:
+            if 'sync' not in _clients:
+                import httpx
+                from openai import OpenAI
+                _clients['sync'] = OpenAI(
+                    base_url=openrouter_endpoint,
+                    api_key=openrouter_token,
+                    http_client=httpx.Client(proxy=proxy_url) if proxy_url else None
+                )
+    return _clients['sync']
+
+
+def get_async_client():
+    if 'async' not in _clients:
+        with _clients_lock:
+            if 'async' not in _clients:
+                import httpx
+                from openai import AsyncOpenAI
+                _clients['async'] = AsyncOpenAI(
+                    base_url=openrouter_endpoint,
+                    api_key=openrouter_token,
+                    http_client=httpx.AsyncClient(
+                        proxy=proxy_url,
+                        limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=100),
+                        timeout=httpx.Timeout(60.0, connect=10.0)
+                    )
+                )
+    return _clients['async']
 
 system_prompt = """
 You are a software testing assistant. Your task is to generate C# test cases that address and cover issues described by the user within the <user_issue> tag.
@@ -125,7 +160,7 @@ Follow these instructions:
 
 def ask_llm(prompt):
     try:
-        response = client.chat.completions.create(
+        response = get_client().chat.completions.create(
             messages=[
                 {
                     "role": "system",
@@ -147,20 +182,17 @@ def ask_llm(prompt):
     except Exception as e:
         return f"[ERROR] OpenRouter request failed: {e}"
 
-def calculate_semantic_similarity(query, matches):
+def _similarity_messages(query, matches):
     """
-    Uses LLM to calculate more accurate semantic similarity percentages.
-    Returns a dict mapping match content to refined percentage.
+    Builds the chat messages asking the LLM to score each match against the query.
     """
-    import re
-    try:
-        # Build the comparison text
-        matches_text = "\n\n".join([
-            f"Match {i+1}:\n{match.get('content', '')}"
-            for i, match in enumerate(matches)
-        ])
+    # Build the comparison text
+    matches_text = "\n\n".join([
+        f"Match {i+1}:\n{match.get('content', '')}"
+        for i, match in enumerate(matches)
+    ])
 
-        prompt = f"""You are a semantic similarity expert. Compare this query against each match and provide a similarity percentage (0-100%) for each based on semantic meaning.
+    prompt = f"""You are a semantic similarity expert. Compare this query against each match and provide a similarity percentage (0-100%) for each based on semantic meaning.
 
 Query:
 {query}
@@ -183,47 +215,156 @@ Match 3: XX%
 Match 4: XX%
 Match 5: XX%"""
 
-        response = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a semantic similarity analyzer. Respond ONLY with percentages in the exact format requested.",
-                },
-                {
-                    "role": "user",
-                    "content": prompt,
-                }
-            ],
+    return [
+        {
+            "role": "system",
+            "content": "You are a semantic similarity analyzer. Respond ONLY with percentages in the exact format requested.",
+        },
+        {
+            "role": "user",
+            "content": prompt,
+        }
+    ]
+
+def _parse_similarity_scores(result_text, matches):
+    """
+    Maps the percentages in an LLM response back to the match contents.
+
+    Returns:
+        dict: Match content to refined percentage, or None when the response
+            did not score every match
+    """
+    # Parse percentages from response
+    percentages = []
+    for line in result_text.split('\n'):
+        match = re.search(r'(\d+)%', line)
+        if match:
+            percentages.append(float(match.group(1)) / 100.0)
+
+    if len(percentages) < len(matches):
+        logging.warning(f"LLM scored {len(percentages)} of {len(matches)} matches, using original scores")
+        return None
+    # Map percentages back to matches
+    return {match.get('content', ''): percentage for match, percentage in zip(matches, percentages)}
+
+def calculate_semantic_similarity(query, matches):
+    """
+    Uses LLM to calculate more accurate semantic similarity percentages.
+
+    Returns:
+        dict: Match content to refined percentage, or None when the call
+            failed or did not score every match
+    """
+    try:
+        response = get_client().chat.completions.create(
+            messages=_similarity_messages(query, matches),
             max_tokens=150,
             temperature=0.1,
             model=openrouter_model
         )
+        return _parse_similarity_scores(response.choices[0].message.content.strip(), matches)
 
-        result_text = response.choices[0].message.content.strip()
-
-        # Parse percentages from response
-        percentages = []
-        for line in result_text.split('\n'):
-            match = re.search(r'(\d+)%', line)
-            if match:
-                percentages.append(float(match.group(1)) / 100.0)
+    except Exception as e:
+        logging.warning(f"LLM similarity calculation failed: {e}, using original scores")
+        return None
 
-        # Map percentages back to matches
-        refined_matches = {}
-        for i, match in enumerate(matches):
-            if i < len(percentages):
-                refined_matches[match.get('content', '')] = percentages[i]
-            else:
-                # Fallback to original if parsing failed
-                refined_matches[match.get('content', '')] = match.get('match', 0)
+async def calculate_semantic_similarity_async(query, matches):
+    """
+    Async counterpart of calculate_semantic_similarity for the ASGI server.
+    Waiting on the LLM does not hold a thread.
 
-        return refined_matches
+    Returns:
+        dict: As calculate_semantic_similarity, None on failure
+    """
+    try:
+        response = await get_async_client().chat.completions.create(
+            messages=_similarity_messages(query, matches),
+            max_tokens=150,
+            temperature=0.1,
+            model=openrouter_model
+        )
+        return _parse_similarity_scores(response.choices[0].message.content.strip(), matches)
 
     except Exception as e:
-        import logging
         logging.warning(f"LLM similarity calculation failed: {e}, using original scores")
-        # Return original scores as fallback
-        return {match.get('content', ''): match.get('match', 0) for match in matches}
+        return None
+
+def _batch_similarity_messages(items):
+    """
+    Builds the chat messages asking the LLM to score the matches of several queries at once.
+    """
+    blocks = []
+    for q, (query, matches) in enumerate(items, start=1):
+        matches_text = "\n\n".join([
+            f"Query {q} Match {i+1}:\n{match.get('content', '')}"
+            for i, match in enumerate(matches)
+        ])
+        blocks.append(f"Query {q}:\n{query}\n\n{matches_text}")
+
+    prompt = f"""You are a semantic similarity expert. For each query below, compare it against each of its matches and provide a similarity percentage (0-100%) for each based on semantic meaning.
+
+{chr(10).join(blocks)}
+
+IMPORTANT:
+- Give varied percentages from 0-100%
+- 80-100%: Nearly identical meaning
+- 60-79%: Similar topic, related concepts
+- 40-59%: Same general domain
+- 20-39%: Some connection
+- 0-19%: Unrelated
+
+Respond with ONLY one line per match in this exact format:
+Query 1 Match 1: XX%
+Query 1 Match 2: XX%"""
+
+    return [
+        {
+            "role": "system",
+            "content": "You are a semantic similarity analyzer. Respond ONLY with percentages in the exact format requested.",
+        },
+        {
+            "role": "user",
+            "content": prompt,
+        }
+    ]
+
+def calculate_semantic_similarity_batch(items):
+    """
+    Scores the matches of several queries with one LLM call.
+
+    Args:
+        items (list): (query, matches) pairs
+
+    Returns:
+        list: Per query, a dict mapping match content to refined percentage,
+            or None when the response did not score all of its matches
+    """
+    try:
+        response = get_client().chat.completions.create(
+            messages=_batch_similarity_messages(items),
+            max_tokens=12 * sum(len(matches) for _, matches in items) + 50,
+            temperature=0.1,
+            model=openrouter_model
+        )
+        result_text = response.choices[0].message.content.strip()
+    except Exception as e:
+        logging.warning(f"LLM batch similarity calculation failed: {e}, using original scores")
+        return [None] * len(items)
+
+    scores = {}
+    for line in result_text.split('\n'):
+        match = re.search(r'Query\s*(\d+)\s*Match\s*(\d+)\s*:\s*(\d+)%', line)
+        if match:
+            scores[(int(match.group(1)), int(match.group(2)))] = float(match.group(3)) / 100.0
+
+    refined = []
+    for q, (_, matches) in enumerate(items, start=1):
+        keys = [(q, i + 1) for i in range(len(matches))]
+        if all(key in scores for key in keys):
+            refined.append({match.get('content', ''): scores[key] for match, key in zip(matches, keys)})
+        else:
+            refined.append(None)
+    return refined
 
 def summary_generator(input_text, entries):
     try:
@@ -246,7 +387,7 @@ def summary_generator(input_text, entries):
         ...
         Summary: [comprehensive summary]
         """
-        response = client.chat.completions.create(
+        response = get_client().chat.completions.create(
             messages=[
                 {
                     "role": "system",
@@ -1,77 +1,481 @@
 import csv
 import hashlib
 import os
-from chroma_instance import get_chroma_client
-from sentence_transformers import SentenceTransformer
+from chroma_instance import get_chroma_client, find_existing_ids
+from bulk_encoder import encode_bulk
+from project_catalog import get_project_catalog, SIMILARITY_MATCHER
+from project_schema import resolve_schema, schema_columns
+from chunking import split_documents, parent_of, window_id, CHUNK_INDEX_KEY, CHUNK_METADATA_PREFIX, CHUNK_PARENT_KEY
+from search_engines import project_changed, hnsw_metadata
+from reduction import reduce_for_project
+from shards import create_project_collection, get_project_collection
+from project_locks import project_write_lock, ProjectBusyError
 
-# Get the directory where this script is located
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-MODEL_PATH = os.path.join(SCRIPT_DIR, "models", "all-MiniLM-L6-v2")
+# Accepted upload formats; Arrow files are read as Feather v2 (Arrow IPC file format)
+TABLE_EXTENSIONS = ('.csv', '.parquet', '.arrow', '.feather')
 
-chroma_client = get_chroma_client()
-embedding_model = SentenceTransformer(MODEL_PATH)
+# Rows embedded and written per upsert/delete call when syncing a CSV
+SYNC_BATCH_SIZE = int(os.environ.get('CSV_SYNC_BATCH_SIZE', 2000))
+# Records read per page when collecting the stored row hashes
+SYNC_PAGE_SIZE = int(os.environ.get('CSV_SYNC_PAGE_SIZE', 10000))
 
 def make_id(text):
     return hashlib.md5(text.encode('utf-8')).hexdigest()
 
-def embed_documents(texts):
-    return embedding_model.encode(texts).tolist()
+def row_hash(document_text, metadata, schema=None):
+    """
+    Returns:
+        str: Hash of a row's content, as sync stores it in 'row_hash'
+    """
+    if schema:
+        # Metadata-only columns are not in the text but still count as a change
+        document_text += '\n' + repr(sorted(metadata.items()))
+    return make_id(document_text)
 
-def load_csv_to_chroma(csv_path: str, project_name: str):
-    try:
+def embed_documents(texts, project_name):
+    # Reduced projects store projected vectors
+    return reduce_for_project(project_name, encode_bulk(texts)).tolist()
+
+def read_table_columns(path):
+    """
+    Returns the column names of a table file without reading its rows.
+    """
+    import pandas as pd
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return [str(c) for c in pd.read_csv(path, nrows=0, encoding='utf-8').columns]
+    if extension == '.parquet':
+        import pyarrow.parquet
+        return pyarrow.parquet.read_schema(path).names
+    import pyarrow.ipc
+    with pyarrow.ipc.open_file(path) as reader:
+        return reader.schema.names
+
+def read_csv_table(path, columns=None):
+    """
+    Reads a CSV file the way the row-by-row loader always has: rows whose
+    field count differs from the header's (blank lines included) are
+    skipped, but still counted, so row numbers stay the same.
+
+    Returns:
+        DataFrame: The requested columns, indexed by row number
+    """
+    import pandas as pd
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            return pd.DataFrame()
+        names = columns or header
+        indices = [header.index(name) for name in names]
+        num_columns = len(header)
+        row_numbers = []
+        values = [[] for _ in indices]
+        for row_num, row in enumerate(reader, start=1):
+            if len(row) != num_columns:
+                continue
+            row_numbers.append(row_num)
+            for column_values, index in zip(values, indices):
+                column_values.append(row[index])
+    return pd.DataFrame(dict(zip(names, values)), index=row_numbers, columns=names)
+
+def read_table(path, columns=None):
+    """
+    Reads a CSV, Parquet or Arrow/Feather file into a DataFrame of strings.
+    Only the requested columns are kept, so wide files do not pay for
+    columns nobody searches.
+
+    Args:
+        path (str): Path of the file, its extension selects the reader
+        columns (list): Columns to read, or None for all of them
+
+    Returns:
+        DataFrame: Cell values as stripped strings, missing values as '',
+            indexed by row number (the first data row is 1)
 
-        existing_collections = [c.name for c in chroma_client.list_collections()]
-        if project_name in existing_collections:
-            collection = chroma_client.get_collection(name=project_name.strip())
-            existing_ids = set(collection.get()['ids'])
+    Raises:
+        ValueError: If the extension is unsupported or a requested column is missing
+    """
+    import pandas as pd
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in TABLE_EXTENSIONS:
+        raise ValueError(f"Unsupported file type '{extension}'. Use one of {list(TABLE_EXTENSIONS)}.")
+
+    if columns:
+        missing = [c for c in columns if c not in read_table_columns(path)]
+        if missing:
+            raise ValueError(f"Columns not found in file: {missing}")
+
+    if extension == '.csv':
+        frame = read_csv_table(path, columns)
+    else:
+        if extension == '.parquet':
+            # Nullable dtypes keep integer columns with gaps from turning into floats
+            frame = pd.read_parquet(path, columns=columns, dtype_backend='numpy_nullable')
         else:
-            # Create collection with cosine similarity config
-            collection = chroma_client.create_collection(
-                name=project_name.strip(),
-                embedding_function=None,  
-                metadata={"hnsw:space": "cosine"}  # Fixed configuration syntax
-            )
-            existing_ids = set()
+            frame = pd.read_feather(path, columns=columns, dtype_backend='numpy_nullable')
+        if columns:
+            frame = frame[columns]
+        frame.index = pd.RangeIndex(1, len(frame) + 1)
 
-        documents, ids = [], []
-        metadata_list = []
+    frame.columns = [str(c) for c in frame.columns]
+    for col_name in frame.columns:
+        values = frame[col_name]
+        frame[col_name] = values.astype(str).str.strip().where(values.notna(), '')
+    return frame
 
-        with open(csv_path, newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            header = next(reader, None)  # Read header row
+def build_documents(frame, embed_columns=None, metadata_columns=None):
+    """
+    Builds the document text ('column_name: column_value' lines) and the
+    metadata of every row, working column by column instead of per cell.
 
-            if not header:
-                print("CSV file is empty or has no header")
-                return []
+    Args:
+        frame (DataFrame): The table, as strings
+        embed_columns (list): Columns that go into the document text, None for all
+        metadata_columns (list): Columns stored as metadata, None for all
 
-            num_columns = len(header)
-            for row_num, row in enumerate(reader, start=1):
-                if not row or len(row) != num_columns:
-                    continue
+    Returns:
+        tuple: (documents, metadata_list)
+    """
+    if frame.empty:
+        return [], []
+    embed_columns = list(frame.columns) if embed_columns is None else embed_columns
+    metadata_columns = list(frame.columns) if metadata_columns is None else metadata_columns
+    parts = [col_name + ': ' + frame[col_name] for col_name in embed_columns]
+    documents = parts[0].str.cat(parts[1:], sep='\n') if len(parts) > 1 else parts[0]
+    metadata_list = frame[metadata_columns].assign(row_id=frame.index.astype(str)).to_dict('records')
+    return documents.tolist(), metadata_list
 
-                # Build description as 'column_name: column_value' for each column
-                description_parts = [f"{col_name}: {row[idx].strip()}" for idx, col_name in enumerate(header)]
-                document_text = "\n".join(description_parts)
+def read_csv_documents(path, columns=None, schema=None):
+    """
+    Reads a table file into documents and metadata, one per well-formed row.
+    With a project schema only the columns it uses are read, and each column
+    goes to the document text, the metadata or both as the schema says.
 
-                # Build metadata dictionary for all columns
-                metadata = {col_name: row[idx].strip() for idx, col_name in enumerate(header)}
-                metadata["row_id"] = str(row_num)
+    Returns:
+        tuple: (header, documents, metadata_list) - header is None for an empty file
+    """
+    import pandas as pd
+    if schema and columns is None:
+        columns = schema_columns(schema)
+    try:
+        frame = read_table(path, columns)
+    except pd.errors.EmptyDataError:
+        return None, [], []
+    header = list(frame.columns)
+    if not header:
+        return None, [], []
+    embed_columns, metadata_columns = resolve_schema(schema, header)
+    documents, metadata_list = build_documents(frame, embed_columns, metadata_columns)
+    return header, documents, metadata_list
+
+def project_schema(project_name, schema=None):
+    """
+    Returns the schema that applies to an upload. A new project takes the
+    schema it is created with; an existing project keeps its stored one.
+
+    Raises:
+        ValueError: If a schema is given that differs from the project's
+    """
+    project = get_project_catalog().get_project(project_name)
+    if project is None:
+        return schema
+    stored = project['settings'].get('schema')
+    if schema is not None and schema != stored:
+        raise ValueError(f"Project '{project_name}' was created with a different schema: {stored}")
+    return stored
+
+def get_or_create_project_collection(project_name, schema=None, index_params=None, shards=1):
+    """
+    Args:
+        project_name (str): Project to open or create
+        schema (dict): Column schema recorded in the catalog for a new project
+        index_params (dict): HNSW parameters (M, construction_ef, search_ef) of a new collection
+        shards (int): Number of shard collections of a new project
+
+    Returns:
+        tuple: (collection, project_exists)
+    """
+    chroma_client = get_chroma_client()
+    project_exists = chroma_client.has_collection(project_name)
+    settings = {}
+    if project_exists:
+        collection = get_project_collection(project_name)
+    else:
+        # Create collection with cosine similarity config
+        collection = create_project_collection(
+            project_name,
+            {"hnsw:space": "cosine", **hnsw_metadata(index_params)},
+            shards
+        )
+        if shards > 1:
+            settings['shards'] = shards
+    if schema:
+        settings['schema'] = schema
+    get_project_catalog().register_project(project_name, SIMILARITY_MATCHER, settings or None)
+    return collection, project_exists
+
+def load_csv_to_chroma(csv_path: str, project_name: str, columns: list = None, schema: dict = None,
+                       index_params: dict = None, shards: int = 1):
+    try:
+        schema = project_schema(project_name.strip(), schema)
+        project = get_project_catalog().get_project(project_name.strip())
+        if project and project['settings'].get('sync'):
+            # Synced rows are stored under their keys, so row numbers would add every row again
+            raise ValueError(f"Project '{project_name.strip()}' is kept in sync with a file; upload with mode=sync")
+        header, documents, metadata_list = read_csv_documents(csv_path, columns, schema)
+        # Held from here on: a rebuild must not swap the collection while rows are written
+        with project_write_lock(project_name.strip()):
+            collection, project_exists = get_or_create_project_collection(project_name.strip(), schema, index_params, shards)
+
+            if not header:
+                print("CSV file is empty or has no header")
+                return []
+            ids = [metadata["row_id"] for metadata in metadata_list]
 
-                row_id = str(row_num)
-                if row_id not in existing_ids:
-                    documents.append(document_text)
-                    ids.append(row_id)
-                    metadata_list.append(metadata)
+            # Skip rows already stored, checking only the candidate ids
+            if project_exists and ids:
+                existing_ids = find_existing_ids(collection, ids)
+                if existing_ids:
+                    keep = [i for i, row_id in enumerate(ids) if row_id not in existing_ids]
+                    documents = [documents[i] for i in keep]
+                    ids = [ids[i] for i in keep]
+                    metadata_list = [metadata_list[i] for i in keep]
 
-        if not documents:
-            print("No new documents to add.")
-            return []
+            if not documents:
+                print("No new documents to add.")
+                return []
 
-        embeddings = embed_documents(documents)
-        collection.add(documents=documents, ids=ids, embeddings=embeddings, metadatas=metadata_list)
+            # Long rows are stored as several token-budgeted windows linked to the row id
+            window_ids, window_documents, window_metadatas, chunked = split_documents(ids, documents, metadata_list)
+            embeddings = embed_documents(window_documents, project_name.strip())
+            collection.add(documents=window_documents, ids=window_ids, embeddings=embeddings, metadatas=window_metadatas)
+            if chunked:
+                get_project_catalog().update_settings(project_name.strip(), {'chunked': True})
+            get_project_catalog().record_ingest(project_name.strip(), len(documents))
+            project_changed(project_name.strip(), added_ids=window_ids)
 
-        return documents
+            return documents
 
+    except (ValueError, ProjectBusyError):
+        raise
     except Exception as e:
         print(f"[ERROR] CSV load failed: {e}")
         return []
+
+def fetch_row_hashes(collection, page_size=SYNC_PAGE_SIZE):
+    """
+    Reads the id and stored row hash of every record, page by page,
+    without fetching documents or embeddings. Windows of a chunked row are
+    grouped under the row (parent) id.
+
+    Returns:
+        tuple: (hashes, records) - row id -> row hash (None for rows ingested
+            before sync existed), row id -> ids of all its stored records
+    """
+    hashes, records = {}, {}
+    offset = 0
+    while True:
+        page = collection.get(include=['metadatas'], limit=page_size, offset=offset)
+        for record_id, metadata in zip(page['ids'], page['metadatas']):
+            row_id = parent_of(record_id, metadata)
+            records.setdefault(row_id, []).append(record_id)
+            if record_id == row_id or row_id not in hashes:
+                hashes[row_id] = (metadata or {}).get('row_hash')
+        if len(page['ids']) < page_size:
+            return hashes, records
+        offset += page_size
+
+def legacy_row_hashes(collection, row_ids, schema=None):
+    """
+    Hashes the stored content of rows ingested by an append upload, which
+    stores no row hash, the way sync hashes a file row. Only rows stored as
+    one record are passed: windows cannot be put back together.
+
+    Args:
+        collection: The project's collection
+        row_ids (list): Ids of single-record rows without a stored hash
+
+    Returns:
+        dict: row id -> row hash
+    """
+    hashes = {}
+    for start in range(0, len(row_ids), SYNC_BATCH_SIZE):
+        page = collection.get(ids=row_ids[start:start + SYNC_BATCH_SIZE], include=['documents', 'metadatas'])
+        for record_id, document_text, metadata in zip(page['ids'], page['documents'], page['metadatas']):
+            metadata = {k: v for k, v in (metadata or {}).items()
+                        if k not in ('row_id', 'row_hash') and not k.startswith(CHUNK_METADATA_PREFIX)}
+            hashes[record_id] = row_hash(document_text or '', metadata, schema)
+    return hashes
+
+def rekey_rows(collection, rows, stored_hashes, stored_records, schema=None):
+    """
+    Carries stored rows that hold the content of a file row over to that
+    row's key, reusing their embeddings instead of encoding them again:
+    rows of append uploads, keyed by row number and stored without a hash,
+    and rows of a sync with another key column. stored_hashes and
+    stored_records are updated to match.
+
+    Args:
+        collection: The project's collection
+        rows (dict): File rows, key -> (document text, metadata with 'row_hash')
+        stored_hashes (dict): Stored row id -> row hash, None for append uploads
+        stored_records (dict): Stored row id -> ids of its records
+
+    Returns:
+        int: Number of rows carried over
+    """
+    legacy = [r for r, h in stored_hashes.items() if h is None and stored_records[r] == [r]]
+    hashes = {**stored_hashes, **legacy_row_hashes(collection, legacy, schema)}
+
+    # A row stored under its key with the file's content only lacks its hash
+    moves = {r: r for r in legacy if r in rows and rows[r][1]['row_hash'] == hashes[r]}
+    unmatched = {rows[k][1]['row_hash']: k for k in rows if k not in stored_hashes}
+    for row_id in stored_hashes:
+        if row_id not in rows and unmatched:
+            key = unmatched.pop(hashes[row_id], None)
+            if key is not None:
+                moves[row_id] = key
+
+    moved = list(moves)
+    for start in range(0, len(moved), SYNC_BATCH_SIZE):
+        batch = moved[start:start + SYNC_BATCH_SIZE]
+        record_ids = [r for row_id in batch for r in stored_records[row_id]]
+        page = collection.get(ids=record_ids, include=['embeddings', 'documents', 'metadatas'])
+        new_ids, new_metadatas = [], []
+        for record_id, metadata in zip(page['ids'], page['metadatas']):
+            key = moves[parent_of(record_id, metadata)]
+            metadata = metadata or {}
+            window = {k: v for k, v in metadata.items() if k.startswith(CHUNK_METADATA_PREFIX)}
+            if window:
+                window[CHUNK_PARENT_KEY] = key
+            new_ids.append(window_id(key, metadata.get(CHUNK_INDEX_KEY, 0)))
+            new_metadatas.append({**rows[key][1], **window})
+        collection.upsert(ids=new_ids, embeddings=page['embeddings'], documents=page['documents'],
+                          metadatas=new_metadatas)
+        kept = set(new_ids)
+        old_ids = [r for r in record_ids if r not in kept]
+        if old_ids:
+            collection.delete(ids=old_ids)
+        for row_id in batch:
+            key = moves[row_id]
+            records = stored_records.pop(row_id)
+            del stored_hashes[row_id]
+            stored_records[key] = [window_id(key, n) for n in range(len(records))]
+            stored_hashes[key] = rows[key][1]['row_hash']
+    return len(moves)
+
+def sync_csv_to_chroma(csv_path: str, project_name: str, key_column: str = None, columns: list = None,
+                       schema: dict = None, index_params: dict = None, shards: int = 1):
+    """
+    Brings a project in line with a re-uploaded file. Rows are keyed by
+    key_column when given, otherwise by a hash of their content. Inserted
+    and changed rows are embedded and upserted, rows missing from the file
+    are deleted and unchanged rows are left alone, so the cost is the size
+    of the diff. Row numbers are not stored: the key identifies a row, and
+    the number of an unchanged row would go stale as rows come and go.
+    Stored rows under another id with the content of a file row, such as
+    rows of earlier append uploads, are moved to its key without being
+    encoded again (rekey_rows). Once synced, a project only takes syncs.
+
+    Args:
+        csv_path (str): Path of the uploaded CSV
+        project_name (str): Project to sync
+        key_column (str): Column holding a stable row key, or None to key by content
+        columns (list): Columns to ingest, or None for all of them
+        schema (dict): Column schema for a new project, see project_schema.py
+        index_params (dict): HNSW parameters of a new project's collection
+        shards (int): Number of shard collections of a new project
+
+    Returns:
+        dict: Counts of inserted, updated, deleted, unchanged and rekeyed rows
+
+    Raises:
+        ValueError: If the file is empty or unreadable, key_column is not in the
+            header, a key is empty or repeated, or the schema does not match the project's
+        ProjectBusyError: If the project is being rebuilt
+    """
+    project_name = project_name.strip()
+    schema = project_schema(project_name, schema)
+    header, documents, metadata_list = read_csv_documents(csv_path, columns, schema)
+    if not header:
+        raise ValueError("CSV file is empty or has no header")
+    if key_column and key_column not in header:
+        raise ValueError(f"Key column '{key_column}' not found in CSV header")
+    if key_column and metadata_list and key_column not in metadata_list[0]:
+        raise ValueError(f"Key column '{key_column}' must be stored as metadata by the project schema")
+
+    # Key every row; rows repeating the content of an earlier one are ignored
+    rows = {}
+    empty_keys, duplicate_keys = [], []
+    for document_text, metadata in zip(documents, metadata_list):
+        row_number = metadata.pop("row_id")
+        content_hash = row_hash(document_text, metadata, schema)
+        row_key = metadata[key_column] if key_column else content_hash
+        if key_column and not row_key:
+            empty_keys.append(row_number)
+            continue
+        if row_key in rows:
+            if key_column:
+                duplicate_keys.append(row_key)
+            continue
+        metadata["row_hash"] = content_hash
+        rows[row_key] = (document_text, metadata)
+    if empty_keys:
+        raise ValueError(f"Key column '{key_column}' is empty in {len(empty_keys)} row(s), "
+                         f"first at rows {empty_keys[:10]}")
+    if duplicate_keys:
+        raise ValueError(f"Key column '{key_column}' repeats {len(duplicate_keys)} key(s), "
+                         f"e.g. {sorted(set(duplicate_keys))[:10]}")
+
+    # Held from here on: a rebuild must not swap the collection while rows are written
+    with project_write_lock(project_name):
+        collection, project_exists = get_or_create_project_collection(project_name, schema, index_params, shards)
+        stored_hashes, stored_records = fetch_row_hashes(collection) if project_exists else ({}, {})
+        rekeyed = rekey_rows(collection, rows, stored_hashes, stored_records, schema) if project_exists else 0
+
+        inserted = [k for k in rows if k not in stored_hashes]
+        updated = [k for k in rows if k in stored_hashes and stored_hashes[k] != rows[k][1]["row_hash"]]
+        deleted = [k for k in stored_hashes if k not in rows]
+
+        changed = inserted + updated
+        chunked = False
+        added_ids = []
+        # Windows of changed rows that the new text no longer produces
+        stale_records = []
+        for start in range(0, len(changed), SYNC_BATCH_SIZE):
+            batch = changed[start:start + SYNC_BATCH_SIZE]
+            window_ids, window_documents, window_metadatas, batch_chunked = split_documents(
+                batch, [rows[k][0] for k in batch], [rows[k][1] for k in batch]
+            )
+            chunked = chunked or batch_chunked
+            collection.upsert(
+                ids=window_ids,
+                documents=window_documents,
+                embeddings=embed_documents(window_documents, project_name),
+                metadatas=window_metadatas
+            )
+            added_ids.extend(window_ids)
+            new_ids = set(window_ids)
+            stale_records.extend(r for k in batch for r in stored_records.get(k, ()) if r not in new_ids)
+
+        stale_records.extend(r for k in deleted for r in stored_records[k])
+        for start in range(0, len(stale_records), SYNC_BATCH_SIZE):
+            collection.delete(ids=stale_records[start:start + SYNC_BATCH_SIZE])
+
+        if chunked:
+            get_project_catalog().update_settings(project_name, {'chunked': True})
+
+        get_project_catalog().set_document_count(project_name, len(rows))
+        get_project_catalog().update_settings(project_name, {'sync': {'key_column': key_column}})
+        if changed or stale_records or rekeyed:
+            # Only inserted rows can be appended to an engine's index; updates and deletes rebuild it
+            project_changed(project_name, added_ids=None if updated or stale_records or rekeyed else added_ids)
+
+        return {
+            'inserted': len(inserted),
+            'updated': len(updated),
+            'deleted': len(deleted),
+            'unchanged': len(rows) - len(changed),
+            'rekeyed': rekeyed
+        }
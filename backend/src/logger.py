@@ -2,86 +2,198 @@
 # This module sets up structured logging for the application.
 # It provides different loggers for application logs, access logs, and metrics logs
 # with JSON formatting and log rotation.
+# Records are handed to a QueueHandler on the calling thread; formatting and
+# disk I/O happen on QueueListener threads, off the request path.
+# Files are rotated by size in-process (LOG_ROTATION=internal), which only
+# works for a single process: under gunicorn every worker shares the files
+# opened by the master, and one rotating would leave the others writing to
+# the renamed file. gunicorn.conf.py therefore sets LOG_ROTATION=external:
+# files are reopened when an external tool such as logrotate moves them.
 
 import os
-import json
+import re
+import copy
+import atexit
+import queue
+import random
 import logging
 import datetime
-from logging.handlers import RotatingFileHandler
+import orjson
+from logging.handlers import RotatingFileHandler, WatchedFileHandler, QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RESERVED_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Fraction of access-log records kept for high-volume routes (health, status, metrics)
+ACCESS_LOG_SAMPLE_RATE = float(os.environ.get('ACCESS_LOG_SAMPLE_RATE', 1.0))
+ACCESS_LOG_SAMPLED_PATHS = re.compile(
+    os.environ.get('ACCESS_LOG_SAMPLED_PATHS', r'^/$|/(health|metrics|ready)$|/status/[^/]+$')
+)
+
+# 'internal' rotates log files by size in this process, 'external' leaves rotation to logrotate
+LOG_ROTATION = os.environ.get('LOG_ROTATION', 'internal')
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+
+# Listeners started by setup_logging, stopped at interpreter exit
+_listeners = []
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as single-line JSON using orjson.
+    Values passed through `extra=` are included as top-level keys.
+    """
+    def format(self, record):
+        log_data = {
+            'timestamp': datetime.datetime.fromtimestamp(record.created),
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_RECORD_ATTRS and not key.startswith('_'):
+                log_data[key] = value
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            log_data['exception'] = record.exc_text
+        return orjson.dumps(log_data, default=str).decode('utf-8')
+
+
+# Renders tracebacks on the logging thread, before the record is queued
+_traceback_formatter = logging.Formatter()
+
+
+class _RecordQueueHandler(QueueHandler):
+    """
+    QueueHandler that only merges the message arguments on the calling thread.
+    The traceback is rendered to text here (the exc_info object cannot cross
+    threads safely) and JSON formatting is left to the listener.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _attach_queue(logger, handlers):
+    """
+    Routes a logger through a queue drained by a QueueListener thread.
+
+    Args:
+        logger: The logger to attach the QueueHandler to
+        handlers (list): The handlers doing the actual formatting and I/O
+    """
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(_RecordQueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
+
+def stop_logging():
+    """
+    Flushes pending records and stops all queue listener threads.
+    """
+    while _listeners:
+        _listeners.pop().stop()
+
+
+def restart_logging():
+    """
+    Starts new listener threads for the existing queues.
+    Threads do not survive fork, so preforked workers call this in the child.
+    """
+    for i, listener in enumerate(_listeners):
+        fresh = QueueListener(listener.queue, *listener.handlers, respect_handler_level=True)
+        fresh.start()
+        _listeners[i] = fresh
+
+
+def should_log_access(path, status_code=None):
+    """
+    Decides whether an access-log record is written for a request.
+    Routes matching ACCESS_LOG_SAMPLED_PATHS are sampled at ACCESS_LOG_SAMPLE_RATE;
+    everything else, and every error response, is always logged.
+
+    Args:
+        path (str): The request path
+        status_code (int): The response status code, if known
+
+    Returns:
+        bool: True if the record should be written
+    """
+    if status_code is not None and status_code >= 400:
+        return True
+    if ACCESS_LOG_SAMPLE_RATE >= 1.0 or not ACCESS_LOG_SAMPLED_PATHS.search(path):
+        return True
+    return random.random() < ACCESS_LOG_SAMPLE_RATE
+
+
+def _file_handler(path):
+    """
+    Returns:
+        logging.Handler: A handler writing to path, rotating it itself or
+            reopening it after external rotation, as LOG_ROTATION says
+    """
+    if LOG_ROTATION == 'external':
+        return WatchedFileHandler(path)
+    return RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+
 
 def setup_logging():
     """
     Sets up structured JSON logging with different log files for
     application logs, access logs, and metrics.
-    
+
     Returns:
         tuple: (root_logger, access_logger, metrics_logger)
     """
     log_dir = os.path.join(os.path.dirname(__file__), 'logs')
     os.makedirs(log_dir, exist_ok=True)
-    
-    # JSON formatter for structured logging
-    class JsonFormatter(logging.Formatter):
-        def format(self, record):
-            log_data = {
-                'timestamp': datetime.datetime.fromtimestamp(record.created).isoformat(),
-                'level': record.levelname,
-                'message': record.getMessage(),
-                'module': record.module,
-                'line': record.lineno
-            }
-            if hasattr(record, 'user_id'):
-                log_data['user_id'] = record.user_id
-            if hasattr(record, 'request_id'):
-                log_data['request_id'] = record.request_id
-            return json.dumps(log_data)
-    
+    formatter = JsonFormatter()
+
     # Root logger for general application logging
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.INFO)
-    
+
     # Console handler
     console_handler = logging.StreamHandler()
-    console_handler.setFormatter(JsonFormatter())
-    root_logger.addHandler(console_handler)
-    
+    console_handler.setFormatter(formatter)
+
     # File handler with rotation
-    file_handler = RotatingFileHandler(
-        os.path.join(log_dir, 'app.log'),
-        maxBytes=10*1024*1024,  # 10MB
-        backupCount=5
-    )
-    file_handler.setFormatter(JsonFormatter())
-    root_logger.addHandler(file_handler)
-    
+    file_handler = _file_handler(os.path.join(log_dir, 'app.log'))
+    file_handler.setFormatter(formatter)
+    _attach_queue(root_logger, [console_handler, file_handler])
+
     # Special logger for access logs
     access_logger = logging.getLogger('access')
-    access_file_handler = RotatingFileHandler(
-        os.path.join(log_dir, 'access.log'),
-        maxBytes=10*1024*1024,
-        backupCount=5
-    )
-    access_file_handler.setFormatter(JsonFormatter())
-    access_logger.addHandler(access_file_handler)
+    access_file_handler = _file_handler(os.path.join(log_dir, 'access.log'))
+    access_file_handler.setFormatter(formatter)
+    _attach_queue(access_logger, [access_file_handler])
     access_logger.setLevel(logging.INFO)
-    
+
     # Logger for metrics
     metrics_logger = logging.getLogger('metrics')
-    metrics_file_handler = RotatingFileHandler(
-        os.path.join(log_dir, 'metrics.log'),
-        maxBytes=10*1024*1024,
-        backupCount=5
-    )
-    metrics_file_handler.setFormatter(JsonFormatter())
-    metrics_logger.addHandler(metrics_file_handler)
+    metrics_file_handler = _file_handler(os.path.join(log_dir, 'metrics.log'))
+    metrics_file_handler.setFormatter(formatter)
+    _attach_queue(metrics_logger, [metrics_file_handler])
     metrics_logger.setLevel(logging.INFO)
-    
+
+    atexit.register(stop_logging)
+
     return root_logger, access_logger, metrics_logger
 
 def log_user_action(user_id, action):
     """
     Logs a user action for tracking and auditing purposes.
-    
+
     Args:
         user_id (str): The ID of the user performing the action
         action (str): Description of the action performed
@@ -1,5 +1,9 @@
+from startup import startup_report, start_warm_up, warm_up_encoder
+startup_report.start('import')
+
 from flask import Flask
 from flask_cors import CORS
+import os
 import logging
 import threading
 import queue
@@ -8,12 +12,18 @@ from werkzeug.exceptions import HTTPException
 from flask import jsonify
 
 # Import our custom modules
-from logger import setup_logging
+from logger import setup_logging, restart_logging
+from results_store import create_results_store
+from chroma_instance import ChromaClient
+from embeddings import configure_torch_threads
+from reduction import start_stale_reprojection
 from worker import Worker
 from monitoring import Monitoring
+from profiling import Profiler
 from middleware import RequestMiddleware
 from routes.teacher_assistant import ApiRoutes as ApiRoutesTeacherAssistant
 from routes.similarity_matcher import ApiRoutes as ApiRoutesSimilarityMatcher
+startup_report.finish('import')
 
 # Create the Flask application
 app = Flask(__name__)
@@ -22,12 +32,17 @@ app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
 
-# Enable CORS for all routes and origins with file upload support
+# Enable CORS for all routes and origins with file upload support.
+# asgi.py sends the same headers on the routes it serves itself.
+CORS_METHODS = ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
+CORS_ALLOW_HEADERS = ["Content-Type", "Authorization", "Admin-Key", "X-Profile"]
+CORS_EXPOSE_HEADERS = ["X-Profile-Report"]
 CORS(app, resources={
     r"/*": {
         "origins": "*",
-        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization", "Admin-Key"]
+        "methods": CORS_METHODS,
+        "allow_headers": CORS_ALLOW_HEADERS,
+        "expose_headers": CORS_EXPOSE_HEADERS
     }
 })
 
@@ -41,7 +56,8 @@ CORS(app, resources={
 REQUEST_QUEUE = queue.Queue(maxsize=20)  # Limit queue size to prevent overload
 
 # Dictionary to store results or status for each request_id. Protected by a lock for thread safety.
-RESULTS = {}
+# Under the preforked production server this is a SQLite-backed store shared by all workers.
+RESULTS = create_results_store()
 RESULTS_LOCK = threading.Lock()
 
 @app.route('/')
@@ -49,6 +65,15 @@ def index():
     return {"status": "ok"}, 200
 
 
+@app.route('/ready')
+def ready():
+    """
+    Readiness probe: 503 until the model is loaded and the database is open,
+    with the startup timing report. /health only reports liveness.
+    """
+    return startup_report.readiness()
+
+
 # Global error handler for exceptions
 @app.errorhandler(Exception)
 def handle_exception(e):
@@ -72,7 +97,7 @@ def initialize_app():
     Initialize and configure all components of the application.
     
     Returns:
-        tuple: (worker_thread, api_routes)
+        tuple: (worker, monitoring, request_middleware, api_routes)
     """
     # Set up structured logging
     root_logger, access_logger, metrics_logger = setup_logging()
@@ -84,19 +109,53 @@ def initialize_app():
     # Setup monitoring system
     monitoring = Monitoring(RESULTS, RESULTS_LOCK, REQUEST_QUEUE, worker_thread)
     
+    # On-demand CPU and allocation profiling (admin only)
+    profiler = Profiler()
+    
     # Register middleware
-    RequestMiddleware(app, monitoring)
+    request_middleware = RequestMiddleware(app, monitoring, profiler)
     
     # Register API routes
-    api_routes_teacher_assistant = ApiRoutesTeacherAssistant(app, REQUEST_QUEUE, RESULTS, RESULTS_LOCK, monitoring)
-    api_routes_similarity_matcher = ApiRoutesSimilarityMatcher(app, REQUEST_QUEUE, RESULTS, RESULTS_LOCK, monitoring)
+    api_routes_teacher_assistant = ApiRoutesTeacherAssistant(app, REQUEST_QUEUE, RESULTS, RESULTS_LOCK, monitoring, profiler)
+    api_routes_similarity_matcher = ApiRoutesSimilarityMatcher(app, REQUEST_QUEUE, RESULTS, RESULTS_LOCK, monitoring, profiler)
     api_routes = (api_routes_teacher_assistant, api_routes_similarity_matcher)
     # Initial metrics collection
     monitoring.collect_metrics()
-    
-    return worker_thread, api_routes
 
-worker_thread, api_routes = initialize_app()
+    return worker, monitoring, request_middleware, api_routes
+
+with startup_report.phase('initialize'):
+    worker, monitoring, request_middleware, api_routes = initialize_app()
+worker_thread = worker.worker_thread
+
+# Load the model, open the vector store and reconcile the catalog.
+# Under gunicorn this runs before forking (WARMUP_MODE=sync), so workers start ready.
+start_warm_up()
+
+def post_fork(num_workers):
+    """
+    Re-creates per-process state in a worker forked from a preloaded master.
+    The embedding model is inherited copy-on-write; threads, torch's thread
+    pool and native database handles are not, so they are started or
+    reopened here.
+
+    Args:
+        num_workers (int): Number of worker processes sharing the host
+    """
+    global worker_thread
+    restart_logging()
+    ChromaClient.reset()
+
+    torch_threads = os.environ.get('TORCH_THREADS')
+    configure_torch_threads(torch_threads or (os.cpu_count() or 1) // max(1, num_workers))
+    # The master only loaded the model; torch's thread pool starts here, sized for this worker
+    warm_up_encoder()
+
+    worker_thread = worker.start()
+    monitoring.worker_thread = worker_thread
+
+    # Refit stale projections here rather than in the master, in one worker on the host
+    start_stale_reprojection()
 
 if __name__ == '__main__':
     # Log startup
@@ -111,5 +170,6 @@ if __name__ == '__main__':
     print("🚀 " + "="*60)
     print("🚀 Backend is Running! ✅")
     print("🚀 " + "="*60)
-    # Start the application server
+    # Start the development server. For production use the preforked server:
+    #   gunicorn -c gunicorn.conf.py   (see start_backend_prod.sh)
     app.run(debug=True, host='0.0.0.0', port=8000)
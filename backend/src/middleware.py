@@ -4,7 +4,10 @@
 import time
 import uuid
 import logging
+import threading
 from flask import request
+from logger import should_log_access
+from monitoring import verify_admin_key
 
 # Get reference to logger
 access_logger = logging.getLogger('access')
@@ -13,43 +16,51 @@ class RequestMiddleware:
     """
     Flask middleware for tracking and monitoring requests and responses.
     """
-    def __init__(self, app, monitoring):
+    def __init__(self, app, monitoring, profiler):
         """
         Initialize middleware with the Flask app and monitoring system.
         
         Args:
             app: The Flask application
             monitoring: The monitoring system instance
+            profiler: The profiler used for requests sent with an X-Profile header
         """
         self.app = app
         self.monitoring = monitoring
+        self.profiler = profiler
+        self.last_metrics_time = 0.0
+        self.metrics_lock = threading.Lock()
         
         # Register middleware functions
         app.before_request(self.before_request)
         app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
     
     def before_request(self):
         """
         Processes each request before it reaches the endpoint.
-        Adds tracking information and logs the request.
+        Adds tracking information and starts profiling when requested.
         """
         # Add timing information for performance tracking
         request.start_time = time.time()
         
         # Add a request_id for tracking
         request.request_id = str(uuid.uuid4())
-        
-        # Log each received request
-        user_id = request.form.get('user_id', 'anonymous') if request.method == 'POST' else request.args.get('user_id', 'anonymous')
-        log_data = {
-            'method': request.method,
-            'path': request.path,
-            'ip': request.remote_addr,
-            'user_agent': request.user_agent.string,
-            'user_id': user_id,
-            'request_id': request.request_id
-        }
-        access_logger.info(f"Request received", extra=log_data)
+        self.profiler.request_started()
+        request.counted_in_flight = True
+
+        # Received lines are debug-only; the completed line carries the same fields
+        if access_logger.isEnabledFor(logging.DEBUG):
+            access_logger.debug(f"Request received", extra={
+                'method': request.method,
+                'path': request.path,
+                'request_id': request.request_id
+            })
+
+        # Profile this request when an admin asks for it (X-Profile: cpu|alloc)
+        profile_mode = request.headers.get('X-Profile')
+        if profile_mode and verify_admin_key(request.headers.get('Admin-Key'), "profile a request"):
+            request.profile_session = self.profiler.start_request_profile(profile_mode)
     
     def after_request(self, response):
         """
@@ -65,19 +76,64 @@ class RequestMiddleware:
         # Calculate request duration
         duration = time.time() - request.start_time
         
-        # Log each response
-        log_data = {
-            'method': request.method,
-            'path': request.path,
-            'status': response.status_code,
-            'duration': duration,
-            'request_id': getattr(request, 'request_id', 'unknown')
-        }
-        access_logger.info(f"Request completed", extra=log_data)
+        # Log each response (health/status routes may be sampled, errors never are)
+        if should_log_access(request.path, response.status_code):
+            user_id = request.form.get('user_id', 'anonymous') if request.method == 'POST' else request.args.get('user_id', 'anonymous')
+            log_data = {
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration': duration,
+                'ip': request.remote_addr,
+                'user_agent': request.user_agent.string,
+                'user_id': user_id,
+                'request_id': getattr(request, 'request_id', 'unknown')
+            }
+            access_logger.info(f"Request completed", extra=log_data)
+
+        session = getattr(request, 'profile_session', None)
+        if session is not None:
+            request.profile_session = None
+            try:
+                reports = self.profiler.finish_request_profile(session, request.request_id)
+                response.headers['X-Profile-Report'] = ','.join(reports)
+            except Exception as e:
+                logging.exception(f"Error writing request profile: {e}")
         
-        # Collect metrics every 10 seconds
-        current_time = int(time.time())
-        if current_time % 10 == 0:
-            self.monitoring.collect_metrics()
+        self.collect_metrics_if_due()
         
         return response
+
+    def collect_metrics_if_due(self):
+        """
+        Collects metrics every 10 seconds, in the background: psutil sampling
+        blocks for a while and must not delay the response. Also called by
+        the routes asgi.py serves without Flask.
+        """
+        current_time = time.time()
+        with self.metrics_lock:
+            due = current_time - self.last_metrics_time >= 10
+            if due:
+                self.last_metrics_time = current_time
+        if due:
+            threading.Thread(target=self.monitoring.collect_metrics, daemon=True).start()
+
+    def teardown_request(self, exc):
+        """
+        Counts the request out of the in-flight requests, and stops a
+        profiling session left running when the request failed before
+        after_request could finish it.
+
+        Args:
+            exc: The exception that ended the request, if any
+        """
+        if getattr(request, 'counted_in_flight', False):
+            request.counted_in_flight = False
+            self.profiler.request_finished()
+        session = getattr(request, 'profile_session', None)
+        if session is not None:
+            request.profile_session = None
+            try:
+                self.profiler.finish_request_profile(session, getattr(request, 'request_id', 'unknown'))
+            except Exception as e:
+                logging.exception(f"Error writing request profile: {e}")
@@ -10,10 +10,37 @@ import datetime
 import logging
 import psutil
 from flask import request, jsonify
+from compute_scheduler import get_compute_scheduler
+from result_cache import get_result_cache, get_semantic_cache
+from single_flight import get_single_flight, get_async_single_flight
 
 # Get reference to loggers
 metrics_logger = logging.getLogger('metrics')
 
+def verify_admin_key(admin_key, action="perform admin action"):
+    """
+    Checks an admin key against the ADMIN_KEY environment variable.
+    Unauthorized attempts are logged.
+
+    Args:
+        admin_key (str): Key sent in the Admin-Key header
+        action (str): Description of the protected action, used in the warning
+
+    Returns:
+        bool: True if the key is valid
+    """
+    # Use environment variable for admin key
+    env_admin_key = os.environ.get('ADMIN_KEY')
+    if not env_admin_key:
+        logging.warning("ADMIN_KEY environment variable not set! Using default insecure key.")
+        env_admin_key = 'supersecretadminkey'  # fallback for legacy/testing
+    if admin_key != env_admin_key:
+        logging.warning(f"Unauthorized attempt to {action}",
+                      extra={"ip": request.remote_addr,
+                            "request_id": getattr(request, 'request_id', 'unknown')})
+        return False
+    return True
+
 class Monitoring:
     """
     Handles monitoring and health check functionality for the application.
@@ -66,6 +93,13 @@ class Monitoring:
                     'total_results': total_results,
                     'done_results': done_results,
                     'failed_results': failed_results,
+                },
+                'compute': get_compute_scheduler().stats(),
+                'result_cache': get_result_cache().stats(),
+                'semantic_cache': get_semantic_cache().stats(),
+                'single_flight': {
+                    'threads': get_single_flight().stats(),
+                    'async': get_async_single_flight().stats(),
                 }
             }
             metrics_logger.info(json.dumps(metrics))
@@ -170,6 +204,17 @@ class Monitoring:
                         'total': total_results,
                         'status': results_status
                     }
+                },
+                # Interactive (query) vs bulk (ingestion) encoding lanes
+                'compute': get_compute_scheduler().stats(),
+                # Compare results served from memory
+                'result_cache': get_result_cache().stats(),
+                # Results reused for near-duplicate queries, and the LLM calls this saved
+                'semantic_cache': get_semantic_cache().stats(),
+                # Identical concurrent compare calls served by one computation
+                'single_flight': {
+                    'threads': get_single_flight().stats(),
+                    'async': get_async_single_flight().stats(),
                 }
             })
         except Exception as e:
@@ -187,15 +232,7 @@ class Monitoring:
         Returns:
             tuple: (response_json, http_status_code)
         """
-        # Use environment variable for admin key
-        env_admin_key = os.environ.get('ADMIN_KEY')
-        if not env_admin_key:
-            logging.warning("ADMIN_KEY environment variable not set! Using default insecure key.")
-            env_admin_key = 'supersecretadminkey'  # fallback for legacy/testing
-        if admin_key != env_admin_key:
-            logging.warning("Unauthorized attempt to clear logs", 
-                          extra={"ip": request.remote_addr, 
-                                "request_id": getattr(request, 'request_id', 'unknown')})
+        if not verify_admin_key(admin_key, "clear logs"):
             return jsonify({'error': 'Unauthorized'}), 401
         
         try:
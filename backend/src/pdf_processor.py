@@ -1,24 +1,23 @@
 """
 PDF Problem Extractor - Extracts problems from PDF and stores in ChromaDB
 """
-import fitz  # PyMuPDF
 import re
 import os
 import logging
 import hashlib
-from sentence_transformers import SentenceTransformer
-from chroma_instance import get_chroma_client
-
-# Get the directory where this script is located
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-MODEL_PATH = os.path.join(SCRIPT_DIR, "models", "all-MiniLM-L6-v2")
-
-embedding_model = SentenceTransformer(MODEL_PATH)
-chroma_client = get_chroma_client()
+from chroma_instance import get_chroma_client, find_existing_ids
+from bulk_encoder import encode_bulk
+from project_catalog import get_project_catalog, TEACHER_ASSISTANT
+from chunking import split_documents
+from search_engines import project_changed, hnsw_metadata
+from reduction import reduce_for_project
+from shards import create_project_collection, get_project_collection
+from project_locks import project_write_lock, ProjectBusyError
 
 
 def extract_text_from_pdf(pdf_path):
     """Extract all text from PDF file page by page."""
+    import fitz  # PyMuPDF
     try:
         doc = fitz.open(pdf_path)
         text_content = []
@@ -121,16 +120,21 @@ def extract_problems_from_text(text_content):
     return problems
 
 
-def process_pdf_to_project(pdf_path, project_name):
+def process_pdf_to_project(pdf_path, project_name, index_params=None, shards=1):
     """
     Main function: Extract problems from PDF and save to ChromaDB collection.
 
     Args:
         pdf_path: Path to PDF file
         project_name: Name of the project/collection
+        index_params: HNSW parameters (M, construction_ef, search_ef) of a new collection
+        shards: Number of shard collections of a new project
 
     Returns:
         dict with success status and problem count
+
+    Raises:
+        ProjectBusyError: If the project is being rebuilt
     """
     try:
         logging.info(f"Processing PDF for project: {project_name}")
@@ -143,79 +147,90 @@ def process_pdf_to_project(pdf_path, project_name):
         # Step 2: Extract problems
         problems = extract_problems_from_text(text_content)
 
-        # Step 3: Create or get ChromaDB collection (even if 0 problems for now)
-        existing_collections = [c.name for c in chroma_client.list_collections()]
-
-        if project_name in existing_collections:
-            collection = chroma_client.get_collection(name=project_name)
-            existing_ids = set(collection.get()['ids'])
-            logging.info(f"Using existing collection '{project_name}' with {len(existing_ids)} items")
-        else:
-            collection = chroma_client.create_collection(
-                name=project_name,
-                embedding_function=None,
-                metadata={"hnsw:space": "cosine", "type": "teacher_assistant"}
+        # Held from here on: a rebuild must not swap the collection while problems are written
+        with project_write_lock(project_name):
+            # Step 3: Create or get ChromaDB collection (even if 0 problems for now)
+            chroma_client = get_chroma_client()
+            project_exists = chroma_client.has_collection(project_name)
+            if project_exists:
+                collection = get_project_collection(project_name)
+                logging.info(f"Using existing collection '{project_name}' with {collection.count()} items")
+            else:
+                collection = create_project_collection(
+                    project_name,
+                    {"hnsw:space": "cosine", "type": "teacher_assistant", **hnsw_metadata(index_params)},
+                    shards
+                )
+                logging.info(f"Created new collection '{project_name}' ({shards} shard(s))")
+            get_project_catalog().register_project(project_name, TEACHER_ASSISTANT,
+                                                   {'shards': shards} if shards > 1 and not project_exists else None)
+
+            # If no problems extracted, return early but still success (collection exists)
+            if not problems:
+                return {
+                    'success': True,
+                    'error': 'No problems could be extracted from PDF. Try a different PDF with clearer text.',
+                    'problems_count': 0,
+                    'message': f"Project '{project_name}' created but no problems were extracted"
+                }
+
+            # Step 4: Prepare data with deduplication
+            documents = []
+            ids = []
+            metadatas = []
+            seen_ids_in_batch = set()  # Track IDs in current batch to avoid duplicates
+
+            # Create unique IDs based on content hash
+            problem_ids = [hashlib.md5(problem['text'].encode()).hexdigest()[:16] for problem in problems]
+            # Look up only these candidates in the database, in bounded batches
+            existing_ids = find_existing_ids(collection, list(set(problem_ids))) if project_exists else set()
+
+            for problem, problem_id in zip(problems, problem_ids):
+                # Skip if already in database OR already added to current batch
+                if problem_id not in existing_ids and problem_id not in seen_ids_in_batch:
+                    documents.append(problem['full_text'])
+                    ids.append(problem_id)
+                    metadatas.append({
+                        'page': str(problem['page']),
+                        'preview': problem['text'],
+                        'type': 'problem'
+                    })
+                    seen_ids_in_batch.add(problem_id)  # Mark as processed in this batch
+
+            if not documents:
+                return {
+                    'success': True,
+                    'message': 'All problems already exist in project',
+                    'problems_count': 0,
+                    'total_problems': len(problems)
+                }
+
+            # Step 5: Split long problems into token-budgeted windows, embed and add to ChromaDB
+            window_ids, window_documents, window_metadatas, chunked = split_documents(ids, documents, metadatas)
+            embeddings_list = reduce_for_project(project_name, encode_bulk(window_documents)).tolist()
+
+            collection.add(
+                documents=window_documents,
+                ids=window_ids,
+                embeddings=embeddings_list,
+                metadatas=window_metadatas
             )
-            existing_ids = set()
-            logging.info(f"Created new collection '{project_name}'")
-
-        # If no problems extracted, return early but still success (collection exists)
-        if not problems:
-            return {
-                'success': True,
-                'error': 'No problems could be extracted from PDF. Try a different PDF with clearer text.',
-                'problems_count': 0,
-                'message': f"Project '{project_name}' created but no problems were extracted"
-            }
 
-        # Step 4: Prepare data with deduplication
-        documents = []
-        ids = []
-        metadatas = []
-        seen_ids_in_batch = set()  # Track IDs in current batch to avoid duplicates
-
-        for i, problem in enumerate(problems):
-            # Create unique ID based on content hash
-            problem_id = hashlib.md5(problem['text'].encode()).hexdigest()[:16]
-
-            # Skip if already in database OR already added to current batch
-            if problem_id not in existing_ids and problem_id not in seen_ids_in_batch:
-                documents.append(problem['full_text'])
-                ids.append(problem_id)
-                metadatas.append({
-                    'page': str(problem['page']),
-                    'preview': problem['text'],
-                    'type': 'problem'
-                })
-                seen_ids_in_batch.add(problem_id)  # Mark as processed in this batch
+            if chunked:
+                get_project_catalog().update_settings(project_name, {'chunked': True})
+            get_project_catalog().record_ingest(project_name, len(documents))
+            project_changed(project_name, added_ids=window_ids)
+            logging.info(f"Added {len(documents)} new problems to '{project_name}'")
 
-        if not documents:
             return {
                 'success': True,
-                'message': 'All problems already exist in project',
-                'problems_count': 0,
-                'total_problems': len(problems)
+                'problems_count': len(documents),
+                'total_problems': len(problems),
+                'message': f'Successfully processed {len(documents)} problems'
             }
 
-        # Step 5: Generate embeddings and add to ChromaDB
-        embeddings_list = embedding_model.encode(documents).tolist()
-
-        collection.add(
-            documents=documents,
-            ids=ids,
-            embeddings=embeddings_list,
-            metadatas=metadatas
-        )
-
-        logging.info(f"Added {len(documents)} new problems to '{project_name}'")
-
-        return {
-            'success': True,
-            'problems_count': len(documents),
-            'total_problems': len(problems),
-            'message': f'Successfully processed {len(documents)} problems'
-        }
-
+    except ProjectBusyError:
+        raise
     except Exception as e:
         logging.exception(f"Error processing PDF: {e}")
         return {
@@ -0,0 +1,383 @@
+# profiling.py
+# This module provides on-demand profiling of the running application.
+# It supports sampling CPU profiles of a single request or of a time-boxed
+# window, deterministic cProfile dumps (pstats) and tracemalloc allocation
+# snapshots. Reports are written to logs/profiles and can be downloaded
+# through the admin endpoints.
+
+import os
+import sys
+import time
+import uuid
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from flask import jsonify, send_from_directory
+from monitoring import verify_admin_key
+
+PROFILE_DIR = os.path.join(os.path.dirname(__file__), 'logs', 'profiles')
+
+# Upper bound for a profiling window so an admin call cannot pin a thread forever
+MAX_WINDOW_SECONDS = float(os.environ.get('PROFILE_MAX_WINDOW_SECONDS', 120))
+DEFAULT_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+TRACEMALLOC_FRAMES = int(os.environ.get('PROFILE_TRACEMALLOC_FRAMES', 25))
+ALLOCATION_TOP_N = 50
+
+PROFILE_MODES = ('cpu', 'alloc')
+
+
+def _collapse_stack(frame):
+    """
+    Converts a frame chain to a collapsed-stack line (root first, ';' separated),
+    the input format of flamegraph.pl and speedscope.
+    """
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(parts))
+
+
+class StackSampler:
+    """
+    Samples the Python stacks of the selected threads at a fixed interval from a
+    background thread and aggregates them as collapsed stacks.
+    """
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL, thread_ids=None, exclude_ids=None):
+        """
+        Args:
+            interval (float): Seconds between two samples
+            thread_ids (set): Thread idents to sample, or None for all threads
+            exclude_ids (set): Thread idents never to sample
+        """
+        self.interval = interval
+        self.thread_ids = set(thread_ids) if thread_ids else None
+        self.exclude_ids = set(exclude_ids) if exclude_ids else set()
+        self.counts = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops sampling.
+
+        Returns:
+            Counter: Mapping of collapsed stack to number of samples
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.counts
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or thread_id in self.exclude_ids:
+                    continue
+                if self.thread_ids is not None and thread_id not in self.thread_ids:
+                    continue
+                self.counts[_collapse_stack(frame)] += 1
+            self.samples += 1
+
+
+class RequestProfile:
+    """
+    Profiling session attached to a single request.
+    """
+    def __init__(self, mode, interval=DEFAULT_SAMPLE_INTERVAL, requests_started=0):
+        """
+        Args:
+            mode (str): 'cpu' or 'alloc'
+            interval (float): Sampling interval for CPU mode
+            requests_started (int): Requests started in the process so far, to
+                tell how many others overlapped an allocation profile
+        """
+        self.mode = mode
+        self.started = time.time()
+        self.requests_started = requests_started
+        self.sampler = None
+        self.cprofile = None
+        self.snapshot_before = None
+
+        if mode == 'cpu':
+            self.sampler = StackSampler(interval, thread_ids={threading.get_ident()})
+            self.sampler.start()
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        elif mode == 'alloc':
+            self.snapshot_before = tracemalloc.take_snapshot()
+
+    def stop(self):
+        """
+        Stops profiling and returns the raw results.
+
+        Returns:
+            dict: Collected data for the session mode
+        """
+        data = {'duration': time.time() - self.started}
+        if self.mode == 'cpu':
+            self.cprofile.disable()
+            data['stacks'] = self.sampler.stop()
+            data['cprofile'] = self.cprofile
+        elif self.mode == 'alloc':
+            snapshot_after = tracemalloc.take_snapshot()
+            data['stats'] = snapshot_after.compare_to(self.snapshot_before, 'traceback')
+        return data
+
+
+class Profiler:
+    """
+    Coordinates profiling sessions and stores their reports on disk.
+    """
+    def __init__(self, profile_dir=PROFILE_DIR):
+        """
+        Args:
+            profile_dir (str): Directory where reports are written
+        """
+        self.profile_dir = profile_dir
+        os.makedirs(self.profile_dir, exist_ok=True)
+        # Only one window profile can run at a time
+        self.window_lock = threading.Lock()
+        # tracemalloc is process global, so it is reference counted across sessions
+        self.tracemalloc_lock = threading.Lock()
+        self.tracemalloc_users = 0
+        # Whether the profiler started tracemalloc, and so is the one to stop it
+        self.tracemalloc_owned = False
+        # Requests in flight and started, kept by the request middleware
+        self.requests_lock = threading.Lock()
+        self.requests_in_flight = 0
+        self.requests_started = 0
+
+    def request_started(self):
+        with self.requests_lock:
+            self.requests_in_flight += 1
+            self.requests_started += 1
+
+    def request_finished(self):
+        with self.requests_lock:
+            self.requests_in_flight -= 1
+
+    def start_request_profile(self, mode):
+        """
+        Starts profiling the current request on the current thread.
+
+        tracemalloc sees every allocation of the process, so an allocation
+        profile is only started when no other request is in flight; requests
+        arriving while it runs are counted in its report.
+
+        Args:
+            mode (str): 'cpu' or 'alloc'
+
+        Returns:
+            RequestProfile: The session, or None if the mode is unknown, a
+                window is running, or (alloc) other requests are in flight
+        """
+        if mode not in PROFILE_MODES or self.window_lock.locked():
+            return None
+        with self.requests_lock:
+            # The profiled request itself is in flight
+            if mode == 'alloc' and self.requests_in_flight > 1:
+                logging.info("Allocation profile refused: other requests are in flight")
+                return None
+            requests_started = self.requests_started
+        if mode == 'alloc':
+            self._acquire_tracemalloc()
+        return RequestProfile(mode, requests_started=requests_started)
+
+    def finish_request_profile(self, session, request_id):
+        """
+        Stops a request profiling session and writes its reports.
+
+        Args:
+            session (RequestProfile): The running session
+            request_id (str): ID of the profiled request, used in report names
+
+        Returns:
+            list: Names of the written report files
+        """
+        try:
+            data = session.stop()
+        finally:
+            if session.mode == 'alloc':
+                self._release_tracemalloc()
+        if session.mode == 'alloc':
+            with self.requests_lock:
+                data['overlapping_requests'] = self.requests_started - session.requests_started
+        base_name = f"request-{request_id}"
+        if session.mode == 'cpu':
+            return self._write_cpu_reports(base_name, data)
+        return self._write_alloc_reports(base_name, data)
+
+    def profile_window(self, seconds, mode='cpu', interval=DEFAULT_SAMPLE_INTERVAL):
+        """
+        Profiles the whole process for a bounded amount of time.
+        CPU mode samples all threads; alloc mode traces allocations made during the window.
+
+        Args:
+            seconds (float): Length of the window, capped at MAX_WINDOW_SECONDS
+            mode (str): 'cpu' or 'alloc'
+            interval (float): Sampling interval for CPU mode
+
+        Returns:
+            list: Names of the written report files, or None if another window is running
+        """
+        seconds = max(0.1, min(float(seconds), MAX_WINDOW_SECONDS))
+        if not self.window_lock.acquire(blocking=False):
+            return None
+        try:
+            base_name = f"window-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+            if mode == 'cpu':
+                sampler = StackSampler(interval, exclude_ids={threading.get_ident()})
+                sampler.start()
+                time.sleep(seconds)
+                data = {'duration': seconds, 'stacks': sampler.stop()}
+                return self._write_cpu_reports(base_name, data)
+
+            self._acquire_tracemalloc()
+            try:
+                snapshot_before = tracemalloc.take_snapshot()
+                time.sleep(seconds)
+                snapshot_after = tracemalloc.take_snapshot()
+            finally:
+                self._release_tracemalloc()
+            snapshot_after.dump(os.path.join(self.profile_dir, f"{base_name}.tracemalloc"))
+            data = {'duration': seconds, 'stats': snapshot_after.compare_to(snapshot_before, 'traceback')}
+            return self._write_alloc_reports(base_name, data) + [f"{base_name}.tracemalloc"]
+        finally:
+            self.window_lock.release()
+
+    def list_reports(self):
+        """
+        Lists the stored report files, newest first.
+
+        Returns:
+            list: Report file names
+        """
+        files = [f for f in os.listdir(self.profile_dir) if os.path.isfile(os.path.join(self.profile_dir, f))]
+        return sorted(files, key=lambda f: os.path.getmtime(os.path.join(self.profile_dir, f)), reverse=True)
+
+    def run_window(self, admin_key, params):
+        """
+        Administrative endpoint handler that profiles a time-boxed window.
+
+        Args:
+            admin_key (str): Authentication key for admin operations
+            params: Request arguments with 'seconds', 'mode' and 'interval'
+
+        Returns:
+            tuple: (response_json, http_status_code)
+        """
+        if not verify_admin_key(admin_key, "run a profile window"):
+            return jsonify({'error': 'Unauthorized'}), 401
+
+        mode = params.get('mode', 'cpu')
+        if mode not in PROFILE_MODES:
+            return jsonify({'error': f"Invalid mode '{mode}'. Use one of {list(PROFILE_MODES)}."}), 400
+        try:
+            seconds = float(params.get('seconds', 10))
+            interval = float(params.get('interval', DEFAULT_SAMPLE_INTERVAL))
+        except ValueError:
+            return jsonify({'error': "'seconds' and 'interval' must be numbers."}), 400
+
+        try:
+            reports = self.profile_window(seconds, mode, max(interval, 0.001))
+        except Exception as e:
+            logging.exception(f"Error running profile window: {e}")
+            return jsonify({'error': 'Failed to run profile window'}), 500
+        if reports is None:
+            return jsonify({'error': 'Another profile window is already running'}), 409
+
+        return jsonify({
+            'status': 'success',
+            'mode': mode,
+            'seconds': min(seconds, MAX_WINDOW_SECONDS),
+            'reports': reports
+        })
+
+    def get_reports(self, admin_key):
+        """
+        Administrative endpoint handler that lists stored profile reports.
+
+        Args:
+            admin_key (str): Authentication key for admin operations
+
+        Returns:
+            tuple: (response_json, http_status_code)
+        """
+        if not verify_admin_key(admin_key, "list profile reports"):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return jsonify({'reports': self.list_reports()})
+
+    def download_report(self, admin_key, filename):
+        """
+        Administrative endpoint handler that downloads a profile report.
+
+        Args:
+            admin_key (str): Authentication key for admin operations
+            filename (str): Name of the report file
+
+        Returns:
+            Response: The report file as an attachment
+        """
+        if not verify_admin_key(admin_key, "download a profile report"):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return send_from_directory(self.profile_dir, filename, as_attachment=True)
+
+    def _acquire_tracemalloc(self):
+        with self.tracemalloc_lock:
+            if self.tracemalloc_users == 0:
+                # Tracing started by someone else (e.g. PYTHONTRACEMALLOC) is left running
+                self.tracemalloc_owned = not tracemalloc.is_tracing()
+                if self.tracemalloc_owned:
+                    tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.tracemalloc_users += 1
+
+    def _release_tracemalloc(self):
+        with self.tracemalloc_lock:
+            self.tracemalloc_users -= 1
+            if self.tracemalloc_users == 0 and self.tracemalloc_owned:
+                tracemalloc.stop()
+                self.tracemalloc_owned = False
+
+    def _write_cpu_reports(self, base_name, data):
+        reports = []
+        collapsed_name = f"{base_name}.collapsed"
+        with open(os.path.join(self.profile_dir, collapsed_name), 'w', encoding='utf-8') as f:
+            for stack, count in data['stacks'].most_common():
+                f.write(f"{stack} {count}\n")
+        reports.append(collapsed_name)
+
+        if data.get('cprofile') is not None:
+            pstats_name = f"{base_name}.pstats"
+            data['cprofile'].dump_stats(os.path.join(self.profile_dir, pstats_name))
+            reports.append(pstats_name)
+
+        logging.info(f"CPU profile written: {reports}", extra={"duration": data['duration']})
+        return reports
+
+    def _write_alloc_reports(self, base_name, data):
+        report_name = f"{base_name}.alloc.txt"
+        stats = data['stats']
+        total = sum(stat.size_diff for stat in stats)
+        with open(os.path.join(self.profile_dir, report_name), 'w', encoding='utf-8') as f:
+            f.write(f"duration_seconds: {data['duration']:.3f}\n")
+            if 'overlapping_requests' in data:
+                # Their allocations are in the report too
+                f.write(f"overlapping_requests: {data['overlapping_requests']}\n")
+            f.write(f"net_allocated_bytes: {total}\n\n")
+            for stat in stats[:ALLOCATION_TOP_N]:
+                f.write(f"{stat.size_diff:+d} B ({stat.count_diff:+d} blocks), total {stat.size} B\n")
+                for line in stat.traceback.format():
+                    f.write(f"    {line}\n")
+                f.write("\n")
+        logging.info(f"Allocation profile written: {report_name}", extra={"duration": data['duration']})
+        return [report_name]
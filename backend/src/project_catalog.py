@@ -0,0 +1,293 @@
+# project_catalog.py
+# This module keeps a lightweight catalog of projects next to the Chroma
+# database: name, type, document count, creation/update times and the model
+# version that produced the vectors. Ingestion and deletion keep it current,
+# so listing and validating projects costs O(#projects) instead of reading
+# every document of every collection. Each project also carries a write
+# version, bumped whenever its documents change, which caches of query
+# results compare against. Collections created or dropped behind the
+# catalog's back (by scripts, or by hand) are picked up by reconcile(), at
+# startup and again, at most every CATALOG_RECONCILE_INTERVAL seconds, when
+# a project is not found or the projects are listed.
+
+import os
+import json
+import time
+import logging
+import datetime
+import threading
+from sqlite_store import SqliteStore
+from embeddings import MODEL_VERSION
+from chroma_instance import is_internal_collection, owning_project, get_chroma_client, REBUILD_SUFFIX
+from project_locks import project_rebuild_lock, ProjectBusyError
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CATALOG_PATH = os.path.join(SCRIPT_DIR, "database", "project_catalog.sqlite3")
+# Minimum seconds between two reconciles triggered by lookups; 0 disables them
+CATALOG_RECONCILE_INTERVAL = float(os.environ.get('CATALOG_RECONCILE_INTERVAL', 60))
+
+# Project types
+SIMILARITY_MATCHER = 'similarity_matcher'
+TEACHER_ASSISTANT = 'teacher_assistant'
+
+_COLUMNS = ('name', 'type', 'document_count', 'created_at', 'updated_at', 'model_version', 'settings', 'write_version')
+
+
+def _now():
+    return datetime.datetime.now().isoformat()
+
+
+class ProjectCatalog(SqliteStore):
+    """
+    SQLite-backed catalog with one row per project.
+    """
+    def __init__(self, path=CATALOG_PATH):
+        """
+        Args:
+            path (str): Location of the catalog database file
+        """
+        super().__init__(path)
+        self._reconciled_at = None
+        self._reconcile_lock = threading.Lock()
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS projects ('
+            'name TEXT PRIMARY KEY, type TEXT NOT NULL, document_count INTEGER NOT NULL DEFAULT 0, '
+            'created_at TEXT NOT NULL, updated_at TEXT NOT NULL, model_version TEXT, settings TEXT, '
+            'write_version INTEGER NOT NULL DEFAULT 0)'
+        )
+        columns = {row[1] for row in self._connection().execute('PRAGMA table_info(projects)')}
+        if 'write_version' not in columns:
+            # Catalogs created before write versions existed
+            self._connection().execute('ALTER TABLE projects ADD COLUMN write_version INTEGER NOT NULL DEFAULT 0')
+
+    def _row_to_dict(self, row):
+        project = dict(zip(_COLUMNS, row))
+        project['settings'] = json.loads(project['settings']) if project['settings'] else {}
+        return project
+
+    def register_project(self, name, project_type, settings=None):
+        """
+        Adds a project if it is not in the catalog yet.
+
+        Args:
+            name (str): Project (collection) name
+            project_type (str): SIMILARITY_MATCHER or TEACHER_ASSISTANT
+            settings (dict): Per-project options chosen at creation time
+        """
+        now = _now()
+        self._connection().execute(
+            'INSERT OR IGNORE INTO projects (name, type, document_count, created_at, updated_at, model_version, settings) '
+            'VALUES (?, ?, 0, ?, ?, ?, ?)',
+            (name, project_type, now, now, MODEL_VERSION, json.dumps(settings or {}))
+        )
+
+    def record_ingest(self, name, added_count):
+        """
+        Adds newly ingested documents to a project's count.
+
+        Args:
+            name (str): Project name
+            added_count (int): Number of documents added
+        """
+        self._connection().execute(
+            'UPDATE projects SET document_count = document_count + ?, updated_at = ? WHERE name = ?',
+            (added_count, _now(), name)
+        )
+
+    def set_document_count(self, name, count):
+        self._connection().execute(
+            'UPDATE projects SET document_count = ?, updated_at = ? WHERE name = ?',
+            (count, _now(), name)
+        )
+
+    def set_model_version(self, name, model_version):
+        """
+        Records that a project's vectors were re-encoded with another model.
+        """
+        self._connection().execute(
+            'UPDATE projects SET model_version = ?, updated_at = ? WHERE name = ?',
+            (model_version, _now(), name)
+        )
+
+    def bump_write_version(self, name):
+        """
+        Records that a project's documents were added, changed or deleted.
+        Cached results computed at an older write version are never served again.
+        """
+        self._connection().execute(
+            'UPDATE projects SET write_version = write_version + 1, updated_at = ? WHERE name = ?',
+            (_now(), name)
+        )
+
+    def update_settings(self, name, settings):
+        """
+        Merges values into a project's settings.
+
+        Args:
+            name (str): Project name
+            settings (dict): Keys to add or replace
+        """
+        conn = self._connection()
+        # Write lock for the read-modify-write, other threads and processes included
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT settings FROM projects WHERE name = ?', (name,)).fetchone()
+            if row is not None:
+                merged = {**(json.loads(row[0]) if row[0] else {}), **settings}
+                conn.execute(
+                    'UPDATE projects SET settings = ?, updated_at = ? WHERE name = ?',
+                    (json.dumps(merged), _now(), name)
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def remove_project(self, name):
+        self._connection().execute('DELETE FROM projects WHERE name = ?', (name,))
+
+    def get_project(self, name):
+        """
+        Returns:
+            dict: The catalog entry, or None if the project is unknown; an
+                unknown name first triggers a reconcile when one is due
+        """
+        project = self._get_project(name)
+        if project is None and not is_internal_collection(name) and self.reconcile_if_due():
+            project = self._get_project(name)
+        return project
+
+    def _get_project(self, name):
+        row = self._connection().execute(
+            f'SELECT {", ".join(_COLUMNS)} FROM projects WHERE name = ?', (name,)
+        ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def list_projects(self, project_type=None):
+        """
+        Args:
+            project_type (str): Only return projects of this type, or None for all
+
+        Returns:
+            list: Catalog entries ordered by name
+        """
+        self.reconcile_if_due()
+        return self._list_projects(project_type)
+
+    def _list_projects(self, project_type=None):
+        query = f'SELECT {", ".join(_COLUMNS)} FROM projects'
+        params = ()
+        if project_type:
+            query += ' WHERE type = ?'
+            params = (project_type,)
+        rows = self._connection().execute(query + ' ORDER BY name', params).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def reconcile(self, chroma_client):
+        """
+        Brings the catalog in line with the collections in the vector store:
+        collections created before the catalog existed (or by scripts) are
+        added, entries whose collection is gone are removed. Only new
+        collections are inspected, with a count and a one-document peek.
+        Rebuilds interrupted by a crash are finished or rolled back first,
+        so a project caught between deleting its old collection and renaming
+        the new one keeps its entry.
+
+        Args:
+            chroma_client: The Chroma client
+        """
+        self._reconciled_at = time.monotonic()
+        collections = {c.name: c for c in chroma_client.list_collections()}
+        if any(name.endswith(REBUILD_SUFFIX) for name in collections):
+            self._recover_rebuilds(chroma_client, collections)
+            collections = {c.name: c for c in chroma_client.list_collections()}
+        known = {p['name'] for p in self._list_projects()}
+
+        for name in known - set(collections):
+            self.remove_project(name)
+            logging.info(f"Removed stale catalog entry: {name}")
+
+        for name in set(collections) - known:
+            if is_internal_collection(name):
+                continue
+            collection = collections[name]
+            try:
+                project_type = SIMILARITY_MATCHER
+                if (collection.metadata or {}).get('type') == TEACHER_ASSISTANT:
+                    project_type = TEACHER_ASSISTANT
+                else:
+                    first = collection.get(limit=1, include=['metadatas'])
+                    metadatas = first.get('metadatas') or []
+                    if metadatas and (metadatas[0] or {}).get('type') == 'problem':
+                        project_type = TEACHER_ASSISTANT
+                # Shard 0 of a sharded project records the shard count in its metadata
+                shards = int((collection.metadata or {}).get('shards', 1))
+                self.register_project(name, project_type, {'shards': shards} if shards > 1 else None)
+                self.set_document_count(name, collection.count())
+                logging.info(f"Added existing collection to catalog: {name} ({project_type})")
+            except Exception as e:
+                logging.warning(f"Error cataloguing collection {name}: {e}")
+
+    def _recover_rebuilds(self, chroma_client, collections):
+        """
+        A rebuild copies a collection into '<name>__rebuild', deletes the
+        original and renames the copy. A copy whose original is gone is
+        complete and takes the original's place; a copy next to its original
+        never replaced it and is dropped. Copies of projects being rebuilt
+        right now are left alone.
+        """
+        for temporary in [name for name in collections if name.endswith(REBUILD_SUFFIX)]:
+            name = temporary[:-len(REBUILD_SUFFIX)]
+            try:
+                with project_rebuild_lock(owning_project(temporary), wait_seconds=0):
+                    if name in collections:
+                        chroma_client.delete_collection(temporary)
+                        logging.warning(f"Dropped the copy of an interrupted rebuild: {temporary}")
+                    else:
+                        collections[temporary].modify(name=name)
+                        logging.warning(f"Finished an interrupted rebuild: {temporary} renamed to {name}")
+            except ProjectBusyError:
+                continue
+            except Exception as e:
+                logging.warning(f"Error recovering interrupted rebuild {temporary}: {e}")
+        chroma_client.invalidate()
+
+    def _reconcile_due(self):
+        return self._reconciled_at is None or time.monotonic() - self._reconciled_at >= CATALOG_RECONCILE_INTERVAL
+
+    def reconcile_if_due(self):
+        """
+        Reconciles with the vector store if the last reconcile is more than
+        CATALOG_RECONCILE_INTERVAL seconds old. Callers arriving while one
+        runs do not wait for it.
+
+        Returns:
+            bool: Whether a reconcile ran
+        """
+        if CATALOG_RECONCILE_INTERVAL <= 0 or not self._reconcile_due():
+            return False
+        if not self._reconcile_lock.acquire(blocking=False):
+            return False
+        try:
+            if not self._reconcile_due():
+                return False
+            self.reconcile(get_chroma_client())
+            return True
+        except Exception as e:
+            logging.warning(f"Catalog reconcile failed: {e}")
+            return False
+        finally:
+            self._reconcile_lock.release()
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_project_catalog():
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = ProjectCatalog()
+    return _catalog
@@ -0,0 +1,135 @@
+# project_locks.py
+# This module holds the per-project locks that keep writes away from a
+# collection while it is being replaced. Rebuilding a project (new HNSW
+# parameters, re-projected vectors) copies it into a new collection and
+# swaps that in; a document written to the old collection during the copy
+# would be lost. Ingestion, sync and deletion therefore take the project's
+# write lock, shared among themselves, and a rebuild takes it exclusively.
+# Ingestion arriving during a rebuild is refused with ProjectBusyError
+# rather than queued, since a rebuild can take minutes. The locks are flock
+# locks on files next to the database, so every worker process sees them
+# and a process that dies releases its locks with it.
+
+import os
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+from chroma_instance import DB_PATH
+
+LOCK_DIR = os.path.join(DB_PATH, "locks")
+# Seconds a rebuild waits for running ingestions to finish before giving up
+PROJECT_LOCK_WAIT_SECONDS = float(os.environ.get('PROJECT_LOCK_WAIT_SECONDS', 30))
+_POLL_SECONDS = 0.05
+
+_held = threading.local()
+
+
+class ProjectBusyError(Exception):
+    """
+    Raised when a project's lock is held by a conflicting operation.
+    """
+
+
+def _held_locks():
+    # lock file name -> exclusive flag, for the locks the current thread holds;
+    # a forked child starts with none, the locks belong to its parent's thread
+    if getattr(_held, 'pid', None) != os.getpid():
+        _held.locks = {}
+        _held.pid = os.getpid()
+    return _held.locks
+
+
+@contextmanager
+def _project_lock(project_name, exclusive, wait_seconds, action, kind=None):
+    # "#" cannot occur in a collection name, so a kind never collides with another project
+    key = f"{project_name}#{kind}.lock" if kind else f"{project_name}.lock"
+    held = _held_locks()
+    if key in held and (held[key] or not exclusive):
+        # Already held by this thread, at least as strongly: nested calls pass through
+        yield
+        return
+
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    lock_file = open(os.path.join(LOCK_DIR, key), 'a')
+    try:
+        mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            try:
+                fcntl.flock(lock_file, mode | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise ProjectBusyError(f"Project '{project_name}' is being {action}; try again later.")
+                time.sleep(_POLL_SECONDS)
+        held[key] = exclusive
+        try:
+            yield
+        finally:
+            del held[key]
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    finally:
+        lock_file.close()
+
+
+def project_write_lock(project_name):
+    """
+    Held while documents of a project are added, changed or deleted. Other
+    writers may hold it at the same time; a rebuild may not.
+
+    Raises:
+        ProjectBusyError: If the project is being rebuilt
+    """
+    return _project_lock(project_name, False, 0, 'rebuilt')
+
+
+def project_rebuild_lock(project_name, wait_seconds=PROJECT_LOCK_WAIT_SECONDS):
+    """
+    Held while a project's collection is replaced, or its catalog entry and
+    collection must change together. Excludes every other writer.
+
+    Args:
+        wait_seconds (float): How long to wait for running writes to finish
+
+    Raises:
+        ProjectBusyError: If writes are still running after wait_seconds
+    """
+    return _project_lock(project_name, True, wait_seconds, 'written to')
+
+
+def project_index_lock(project_name, wait_seconds=PROJECT_LOCK_WAIT_SECONDS):
+    """
+    Held while a project's search engine index is built or appended to, so
+    two updates of it never publish over each other. Taken after the
+    project's write or rebuild lock, never before.
+
+    Args:
+        wait_seconds (float): How long to wait for a running update to finish
+
+    Raises:
+        ProjectBusyError: If the index is still being updated after wait_seconds
+    """
+    return _project_lock(project_name, True, wait_seconds, 'indexed', kind='index')
+
+
+@contextmanager
+def host_task_lock(task_name):
+    """
+    Lets one process on the host run a maintenance task at a time; the
+    others skip it instead of waiting.
+
+    Yields:
+        bool: True in the process holding the lock, False elsewhere
+    """
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    with open(os.path.join(LOCK_DIR, f"{task_name}.task.lock"), 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,168 @@
+# project_schema.py
+# This module describes how the columns of an uploaded table are used by a
+# similarity-matcher project: embedded into the document text, stored as
+# filterable metadata, or dropped. The schema is chosen at createProject
+# time and kept in the project catalog; ingestion reads only the columns it
+# names and compare validates metadata filters against it.
+
+import json
+from chunking import CHUNK_METADATA_PREFIX
+
+SCHEMA_KEYS = ('embed', 'metadata', 'drop')
+
+# Metadata keys the ingestion adds itself, always available to filters
+SYSTEM_METADATA_KEYS = ('row_id', 'row_hash')
+
+
+def parse_schema(value):
+    """
+    Parses and validates a schema given as JSON, e.g.
+    {"embed": ["title", "description"], "metadata": ["sku", "price"], "drop": ["notes"]}.
+    'embed' and 'metadata' default to every column not dropped.
+
+    Args:
+        value (str|dict): The schema, or None/'' for no schema
+
+    Returns:
+        dict: The normalised schema (only the keys that were given), or None
+
+    Raises:
+        ValueError: If the schema is malformed
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Schema is not valid JSON: {e}")
+    if not isinstance(value, dict):
+        raise ValueError("Schema must be a JSON object")
+
+    unknown = [k for k in value if k not in SCHEMA_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown schema keys {unknown}. Allowed: {list(SCHEMA_KEYS)}.")
+
+    schema = {}
+    for key in SCHEMA_KEYS:
+        if key not in value:
+            continue
+        columns = value[key]
+        if not isinstance(columns, list) or not all(isinstance(c, str) and c.strip() for c in columns):
+            raise ValueError(f"Schema '{key}' must be a list of column names")
+        schema[key] = list(dict.fromkeys(c.strip() for c in columns))
+        reserved = [c for c in schema[key] if c.startswith(CHUNK_METADATA_PREFIX)]
+        if reserved:
+            raise ValueError(f"Column names starting with '{CHUNK_METADATA_PREFIX}' are reserved: {reserved}")
+
+    if 'embed' in schema and not schema['embed']:
+        raise ValueError("Schema 'embed' must name at least one column")
+    overlap = set(schema.get('drop', ())) & (set(schema.get('embed', ())) | set(schema.get('metadata', ())))
+    if overlap:
+        raise ValueError(f"Columns both dropped and used: {sorted(overlap)}")
+    return schema or None
+
+
+def schema_columns(schema):
+    """
+    Returns:
+        list: The columns the schema needs read, or None if it needs every column
+    """
+    if not schema or 'embed' not in schema or 'metadata' not in schema:
+        return None
+    return list(dict.fromkeys(schema['embed'] + schema['metadata']))
+
+
+def resolve_schema(schema, header):
+    """
+    Applies a schema to the columns of a file.
+
+    Args:
+        schema (dict): The project schema, or None
+        header (list): Column names of the file
+
+    Returns:
+        tuple: (embed_columns, metadata_columns)
+
+    Raises:
+        ValueError: If the schema names a column missing from the file, or a
+            column stored as metadata has a reserved name
+    """
+    if not schema:
+        _check_reserved(header)
+        return list(header), list(header)
+    named = [c for key in ('embed', 'metadata') for c in schema.get(key, ())]
+    missing = [c for c in dict.fromkeys(named) if c not in header]
+    if missing:
+        raise ValueError(f"Schema columns not found in file: {missing}")
+
+    kept = [c for c in header if c not in set(schema.get('drop', ()))]
+    embed_columns = schema.get('embed', kept)
+    metadata_columns = schema.get('metadata', kept)
+    if not embed_columns:
+        raise ValueError("Schema leaves no columns to embed")
+    _check_reserved(metadata_columns)
+    return embed_columns, metadata_columns
+
+
+def _check_reserved(metadata_columns):
+    # Such a column would be taken for, or overwritten by, the keys linking a window to its parent
+    reserved = [c for c in metadata_columns if c.startswith(CHUNK_METADATA_PREFIX)]
+    if reserved:
+        raise ValueError(f"Column names starting with '{CHUNK_METADATA_PREFIX}' are reserved: {reserved}; "
+                         f"drop them with the project schema")
+
+
+def filterable_keys(schema):
+    """
+    Returns:
+        set: Metadata keys a compare filter may use, or None if any key is allowed
+    """
+    if not schema or 'metadata' not in schema:
+        return None
+    return set(schema['metadata']) | set(SYSTEM_METADATA_KEYS)
+
+
+def _filter_keys(where):
+    # Field names used by a Chroma where filter, skipping $and/$or/$eq style operators
+    keys = set()
+    if isinstance(where, dict):
+        for key, value in where.items():
+            if key.startswith('$'):
+                for clause in value if isinstance(value, list) else [value]:
+                    keys |= _filter_keys(clause)
+            else:
+                keys.add(key)
+    return keys
+
+
+def parse_where(value, schema):
+    """
+    Parses a metadata filter in Chroma's where syntax, e.g. {"category": "shoes"}
+    or {"$and": [{"category": "shoes"}, {"brand": {"$in": ["a", "b"]}}]}.
+
+    Args:
+        value (str): The filter as JSON, or None/''
+        schema (dict): The project schema, or None
+
+    Returns:
+        dict: The filter, or None when not given
+
+    Raises:
+        ValueError: If the filter is malformed or uses non-filterable keys
+    """
+    if not value:
+        return None
+    try:
+        where = json.loads(value)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"'where' is not valid JSON: {e}")
+    if not isinstance(where, dict) or not where:
+        raise ValueError("'where' must be a non-empty JSON object")
+
+    allowed = filterable_keys(schema)
+    if allowed is not None:
+        unknown = sorted(_filter_keys(where) - allowed)
+        if unknown:
+            raise ValueError(f"Keys {unknown} are not filterable in this project. Allowed: {sorted(allowed)}.")
+    return where
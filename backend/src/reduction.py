@@ -0,0 +1,408 @@
+# reduction.py
+# This module implements the optional per-project dimensionality reduction.
+# A PCA projection is fitted on a sample of the project's full-size
+# embeddings and the collection is rewritten with the reduced vectors; from
+# then on every vector written to or queried against the project goes
+# through the same projection. The projection is stored with the model
+# version it was fitted for. When the model changes, the project's
+# documents are re-encoded and the projection is refitted once the server
+# is up, in a background thread of one process (or on demand, see below).
+# Until then the project keeps answering with its old projection.
+#
+# Usage, from backend/src:
+#   python reduction.py reproject      refit every stale projection now
+
+import os
+import sys
+import time
+import logging
+import threading
+import numpy as np
+from project_catalog import get_project_catalog
+from shards import get_project_collection
+from embeddings import MODEL_VERSION, get_embedding_model
+from search_engines import (IndexFiles, export_embeddings, normalise, top_k_dot, rebuild_collection,
+                            project_changed)
+from project_locks import project_rebuild_lock, host_task_lock, ProjectBusyError
+
+# Full-size vectors the PCA is fitted on
+REDUCTION_FIT_SAMPLE = int(os.environ.get('REDUCTION_FIT_SAMPLE', 100000))
+# Sampled queries used to report the recall cost of a reduction
+REDUCTION_REPORT_QUERIES = int(os.environ.get('REDUCTION_REPORT_QUERIES', 200))
+# Rows projected per step when rewriting or measuring
+REDUCTION_BLOCK_ROWS = int(os.environ.get('REDUCTION_BLOCK_ROWS', 65536))
+
+# Refit stale projections in the background once the server is up; with 0
+# they are only refitted by the reproject command
+REPROJECT_ON_START = os.environ.get('REPROJECT_ON_START', '1') == '1'
+
+# Directory, inside a project's index directory, holding its projection
+REDUCTION_SUBDIR = 'reduction'
+
+_projections = {}
+_projections_lock = threading.Lock()
+
+
+class Projection:
+    """
+    A fitted PCA: centres vectors on the training mean, projects them on the
+    leading components and scales the result back to unit length, so
+    projected vectors can be compared by cosine like the full ones.
+    """
+    def __init__(self, mean, components, explained_variance_ratio):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+        self.explained_variance_ratio = np.asarray(explained_variance_ratio, dtype=np.float32)
+
+    @property
+    def dim(self):
+        return self.components.shape[0]
+
+    def transform(self, vectors):
+        """
+        Returns:
+            np.ndarray: (n, dim) float32 unit-length projected vectors
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return normalise((vectors - self.mean) @ self.components.T)
+
+    def save(self, path):
+        np.savez(path, mean=self.mean, components=self.components,
+                 explained_variance_ratio=self.explained_variance_ratio)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['mean'], data['components'], data['explained_variance_ratio'])
+
+
+def fit_projection(vectors, dim):
+    """
+    Fits a PCA projection.
+
+    Args:
+        vectors (np.ndarray): (n, d) full-size training vectors
+        dim (int): Target dimension
+
+    Returns:
+        Projection: The fitted projection
+    """
+    # Imported here: scikit-learn takes a while to import and most processes never fit
+    from sklearn.decomposition import PCA
+    pca = PCA(n_components=dim, svd_solver='randomized' if dim < min(vectors.shape) * 0.8 else 'full', random_state=0)
+    pca.fit(np.asarray(vectors, dtype=np.float32))
+    return Projection(pca.mean_, pca.components_, pca.explained_variance_ratio_)
+
+
+def project_reduction(project):
+    """
+    Returns:
+        dict: The project's reduction settings, or None if its vectors are full size
+    """
+    return (project or {}).get('settings', {}).get('reduction')
+
+
+def _projection_files(project_name):
+    return IndexFiles(project_name, REDUCTION_SUBDIR)
+
+
+def load_projection(project_name, reduction):
+    """
+    Returns:
+        Projection: The project's projection, cached per process and per file
+    """
+    path = _projection_files(project_name).path(reduction['file'])
+    with _projections_lock:
+        projection = _projections.get(path)
+    if projection is None:
+        projection = Projection.load(path)
+        with _projections_lock:
+            _projections[path] = projection
+    return projection
+
+
+def reduce_vectors(project, vectors):
+    """
+    Applies a project's projection to full-size vectors: embeddings about to
+    be stored, or query embeddings about to be searched.
+
+    Args:
+        project (dict): Catalog entry, or None
+        vectors: Full-size vectors (list or array)
+
+    Returns:
+        The vectors unchanged for a project without reduction, else an array of reduced vectors
+    """
+    reduction = project_reduction(project)
+    if not reduction:
+        return vectors
+    return load_projection(project['name'], reduction).transform(vectors)
+
+
+def reduce_for_project(project_name, vectors):
+    """
+    reduce_vectors() for callers that only have the project name.
+    """
+    return reduce_vectors(get_project_catalog().get_project(project_name), vectors)
+
+
+def _full_vectors_are_stored(project):
+    # Stored vectors can be used as they are only if they are full size and from the current model
+    return not project_reduction(project) and project.get('model_version') == MODEL_VERSION
+
+
+def _model_dimension():
+    return get_embedding_model().get_sentence_embedding_dimension()
+
+
+def _encode(documents):
+    # Imported here: the bulk encoder loads the model
+    from bulk_encoder import encode_bulk
+    return encode_bulk(documents)
+
+
+def _measure_recall(full, projection, k, num_queries, scratch_path, seed=0):
+    """
+    Recall@k of search over projected vectors against search over the full
+    ones, with stored rows sampled as queries (their self-match left out).
+    The projected matrix is written to scratch_path rather than kept in memory.
+    """
+    rows = full.shape[0]
+    rng = np.random.default_rng(seed)
+    query_rows = np.sort(rng.choice(rows, size=min(num_queries, rows), replace=False))
+    queries = np.asarray(full[query_rows], dtype=np.float32)
+
+    reduced = np.lib.format.open_memmap(scratch_path, mode='w+', dtype=np.float16, shape=(rows, projection.dim))
+    for start in range(0, rows, REDUCTION_BLOCK_ROWS):
+        reduced[start:start + REDUCTION_BLOCK_ROWS] = projection.transform(full[start:start + REDUCTION_BLOCK_ROWS])
+
+    truth, _ = top_k_dot(full, normalise(queries), k + 1)
+    found, _ = top_k_dot(reduced, projection.transform(queries), k + 1)
+    hits = 0
+    for own, expected, got in zip(query_rows, truth, found):
+        hits += len(set(expected[expected != own][:k]) & set(got[got != own][:k]))
+    return round(hits / max(1, len(query_rows) * min(k, rows - 1)), 4)
+
+
+def set_reduction(project_name, dim, k=10, report_queries=REDUCTION_REPORT_QUERIES):
+    """
+    Fits a PCA projection to dim dimensions on the project's full-size
+    embeddings and rewrites the collection with projected vectors; dim 0
+    restores full-size vectors. Full-size vectors are read from the
+    collection when it still holds them, else re-encoded from the stored
+    documents. The project's search engine index is rebuilt afterwards.
+
+    Args:
+        project_name (str): Project name
+        dim (int): Target dimension, or 0 to remove the reduction
+        k (int): Results per query for the recall report
+        report_queries (int): Sampled queries for the recall report
+
+    Returns:
+        dict: Dimensions, explained variance, recall@k of the reduced
+            vectors against the full ones, and bytes per stored vector
+
+    Raises:
+        ValueError: If the project does not exist or is empty, or dim is not below the full dimension
+        ProjectBusyError: If writes to the project do not finish in time
+    """
+    catalog = get_project_catalog()
+    if catalog.get_project(project_name) is None:
+        raise ValueError(f"Project '{project_name}' does not exist.")
+    full_dim = _model_dimension()
+    if dim < 0:
+        raise ValueError("'dim' must not be negative")
+    if dim and not dim < full_dim:
+        raise ValueError(f"'dim' must be below the model's dimension ({full_dim})")
+
+    started = time.perf_counter()
+    # Writes wait until the new vectors and the settings that describe them are both in place
+    with project_rebuild_lock(project_name):
+        project = catalog.get_project(project_name)
+        collection = get_project_collection(project_name, project)
+        if not collection.count():
+            raise ValueError(f"Project '{project_name}' has no documents to fit a projection on.")
+        files = _projection_files(project_name)
+        token = files.new_build()
+        full_path, reduced_path = files.path(f"full-{token}.npy"), files.path(f"reduced-{token}.npy")
+        reencode = not _full_vectors_are_stored(project)
+        try:
+            ids = export_embeddings(collection, full_path, encode=_encode if reencode else None)
+            full = np.load(full_path, mmap_mode='r')
+
+            report = {'project_name': project_name, 'documents': len(ids), 'full_dim': full_dim, 'dim': dim or full_dim}
+            if dim:
+                rng = np.random.default_rng(0)
+                sample = np.sort(rng.choice(len(ids), size=min(REDUCTION_FIT_SAMPLE, len(ids)), replace=False))
+                projection = fit_projection(full[sample], dim)
+                report['explained_variance'] = round(float(projection.explained_variance_ratio.sum()), 4)
+                report[f'recall_at_{k}'] = _measure_recall(full, projection, k, report_queries, reduced_path)
+            else:
+                projection = None
+
+            row_of = {record_id: row for row, record_id in enumerate(ids)}
+
+            def vectors_of(page):
+                # No record is added while the lock is held, so every one was exported
+                vectors = np.asarray(full[[row_of[record_id] for record_id in page['ids']]], dtype=np.float32)
+                return (projection.transform(vectors) if projection else vectors).tolist()
+
+            rebuild_collection(project_name, collection, vectors_of=vectors_of)
+            del full
+        finally:
+            for path in (full_path, reduced_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        if projection:
+            name = f"pca-{token}.npz"
+            projection.save(files.path(name))
+            files.commit({'files': {'projection': name}})
+            reduction = {
+                'method': 'pca',
+                'dim': dim,
+                'file': name,
+                'model_version': MODEL_VERSION,
+                'explained_variance': report['explained_variance'],
+            }
+        else:
+            files.commit({'files': {}})
+            reduction = None
+        catalog.update_settings(project_name, {'reduction': reduction})
+        if reencode:
+            catalog.set_model_version(project_name, MODEL_VERSION)
+        # The collection was replaced: the old index does not fit it, so it is rebuilt right away
+        project_changed(project_name, wait=True)
+
+    report['bytes_per_vector'] = 4 * report['dim']
+    report['full_bytes_per_vector'] = 4 * full_dim
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    logging.info(f"Reduction of '{project_name}' set to {report['dim']} dimensions", extra={"reduction": report})
+    return report
+
+
+def reproject_stale_projects():
+    """
+    Refits the projection of every reduced project fitted for another model
+    version. Its stored vectors came from that model too, so the documents
+    are re-encoded with the current one before fitting.
+
+    Returns:
+        list: Names of the re-projected projects
+    """
+    catalog = get_project_catalog()
+    reprojected = []
+    for project in catalog.list_projects():
+        reduction = project_reduction(project)
+        if not reduction or reduction.get('model_version') == MODEL_VERSION:
+            continue
+        logging.info(f"Re-projecting '{project['name']}': fitted for {reduction.get('model_version')}, model is {MODEL_VERSION}")
+        try:
+            set_reduction(project['name'], reduction['dim'])
+            reprojected.append(project['name'])
+        except Exception as e:
+            logging.exception(f"Re-projection of '{project['name']}' failed: {e}")
+    return reprojected
+
+
+def _reproject_in_background():
+    with host_task_lock('reprojection') as acquired:
+        if acquired:
+            reproject_stale_projects()
+
+
+def start_stale_reprojection():
+    """
+    Runs reproject_stale_projects() in a background thread, unless disabled
+    by REPROJECT_ON_START. Every gunicorn worker calls this after fork; only
+    the one that takes the host-wide lock does the work, and never the
+    master, whose torch thread pool the workers would inherit.
+
+    Returns:
+        threading.Thread: The thread, or None when disabled
+    """
+    if not REPROJECT_ON_START:
+        return None
+    thread = threading.Thread(target=_reproject_in_background, name='reprojection', daemon=True)
+    thread.start()
+    return thread
+
+
+def requested_reduction(form):
+    """
+    Reads the optional 'reduce_dim' field of an upload form.
+
+    Returns:
+        int: The requested dimension (0 for full size), or None if not given
+
+    Raises:
+        ValueError: If the value is not a non-negative integer
+    """
+    value = (form.get('reduce_dim') or '').strip()
+    if not value:
+        return None
+    try:
+        dim = int(value)
+    except ValueError:
+        raise ValueError("'reduce_dim' must be an integer")
+    if dim < 0:
+        raise ValueError("'reduce_dim' must not be negative")
+    return dim
+
+
+def ensure_reduction(project_name, dim):
+    """
+    Sets a project's reduction to dim unless it already has it.
+
+    Returns:
+        dict: The set_reduction() report, or None if nothing changed
+    """
+    if dim is None:
+        return None
+    reduction = project_reduction(get_project_catalog().get_project(project_name))
+    if (reduction['dim'] if reduction else 0) == dim:
+        return None
+    return set_reduction(project_name, dim)
+
+
+def handle_set_reduction(project_name, form):
+    """
+    Endpoint handler that sets a project's reduction ('dim' form field, 0 to
+    remove it; optional 'k' for the recall report).
+
+    Returns:
+        tuple: (response_dict, http_status_code)
+    """
+    if get_project_catalog().get_project(project_name) is None:
+        return {'error': f"Project '{project_name}' does not exist."}, 404
+    try:
+        dim = int((form.get('dim') or '').strip())
+        k = int(form.get('k') or 10)
+    except ValueError:
+        return {'error': "'dim' and 'k' must be integers"}, 400
+    try:
+        return set_reduction(project_name, dim, k), 200
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    except ProjectBusyError as e:
+        return {'error': str(e)}, 409
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv != ['reproject']:
+        print("Usage: python reduction.py reproject", file=sys.stderr)
+        return 2
+    with host_task_lock('reprojection') as acquired:
+        if not acquired:
+            print("Error: a re-projection is already running on this host", file=sys.stderr)
+            return 1
+        print(f"Re-projected: {reproject_stale_projects()}")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,133 @@
+# responses.py
+# This module provides fast JSON responses for large payloads: orjson
+# serialisation, gzip/brotli compression negotiated from Accept-Encoding,
+# and the `fields=` selector that trims compare matches to the keys a
+# client actually uses.
+
+import os
+import gzip
+import orjson
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip is offered without it
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed; the framing overhead isn't worth it
+MIN_COMPRESS_BYTES = int(os.environ.get('RESPONSE_MIN_COMPRESS_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', 5))
+BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', 4))
+
+MATCH_FIELDS = ('id', 'content', 'metadata', 'match', 'project_name')
+
+
+def parse_fields(values):
+    """
+    Reads the `fields` selector (comma-separated match keys) from request values.
+
+    Args:
+        values: Request form or query arguments
+
+    Returns:
+        tuple: (fields, error) - fields is None when every field is wanted
+    """
+    raw = values.get('fields')
+    if not raw:
+        return None, None
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in MATCH_FIELDS]
+    if unknown:
+        return None, f"Unknown fields {unknown}. Allowed: {list(MATCH_FIELDS)}."
+    return set(fields), None
+
+
+def select_fields(matches, fields):
+    """
+    Keeps only the selected keys of each match.
+
+    Args:
+        matches (list): Match dicts
+        fields (set): Keys to keep, or None to keep everything
+
+    Returns:
+        list: The trimmed matches
+    """
+    if fields is None:
+        return matches
+    return [{k: v for k, v in match.items() if k in fields} for match in matches]
+
+
+def _accepted_encodings(accept_encoding):
+    """
+    Parses an Accept-Encoding header.
+
+    Args:
+        accept_encoding (str): The header value
+
+    Returns:
+        dict: Encoding (lower case, '*' included) -> q-value; a malformed
+            q-value counts as 0
+    """
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, *params = [p.strip() for p in part.split(';')]
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.lower()] = q
+    return accepted
+
+
+def compress_body(body, accept_encoding):
+    """
+    Compresses a response body with the best encoding the client accepts.
+
+    Args:
+        body (bytes): The uncompressed body
+        accept_encoding (str): The request's Accept-Encoding header
+
+    Returns:
+        tuple: (body, content_encoding) - content_encoding is None if uncompressed
+    """
+    if len(body) < MIN_COMPRESS_BYTES or not accept_encoding:
+        return body, None
+    accepted = _accepted_encodings(accept_encoding)
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    # An encoding not listed takes the q-value of '*'; q=0 refuses it.
+    # Ties keep the order of `offered`, brotli first.
+    quality = {name: accepted.get(name, accepted.get('*', 0.0)) for name in offered}
+    best = max(offered, key=lambda name: quality[name])
+    if quality[best] <= 0:
+        return body, None
+    if best == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    return gzip.compress(body, compresslevel=GZIP_LEVEL), 'gzip'
+
+
+def json_response(payload, status=200):
+    """
+    Builds a JSON response serialised with orjson and compressed when the
+    client supports it. Drop-in replacement for `jsonify(payload), status`.
+
+    Args:
+        payload: JSON-serialisable data
+        status (int): HTTP status code
+
+    Returns:
+        Response: The Flask response
+    """
+    body = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    body, encoding = compress_body(body, request.headers.get('Accept-Encoding', ''))
+    response = Response(body, status=status, mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
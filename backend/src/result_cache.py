@@ -0,0 +1,282 @@
+# result_cache.py
+# This module caches compare results in memory. Many compare calls repeat
+# the same query against the same project between two writes to it; their
+# result is served from here instead of encoding, searching and asking the
+# LLM again. Keys hold the project's write version (bumped by every
+# ingestion, sync and delete), its creation time and its search settings,
+# so a result is never served once the project it came from has changed.
+# The cache is per process, bounded and least-recently-used.
+#
+# The optional semantic cache goes one step further for reworded repeats:
+# it keeps the embeddings of recent queries per project and search context
+# and serves the result of a stored query whose cosine similarity to the
+# new one reaches SEMANTIC_CACHE_THRESHOLD. It still costs an encode, but
+# no vector search and no LLM call.
+
+import os
+import copy
+import json
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+# Entries kept per process; 0 disables the cache
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 2048))
+# Cosine similarity from which a stored query's result is reused; 0 disables the semantic cache
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0))
+# Queries remembered per project and search context
+SEMANTIC_CACHE_QUERIES = int(os.environ.get('SEMANTIC_CACHE_QUERIES', 256))
+# Projects and search contexts remembered
+SEMANTIC_CACHE_CONTEXTS = int(os.environ.get('SEMANTIC_CACHE_CONTEXTS', 64))
+
+# Project settings that change what a query returns
+_SEARCH_SETTINGS = ('engine', 'index_params', 'reduction', 'chunked')
+
+
+def normalise_query(query):
+    """
+    Returns:
+        str: The query with Unicode normalised, case folded and whitespace
+            collapsed; the MiniLM tokenizer is uncased, so the match is the same
+    """
+    return ' '.join(unicodedata.normalize('NFKC', query).casefold().split())
+
+
+def compare_context(project, k, where=None):
+    """
+    Args:
+        project (dict): Catalog entry of the queried project
+        k (int): Results requested
+        where (dict): Metadata filter, if any
+
+    Returns:
+        tuple: Everything besides the query that a compare result depends on
+    """
+    settings = project.get('settings') or {}
+    return (
+        project['name'],
+        project['created_at'],
+        project.get('write_version', 0),
+        project.get('model_version'),
+        json.dumps({name: settings.get(name) for name in _SEARCH_SETTINGS}, sort_keys=True),
+        k,
+        json.dumps(where, sort_keys=True) if where else None,
+    )
+
+
+def compare_cache_key(project, query, k, where=None):
+    """
+    Returns:
+        tuple: The cache key of a compare result: its context, then the normalised query
+    """
+    return compare_context(project, k, where) + (normalise_query(query),)
+
+
+class ResultCache:
+    """
+    Thread-safe LRU map from compare keys to results, with hit counters.
+    """
+    def __init__(self, max_entries=RESULT_CACHE_SIZE):
+        """
+        Args:
+            max_entries (int): Entries kept before the least recently used is evicted
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Returns:
+            A copy of the cached value, or None on a miss
+        """
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Callers trim and re-sort matches, so they get their own copy
+        return copy.deepcopy(value)
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def drop_project(self, project_name):
+        """
+        Frees the entries of a deleted project.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == project_name]:
+                del self._entries[key]
+
+    def stats(self):
+        """
+        Returns:
+            dict: Size, hits, misses, evictions and hit rate since start
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class SemanticCache:
+    """
+    Per search context, a ring of recent query embeddings and their results.
+    A lookup is one matrix-vector product over at most SEMANTIC_CACHE_QUERIES rows.
+    """
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, max_queries=SEMANTIC_CACHE_QUERIES,
+                 max_contexts=SEMANTIC_CACHE_CONTEXTS):
+        """
+        Args:
+            threshold (float): Cosine similarity from which a result is reused; 0 disables the cache
+            max_queries (int): Queries kept per context, the oldest replaced first
+            max_contexts (int): Contexts kept, the least recently used evicted first
+        """
+        self.threshold = threshold
+        self.max_queries = max_queries
+        self.max_contexts = max_contexts
+        self._contexts = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.llm_calls_saved = 0
+
+    @property
+    def enabled(self):
+        return self.threshold > 0 and self.max_queries > 0 and self.max_contexts > 0
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def get(self, context, embedding):
+        """
+        Args:
+            context (tuple): compare_context() of the call
+            embedding: The query embedding
+
+        Returns:
+            A copy of the result of the most similar stored query reaching the
+            threshold, or None
+        """
+        if not self.enabled:
+            return None
+        vector = self._unit(embedding)
+        with self._lock:
+            entry = self._contexts.get(context)
+            best = -1.0
+            if entry is not None and entry['size']:
+                similarities = entry['vectors'][:entry['size']] @ vector
+                row = int(np.argmax(similarities))
+                best = float(similarities[row])
+            if best < self.threshold:
+                self.misses += 1
+                return None
+            self._contexts.move_to_end(context)
+            self.hits += 1
+            value = entry['results'][row]
+            if value['llm_refined']:
+                self.llm_calls_saved += 1
+        return copy.deepcopy(value['result'])
+
+    def put(self, context, embedding, result, llm_refined=True):
+        """
+        Args:
+            context (tuple): compare_context() of the call
+            embedding: The query embedding
+            result: The compare result
+            llm_refined (bool): Whether computing the result took an LLM call,
+                which each reuse then saves
+        """
+        if not self.enabled:
+            return
+        vector = self._unit(embedding)
+        value = {'result': copy.deepcopy(result), 'llm_refined': llm_refined}
+        with self._lock:
+            entry = self._contexts.get(context)
+            if entry is None or entry['vectors'].shape[1] != vector.shape[0]:
+                entry = {
+                    'vectors': np.zeros((self.max_queries, vector.shape[0]), dtype=np.float32),
+                    'results': [None] * self.max_queries,
+                    'size': 0,
+                    'next': 0,
+                }
+                self._contexts[context] = entry
+            row = entry['next']
+            entry['vectors'][row] = vector
+            entry['results'][row] = value
+            entry['next'] = (row + 1) % self.max_queries
+            entry['size'] = min(entry['size'] + 1, self.max_queries)
+            self._contexts.move_to_end(context)
+            while len(self._contexts) > self.max_contexts:
+                self._contexts.popitem(last=False)
+
+    def drop_project(self, project_name):
+        with self._lock:
+            for context in [context for context in self._contexts if context[0] == project_name]:
+                del self._contexts[context]
+
+    def stats(self):
+        """
+        Returns:
+            dict: Contexts, stored queries, hits, misses, hit rate and LLM calls saved
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'threshold': self.threshold,
+                'contexts': len(self._contexts),
+                'queries': sum(entry['size'] for entry in self._contexts.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'llm_calls_saved': self.llm_calls_saved,
+            }
+
+
+_cache = None
+_semantic_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
+
+
+def get_semantic_cache():
+    global _semantic_cache
+    if _semantic_cache is None:
+        with _cache_lock:
+            if _semantic_cache is None:
+                _semantic_cache = SemanticCache()
+    return _semantic_cache
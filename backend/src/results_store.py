@@ -0,0 +1,84 @@
+# results_store.py
+# This module provides the storage behind RESULTS, the per-request status
+# dictionary read by the /status endpoints. The development server uses a
+# plain dict; preforked production workers use a SQLite-backed store so a
+# status request can be answered by any worker process.
+
+import os
+import time
+import orjson
+from sqlite_store import SqliteStore
+
+RESULTS_BACKEND = os.environ.get('RESULTS_BACKEND', 'memory')
+RESULTS_DB_PATH = os.environ.get(
+    'RESULTS_DB_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runtime', 'results.sqlite3')
+)
+# Finished results older than this are pruned from the shared store
+RESULTS_TTL_SECONDS = int(os.environ.get('RESULTS_TTL_SECONDS', 24 * 3600))
+
+
+class SqliteResults(SqliteStore):
+    """
+    Dict-like results store shared by all processes on the host.
+    Values are JSON-serialisable dicts; reads return copies, so callers must
+    assign the updated dict back instead of mutating it in place.
+    """
+    def __init__(self, path=RESULTS_DB_PATH, ttl_seconds=RESULTS_TTL_SECONDS):
+        """
+        Args:
+            path (str): Location of the SQLite database file
+            ttl_seconds (int): Age after which entries are pruned
+        """
+        super().__init__(path)
+        self.ttl_seconds = ttl_seconds
+        self._last_prune = 0.0
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'request_id TEXT PRIMARY KEY, status TEXT, payload BLOB, updated_at REAL)'
+        )
+
+    def __setitem__(self, request_id, value):
+        now = time.time()
+        self._connection().execute(
+            'INSERT OR REPLACE INTO results (request_id, status, payload, updated_at) VALUES (?, ?, ?, ?)',
+            (request_id, value.get('status'), orjson.dumps(value), now)
+        )
+        if now - self._last_prune > 60:
+            self._last_prune = now
+            self._connection().execute('DELETE FROM results WHERE updated_at < ?', (now - self.ttl_seconds,))
+
+    def __getitem__(self, request_id):
+        value = self.get(request_id)
+        if value is None:
+            raise KeyError(request_id)
+        return value
+
+    def __delitem__(self, request_id):
+        self._connection().execute('DELETE FROM results WHERE request_id = ?', (request_id,))
+
+    def __contains__(self, request_id):
+        row = self._connection().execute('SELECT 1 FROM results WHERE request_id = ?', (request_id,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def get(self, request_id, default=None):
+        row = self._connection().execute('SELECT payload FROM results WHERE request_id = ?', (request_id,)).fetchone()
+        return orjson.loads(row[0]) if row else default
+
+    def values(self):
+        return [orjson.loads(row[0]) for row in self._connection().execute('SELECT payload FROM results')]
+
+
+def create_results_store():
+    """
+    Creates the results store selected by the RESULTS_BACKEND environment variable.
+
+    Returns:
+        dict or SqliteResults: 'memory' gives a plain dict, 'sqlite' a shared store
+    """
+    if RESULTS_BACKEND == 'sqlite':
+        return SqliteResults()
+    return {}
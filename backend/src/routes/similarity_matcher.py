@@ -1,8 +1,16 @@
 from flask import Blueprint, request, jsonify
 from get_projects import get_projects
 from status_service import handle_status
-from load_csv_to_chroma_db import load_csv_to_chroma
+from load_csv_to_chroma_db import load_csv_to_chroma, sync_csv_to_chroma, TABLE_EXTENSIONS
+from project_schema import parse_schema
+from search_engines import set_project_engine, handle_set_engine, handle_recall_report, requested_engine
+from reduction import requested_reduction, ensure_reduction, handle_set_reduction
+from chroma_instance import validate_project_name
+from project_catalog import get_project_catalog
+from shards import requested_shards
+from project_locks import ProjectBusyError
 from compare_service import handle_compare
+from batch_compare import handle_batch_compare
 import os
 from werkzeug.utils import secure_filename
 
@@ -10,7 +18,7 @@ class ApiRoutes:
     """
     Defines API routes and handlers for the application.
     """
-    def __init__(self, app, request_queue, results_dict, results_lock, monitoring):
+    def __init__(self, app, request_queue, results_dict, results_lock, monitoring, profiler):
         """
         Initialize API routes with shared resources.
         
@@ -20,21 +28,30 @@ class ApiRoutes:
             results_dict (dict): Shared dictionary to store results
             results_lock: Thread lock for safely accessing results_dict
             monitoring: The monitoring system instance
+            profiler: The profiler behind the admin profiling endpoints
         """
         self.REQUEST_QUEUE = request_queue
         self.RESULTS = results_dict
         self.RESULTS_LOCK = results_lock
         self.monitoring = monitoring
+        self.profiler = profiler
         
         similarity_matcher_api = Blueprint("api", __name__, url_prefix="/api/similarity-matcher")
 
         similarity_matcher_api.route("/createProject",methods=["POST"])(self.create_project)
         similarity_matcher_api.route('/getProjects', methods=['GET'])(self.get_projects)
+        similarity_matcher_api.route('/projects/<project_name>/engine', methods=['POST'])(self.set_engine)
+        similarity_matcher_api.route('/projects/<project_name>/engine/report', methods=['GET'])(self.engine_report)
+        similarity_matcher_api.route('/projects/<project_name>/reduction', methods=['POST'])(self.set_reduction)
         similarity_matcher_api.route('/compare', methods=['POST'])(self.compare_query)
+        similarity_matcher_api.route('/compare/batch', methods=['POST'])(self.compare_batch)
         similarity_matcher_api.route('/status/<request_id>', methods=['GET'])(self.get_status)
         similarity_matcher_api.route('/health', methods=['GET'])(self.health_check)
         similarity_matcher_api.route('/metrics', methods=['GET'])(self.get_metrics)
         similarity_matcher_api.route('/admin/logs/clear', methods=['POST'])(self.clear_logs)
+        similarity_matcher_api.route('/admin/profile/window', methods=['POST'])(self.profile_window)
+        similarity_matcher_api.route('/admin/profile/reports', methods=['GET'])(self.list_profile_reports)
+        similarity_matcher_api.route('/admin/profile/reports/<filename>', methods=['GET'])(self.download_profile_report)
         similarity_matcher_api.route('/list_uploaded_csvs', methods=['GET'])(self.list_uploaded_csvs)
         similarity_matcher_api.route('/download_uploaded_csv/<filename>', methods=['GET'])(self.download_uploaded_csv)
         similarity_matcher_api.route('/authenticate', methods=['POST'])(self.authenticate)
@@ -43,7 +60,20 @@ class ApiRoutes:
         app.register_blueprint(similarity_matcher_api)
 
     def create_project(self):
-        """Endpoint to create a new project from a CSV file."""
+        """
+        Endpoint to create a new project from a CSV, Parquet or Arrow file.
+        An optional comma-separated 'columns' field limits ingestion to those columns.
+        An optional JSON 'schema' ({"embed": [...], "metadata": [...], "drop": [...]})
+        fixes, for the lifetime of the project, which columns are embedded,
+        which are stored as filterable metadata and which are dropped.
+        An optional 'engine' field selects the project's search engine; fields
+        named after its parameters tune it (e.g. 'M', 'construction_ef' and
+        'search_ef' for Chroma's HNSW index, 'nprobe' for IVF-PQ). An optional
+        'reduce_dim' field stores PCA-reduced vectors of that dimension.
+        With mode=sync an existing project is brought in line with the file:
+        rows are keyed by 'key_column' (or by content), changed rows are
+        re-embedded and rows missing from the file are deleted.
+        """
         try:
             import logging
             logging.info(f"Received createProject request. Files: {list(request.files.keys())}, Form: {list(request.form.keys())}")
@@ -63,9 +93,32 @@ class ApiRoutes:
             if not project_name:
                 return jsonify({"error": "Project name cannot be empty"}), 400
 
+            # Names of shard and temporary collections would be mistaken for internal ones
+            if get_project_catalog().get_project(project_name) is None:
+                try:
+                    validate_project_name(project_name)
+                except ValueError as e:
+                    return jsonify({"error": str(e)}), 400
+
+            mode = request.form.get('mode', 'append')
+            if mode not in ('append', 'sync'):
+                return jsonify({"error": "Invalid 'mode'. Use 'append' or 'sync'."}), 400
+            key_column = request.form.get('key_column', '').strip() or None
+            columns = [c.strip() for c in request.form.get('columns', '').split(',') if c.strip()] or None
+            try:
+                schema = parse_schema(request.form.get('schema'))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            try:
+                engine, index_params = requested_engine(project_name, request.form)
+                reduce_dim = requested_reduction(request.form)
+                shards = requested_shards(request.form, get_project_catalog().get_project(project_name))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
             # Validate file extension
-            if not csv_file.filename.lower().endswith('.csv'):
-                return jsonify({"error": "Only CSV files are supported"}), 400
+            if not csv_file.filename.lower().endswith(TABLE_EXTENSIONS):
+                return jsonify({"error": f"Only {', '.join(TABLE_EXTENSIONS)} files are supported"}), 400
 
             # Save uploaded file
             upload_dir = os.path.join(os.getcwd(), 'resources', 'uploads')
@@ -78,9 +131,32 @@ class ApiRoutes:
             csv_file.save(file_path)
             logging.info(f"File saved to: {file_path}")
 
+            if mode == 'sync':
+                try:
+                    changes = sync_csv_to_chroma(file_path, project_name, key_column, columns, schema, index_params,
+                                                 shards)
+                except ValueError as e:
+                    return jsonify({"error": str(e)}), 400
+                ensure_reduction(project_name, reduce_dim)
+                if engine:
+                    set_project_engine(project_name, engine, index_params)
+                return jsonify({
+                    "message": f"Project '{project_name}' synced successfully.",
+                    "added_documents": changes['inserted'],
+                    "changes": changes,
+                    "project_name": project_name
+                }), 200
+
             # Load data into Chroma
-            added_docs = load_csv_to_chroma(file_path, project_name)
+            try:
+                added_docs = load_csv_to_chroma(file_path, project_name, columns, schema, index_params, shards)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
             added_count = len(added_docs) if added_docs else 0
+            if added_count:
+                ensure_reduction(project_name, reduce_dim)
+            if engine:
+                set_project_engine(project_name, engine, index_params)
 
             return jsonify({
                 "message": f"Project '{project_name}' created successfully.",
@@ -88,6 +164,8 @@ class ApiRoutes:
                 "project_name": project_name
             }), 200
 
+        except ProjectBusyError as e:
+            return jsonify({"error": str(e)}), 409
         except Exception as e:
             import logging
             logging.exception(f"Error in create_project: {e}")
@@ -97,6 +175,42 @@ class ApiRoutes:
                     ## if the db already exists, but with diferent name add error
                     ## if the db already exists but with diferent name and has some new things similar with new things update the db
     
+    def set_engine(self, project_name):
+        """
+        Endpoint to select or tune the search engine of a project ('engine' form
+        field, plus optional engine parameters). The engine's index is built
+        before the switch; changing only query-time parameters needs no rebuild.
+
+        Returns:
+            tuple: (response_json, http_status_code)
+        """
+        response, status = handle_set_engine(project_name, request.form)
+        return jsonify(response), status
+
+    def engine_report(self, project_name):
+        """
+        Endpoint that measures recall@k and latency of a project's search engine
+        against exact search. Query arguments: 'engine' and engine parameters
+        to measure another configuration, 'k', 'sample' (number of queries).
+
+        Returns:
+            tuple: (response_json, http_status_code)
+        """
+        response, status = handle_recall_report(project_name, request.args)
+        return jsonify(response), status
+
+    def set_reduction(self, project_name):
+        """
+        Endpoint that sets a project's dimensionality reduction: 'dim' form
+        field (0 for full-size vectors), optional 'k' for the recall report.
+        The collection is rewritten with projected vectors.
+
+        Returns:
+            tuple: (response_json, http_status_code) - the report includes recall@k against full-size vectors
+        """
+        response, status = handle_set_reduction(project_name, request.form)
+        return jsonify(response), status
+
     def get_projects(self):
         """endpoint to retrieve a list of projects."""
         return get_projects()
@@ -131,7 +245,7 @@ class ApiRoutes:
             tuple: (response_json, http_status_code)
         """
         try:
-            from llm import client, openrouter_model
+            from llm import get_client, openrouter_model
             import os
 
             # Check if API key is set
@@ -144,7 +258,7 @@ class ApiRoutes:
                 }), 200
 
             # Make a simple test request
-            response = client.chat.completions.create(
+            response = get_client().chat.completions.create(
                 messages=[
                     {
                         "role": "user",
@@ -184,6 +298,21 @@ class ApiRoutes:
 
         return handle_compare(request, self.REQUEST_QUEUE, self.RESULTS, self.RESULTS_LOCK)
     
+    def compare_batch(self):
+        """
+        Endpoint to match many inquiries against one project in one call.
+        Takes a JSON body ({"project_name", "queries": [...], "k", "refine",
+        "format", "where", "fields"}) or a form with a 'queries_file' CSV
+        ('query_column', optional 'id_column'). Queries are a string or
+        {"id", "query"} each. With refine=true the scores are refined by the
+        LLM, several queries per prompt.
+
+        Returns:
+            Response: NDJSON (format=ndjson, one line per query) or CSV
+                (format=csv, one row per match), streamed as batches complete
+        """
+        return handle_batch_compare(request)
+
     def compare_query_multiple(self):
         """Endpoint to compare a query in multipe projects"""
         return handle_compare_multiple(request,self.REQUEST_QUEUE,self.RESULTS, self.RESULTS_LOCK)
@@ -229,6 +358,44 @@ class ApiRoutes:
         """
         admin_key = request.headers.get('Admin-Key')
         return self.monitoring.clear_logs(admin_key)
+
+    def profile_window(self):
+        """
+        Administrative endpoint to profile the whole process for a time-boxed window.
+        Accepts 'seconds', 'mode' (cpu|alloc) and 'interval' as query parameters.
+        Protected by an admin key in the request header.
+
+        Returns:
+            tuple: (response_json, http_status_code)
+        """
+        admin_key = request.headers.get('Admin-Key')
+        return self.profiler.run_window(admin_key, request.args)
+
+    def list_profile_reports(self):
+        """
+        Administrative endpoint to list stored profile reports.
+        Protected by an admin key in the request header.
+
+        Returns:
+            tuple: (response_json, http_status_code)
+        """
+        admin_key = request.headers.get('Admin-Key')
+        return self.profiler.get_reports(admin_key)
+
+    def download_profile_report(self, filename):
+        """
+        Administrative endpoint to download a profile report
+        (.collapsed, .pstats, .alloc.txt or .tracemalloc).
+        Protected by an admin key in the request header.
+
+        Args:
+            filename (str): The name of the report file
+
+        Returns:
+            Response: The report file as an attachment
+        """
+        admin_key = request.headers.get('Admin-Key')
+        return self.profiler.download_report(admin_key, filename)
     
     def list_uploaded_csvs(self):
         """
@@ -1,28 +1,29 @@
 from flask import request, jsonify, Blueprint
-from sentence_transformers import SentenceTransformer
 from compare_service import handle_compare
 from status_service import handle_status
-from chroma_instance import get_chroma_client
+from embeddings import get_embedding_model
+from chroma_instance import validate_project_name
+from project_catalog import get_project_catalog, TEACHER_ASSISTANT
+from chunking import best_window_per_parent, CHUNK_QUERY_OVERSAMPLE
+from compute_scheduler import get_compute_scheduler
+from search_engines import query_project, drop_project_indexes, set_project_engine, handle_set_engine, handle_recall_report, requested_engine
+from reduction import requested_reduction, ensure_reduction, handle_set_reduction
+from shards import requested_shards, get_project_collection, delete_project_collections
+from result_cache import get_result_cache, get_semantic_cache
+from project_locks import project_rebuild_lock, ProjectBusyError
 import os
 from llm import ask_llm
 from functools import reduce
 
-# Get the directory where the src folder is located (parent of routes)
-SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-model_dir = os.path.join(SCRIPT_DIR, 'models', 'all-MiniLM-L6-v2')
-model = SentenceTransformer(model_dir)
-# Use shared ChromaDB instance
-chroma_client = get_chroma_client()
-
 class ApiRoutes:
     def get_top_vectors(self, prompt):
-        collection = chroma_client.get_collection(name="api_files")
-
-        query_embedding = model.encode([prompt])[0]
-        results = collection.query(
-            query_embeddings=[query_embedding],
+        with get_compute_scheduler().interactive():
+            query_embedding = get_embedding_model().encode([prompt])[0]
+        results = query_project(
+            "api_files",
+            [query_embedding.tolist()],
             n_results=10,
-            include=["documents", "metadatas"]
+            include=("documents", "metadatas")
         )
         top_results = []
         for doc, metadata in zip(results['documents'][0], results['metadatas'][0]):
@@ -55,34 +56,40 @@ class ApiRoutes:
             return jsonify({'error': 'No prompt provided'}), 400
 
         try:
-            # Check if collection exists
-            existing_collections = [c.name for c in chroma_client.list_collections()]
-            if project_name not in existing_collections:
+            # Check if project exists
+            project = get_project_catalog().get_project(project_name)
+            if project is None:
                 return jsonify({
                     'error': f'Collection [{project_name}] does not exist. Please select a valid project.'
                 }), 400
 
-            # Get problems from specified project
-            collection = chroma_client.get_collection(name=project_name)
-
-            # Check if collection has any documents
-            col_data = collection.get()
-            if not col_data['ids'] or len(col_data['ids']) == 0:
+            # Check if project has any documents
+            if project['document_count'] == 0:
                 return jsonify({
                     'error': f'Project [{project_name}] has no problems. Please upload a PDF with content first.'
                 }), 400
 
-            query_embedding = model.encode([prompt])[0]
-            results = collection.query(
-                query_embeddings=[query_embedding],
-                n_results=min(25, len(col_data['ids'])),  # Get top 25 relevant problems
-                include=["documents", "metadatas"]
+            # Get problems from specified project
+            collection = get_project_collection(project_name, project)
+
+            with get_compute_scheduler().interactive():
+                query_embedding = get_embedding_model().encode([prompt])[0]
+            n_problems = min(25, project['document_count'])  # Get top 25 relevant problems
+            chunked = project['settings'].get('chunked')
+            results = query_project(
+                project_name,
+                [query_embedding.tolist()],
+                # Long problems are stored as several windows; fetch extra and keep one per problem
+                n_results=min(n_problems * CHUNK_QUERY_OVERSAMPLE, collection.count()) if chunked else n_problems,
+                include=("documents", "metadatas"),
+                project=project
             )
+            keep = best_window_per_parent(results, n_problems) if chunked else range(len(results['documents'][0]))
 
             # Build context from similar problems
             problems_context = "\n\n".join([
-                f"Problem {i+1}: {doc}"
-                for i, doc in enumerate(results['documents'][0])
+                f"Problem {n+1}: {results['documents'][0][i]}"
+                for n, i in enumerate(keep)
             ])
 
             if not problems_context.strip():
@@ -104,7 +111,7 @@ class ApiRoutes:
     """
     Defines API routes and handlers for the application.
     """
-    def __init__(self, app, request_queue, results_dict, results_lock, monitoring):
+    def __init__(self, app, request_queue, results_dict, results_lock, monitoring, profiler):
         """
         Initialize API routes with shared resources.
         
@@ -114,11 +121,13 @@ class ApiRoutes:
             results_dict (dict): Shared dictionary to store results
             results_lock: Thread lock for safely accessing results_dict
             monitoring: The monitoring system instance
+            profiler: The profiler behind the admin profiling endpoints
         """
         self.REQUEST_QUEUE = request_queue
         self.RESULTS = results_dict
         self.RESULTS_LOCK = results_lock
         self.monitoring = monitoring
+        self.profiler = profiler
 
         teacher_assistant_api = Blueprint("teacher_assistant", __name__)
         
@@ -128,6 +137,9 @@ class ApiRoutes:
         teacher_assistant_api.add_url_rule('/health', view_func=self.health_check, methods=['GET'])
         teacher_assistant_api.add_url_rule('/metrics', view_func=self.get_metrics, methods=['GET'])
         teacher_assistant_api.add_url_rule('/admin/logs/clear', view_func=self.clear_logs, methods=['POST'])
+        teacher_assistant_api.add_url_rule('/admin/profile/window', view_func=self.profile_window, methods=['POST'])
+        teacher_assistant_api.add_url_rule('/admin/profile/reports', view_func=self.list_profile_reports, methods=['GET'])
+        teacher_assistant_api.add_url_rule('/admin/profile/reports/<filename>', view_func=self.download_profile_report, methods=['GET'])
         teacher_assistant_api.add_url_rule('/list_uploaded_csvs', view_func=self.list_uploaded_csvs, methods=['GET'])
         teacher_assistant_api.add_url_rule('/download_uploaded_csv/<filename>', view_func=self.download_uploaded_csv, methods=['GET'])
         teacher_assistant_api.add_url_rule('/get-top-vectors', view_func=self.return_top_vectos, methods=['POST'])
@@ -135,6 +147,9 @@ class ApiRoutes:
         teacher_assistant_api.add_url_rule("/create-project-from-pdf", view_func=self.create_project_from_pdf, methods=['POST'])
         teacher_assistant_api.add_url_rule("/get-teacher-projects", view_func=self.get_teacher_projects, methods=['GET'])
         teacher_assistant_api.add_url_rule("/delete-project/<project_name>", view_func=self.delete_project, methods=['DELETE'])
+        teacher_assistant_api.add_url_rule("/projects/<project_name>/engine", view_func=self.set_engine, methods=['POST'])
+        teacher_assistant_api.add_url_rule("/projects/<project_name>/engine/report", view_func=self.engine_report, methods=['GET'])
+        teacher_assistant_api.add_url_rule("/projects/<project_name>/reduction", view_func=self.set_reduction, methods=['POST'])
 
         app.register_blueprint(teacher_assistant_api, url_prefix="/api/teacher-assistant")
         
@@ -195,6 +210,44 @@ class ApiRoutes:
         """
         admin_key = request.headers.get('Admin-Key')
         return self.monitoring.clear_logs(admin_key)
+
+    def profile_window(self):
+        """
+        Administrative endpoint to profile the whole process for a time-boxed window.
+        Accepts 'seconds', 'mode' (cpu|alloc) and 'interval' as query parameters.
+        Protected by an admin key in the request header.
+
+        Returns:
+            tuple: (response_json, http_status_code)
+        """
+        admin_key = request.headers.get('Admin-Key')
+        return self.profiler.run_window(admin_key, request.args)
+
+    def list_profile_reports(self):
+        """
+        Administrative endpoint to list stored profile reports.
+        Protected by an admin key in the request header.
+
+        Returns:
+            tuple: (response_json, http_status_code)
+        """
+        admin_key = request.headers.get('Admin-Key')
+        return self.profiler.get_reports(admin_key)
+
+    def download_profile_report(self, filename):
+        """
+        Administrative endpoint to download a profile report
+        (.collapsed, .pstats, .alloc.txt or .tracemalloc).
+        Protected by an admin key in the request header.
+
+        Args:
+            filename (str): The name of the report file
+
+        Returns:
+            Response: The report file as an attachment
+        """
+        admin_key = request.headers.get('Admin-Key')
+        return self.profiler.download_report(admin_key, filename)
     
     def list_uploaded_csvs(self):
         """
@@ -228,6 +281,10 @@ class ApiRoutes:
         """
         Endpoint to create a new teacher assistant project from a PDF file.
         Extracts problems from the PDF and stores them in ChromaDB.
+        An optional 'engine' field selects the project's search engine; fields
+        named after its parameters tune it (e.g. 'M', 'construction_ef' and
+        'search_ef' for Chroma's HNSW index, 'nprobe' for IVF-PQ). An optional
+        'reduce_dim' field stores PCA-reduced vectors of that dimension.
 
         Returns:
             tuple: (response_json, http_status_code)
@@ -254,6 +311,20 @@ class ApiRoutes:
             if not project_name:
                 return jsonify({"error": "Project name cannot be empty"}), 400
 
+            # Names of shard and temporary collections would be mistaken for internal ones
+            if get_project_catalog().get_project(project_name) is None:
+                try:
+                    validate_project_name(project_name)
+                except ValueError as e:
+                    return jsonify({"error": str(e)}), 400
+
+            try:
+                engine, index_params = requested_engine(project_name, request.form)
+                reduce_dim = requested_reduction(request.form)
+                shards = requested_shards(request.form, get_project_catalog().get_project(project_name))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
             # Validate file extension
             if not pdf_file.filename.lower().endswith('.pdf'):
                 return jsonify({"error": "Only PDF files are supported"}), 400
@@ -269,7 +340,12 @@ class ApiRoutes:
             logging.info(f"PDF saved to: {file_path}")
 
             # Process PDF and create project
-            result = process_pdf_to_project(file_path, project_name)
+            result = process_pdf_to_project(file_path, project_name, index_params, shards)
+
+            if result['success'] and result.get('problems_count'):
+                ensure_reduction(project_name, reduce_dim)
+            if result['success'] and engine:
+                set_project_engine(project_name, engine, index_params)
 
             if result['success']:
                 return jsonify({
@@ -284,6 +360,8 @@ class ApiRoutes:
                     "problems_count": result.get('problems_count', 0)
                 }), 400
 
+        except ProjectBusyError as e:
+            return jsonify({"error": str(e)}), 409
         except Exception as e:
             import logging
             logging.exception(f"Error in create_project_from_pdf: {e}")
@@ -292,7 +370,7 @@ class ApiRoutes:
     def get_teacher_projects(self):
         """
         Endpoint to retrieve all teacher assistant projects.
-        Returns list of project names from ChromaDB collections that have documents with type='problem'.
+        Returns list of project names and problem counts from the project catalog.
 
         Returns:
             tuple: (response_json, http_status_code)
@@ -302,45 +380,14 @@ class ApiRoutes:
 
             logging.info("Retrieving teacher assistant projects")
 
-            # Get all collections from ChromaDB
-            all_collections = chroma_client.list_collections()
-            logging.info(f"Total collections in database: {len(all_collections)}")
-
-            # Filter collections that have documents with type='problem' metadata
-            teacher_projects = []
-            for collection in all_collections:
-                try:
-                    # Get collection data
-                    col_data = collection.get()
-                    item_count = len(col_data.get('ids', []))
-
-                    # If collection is empty, still check collection metadata
-                    if item_count == 0:
-                        # Check collection-level metadata
-                        collection_meta = collection.metadata or {}
-                        if collection_meta.get('type') == 'teacher_assistant':
-                            teacher_projects.append({
-                                'name': collection.name,
-                                'problems_count': 0
-                            })
-                            logging.info(f"Added empty teacher project: {collection.name}")
-                        continue
-
-                    # Check if this collection has documents with type='problem' in metadata
-                    metadatas = col_data.get('metadatas', [])
-                    if metadatas and len(metadatas) > 0:
-                        # Check first document's metadata for type='problem'
-                        first_metadata = metadatas[0] or {}
-                        if first_metadata.get('type') == 'problem':
-                            teacher_projects.append({
-                                'name': collection.name,
-                                'problems_count': item_count
-                            })
-                            logging.info(f"Added teacher project: {collection.name} with {item_count} problems")
-
-                except Exception as col_error:
-                    logging.warning(f"Error checking collection {collection.name}: {col_error}")
-                    continue
+            # Read teacher assistant projects from the project catalog
+            teacher_projects = [
+                {
+                    'name': project['name'],
+                    'problems_count': project['document_count']
+                }
+                for project in get_project_catalog().list_projects(TEACHER_ASSISTANT)
+            ]
 
             logging.info(f"Found {len(teacher_projects)} teacher assistant projects")
 
@@ -354,6 +401,42 @@ class ApiRoutes:
             logging.exception(f"Error in get_teacher_projects: {e}")
             return jsonify({"error": f"Failed to retrieve projects: {str(e)}"}), 500
 
+    def set_engine(self, project_name):
+        """
+        Endpoint to select or tune the search engine of a project ('engine' form
+        field, plus optional engine parameters). The engine's index is built
+        before the switch; changing only query-time parameters needs no rebuild.
+
+        Returns:
+            tuple: (response_json, http_status_code)
+        """
+        response, status = handle_set_engine(project_name, request.form)
+        return jsonify(response), status
+
+    def engine_report(self, project_name):
+        """
+        Endpoint that measures recall@k and latency of a project's search engine
+        against exact search. Query arguments: 'engine' and engine parameters
+        to measure another configuration, 'k', 'sample' (number of queries).
+
+        Returns:
+            tuple: (response_json, http_status_code)
+        """
+        response, status = handle_recall_report(project_name, request.args)
+        return jsonify(response), status
+
+    def set_reduction(self, project_name):
+        """
+        Endpoint that sets a project's dimensionality reduction: 'dim' form
+        field (0 for full-size vectors), optional 'k' for the recall report.
+        The collection is rewritten with projected vectors.
+
+        Returns:
+            tuple: (response_json, http_status_code) - the report includes recall@k against full-size vectors
+        """
+        response, status = handle_set_reduction(project_name, request.form)
+        return jsonify(response), status
+
     def delete_project(self, project_name):
         """
         Endpoint to delete a teacher assistant project.
@@ -370,36 +453,26 @@ class ApiRoutes:
 
             logging.info(f"Attempting to delete project: {project_name}")
 
-            # Check if collection exists
-            existing_collections = [c.name for c in chroma_client.list_collections()]
-            if project_name not in existing_collections:
+            # Check if project exists
+            project = get_project_catalog().get_project(project_name)
+            if project is None:
                 return jsonify({
                     "error": f"Project '{project_name}' does not exist."
                 }), 404
 
             # Check if it's a teacher assistant project
-            collection = chroma_client.get_collection(name=project_name)
-            col_data = collection.get()
-
-            is_teacher_project = False
-
-            # Check collection metadata
-            if collection.metadata and collection.metadata.get('type') == 'teacher_assistant':
-                is_teacher_project = True
-
-            # Check document metadata if collection has items
-            if not is_teacher_project and col_data.get('metadatas') and len(col_data['metadatas']) > 0:
-                first_metadata = col_data['metadatas'][0] or {}
-                if first_metadata.get('type') == 'problem':
-                    is_teacher_project = True
-
-            if not is_teacher_project:
+            if project['type'] != TEACHER_ASSISTANT:
                 return jsonify({
                     "error": f"Project '{project_name}' is not a teacher assistant project and cannot be deleted."
                 }), 400
 
-            # Delete the collection
-            chroma_client.delete_collection(name=project_name)
+            # Delete the collection, unless it is being written to or rebuilt
+            with project_rebuild_lock(project_name, wait_seconds=0):
+                delete_project_collections(project_name, project)
+                get_project_catalog().remove_project(project_name)
+                drop_project_indexes(project_name)
+            get_result_cache().drop_project(project_name)
+            get_semantic_cache().drop_project(project_name)
             logging.info(f"Successfully deleted project: {project_name}")
 
             return jsonify({
@@ -407,6 +480,8 @@ class ApiRoutes:
                 "project_name": project_name
             }), 200
 
+        except ProjectBusyError as e:
+            return jsonify({"error": str(e)}), 409
         except Exception as e:
             import logging
             logging.exception(f"Error deleting project {project_name}: {e}")
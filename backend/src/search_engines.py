@@ -0,0 +1,1453 @@
+# search_engines.py
+# This module decides, per project, how nearest-neighbour queries are
+# answered. The Chroma collection stays the store of record and its HNSW
+# index the default engine. Other engines keep derived index files under
+# database/indexes/<project> and return results in Chroma's query format,
+# so callers do not care which engine answered. Records added to a project
+# are appended to its published index; other writes mark the index stale
+# and it is rebuilt from the collection in the background, so no upload
+# waits for a rebuild. Tunable engine parameters live in the project's
+# catalog settings under 'index_params'.
+
+import os
+import time
+import uuid
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+import numpy as np
+import orjson
+from chroma_instance import DB_PATH, REBUILD_SUFFIX, SCRATCH_SUFFIX, SCRATCH_ID_LENGTH, get_chroma_client
+from project_catalog import get_project_catalog
+from project_locks import (project_rebuild_lock, project_write_lock, project_index_lock, ProjectBusyError,
+                           PROJECT_LOCK_WAIT_SECONDS)
+from shards import ShardedCollection, shard_names, get_project_collection, invalidate_project_collection
+
+INDEX_DIR = os.path.join(DB_PATH, "indexes")
+# Rows multiplied per step of the exact search; bounds the float32 working copy
+EXACT_BLOCK_ROWS = int(os.environ.get('EXACT_BLOCK_ROWS', 65536))
+# Records read per page when exporting a collection's embeddings
+EXPORT_PAGE_SIZE = int(os.environ.get('INDEX_EXPORT_PAGE_SIZE', 10000))
+# Seconds an append waits for another update of the same index before leaving the rows to a rebuild
+INDEX_APPEND_WAIT_SECONDS = float(os.environ.get('INDEX_APPEND_WAIT_SECONDS', 5))
+# Seconds before a background index rebuild that failed, or found the project busy, is tried again
+INDEX_REBUILD_RETRY_SECONDS = float(os.environ.get('INDEX_REBUILD_RETRY_SECONDS', 60))
+
+# HNSW defaults of new Chroma collections (Chroma's own defaults), overridable per project
+HNSW_M = int(os.environ.get('HNSW_M', 16))
+HNSW_CONSTRUCTION_EF = int(os.environ.get('HNSW_CONSTRUCTION_EF', 100))
+HNSW_SEARCH_EF = int(os.environ.get('HNSW_SEARCH_EF', 100))
+
+# Hamming-distance candidates kept per requested result by the binary engine, re-ranked exactly
+BINARY_RERANK_FACTOR = int(os.environ.get('BINARY_RERANK_FACTOR', 20))
+# Rows whose codes are compared per step of the binary search; the XOR buffer is queries x rows x words
+BINARY_BLOCK_ROWS = int(os.environ.get('BINARY_BLOCK_ROWS', 16384))
+
+# IVF-PQ defaults; every one can be overridden per project through 'index_params'
+# Inverted lists (coarse clusters); 0 picks about 4 x sqrt(rows)
+IVFPQ_NLIST = int(os.environ.get('IVFPQ_NLIST', 0))
+# Sub-quantisers per vector, each stored in one byte; must divide the embedding dimension
+IVFPQ_PQ_M = int(os.environ.get('IVFPQ_PQ_M', 48))
+# Inverted lists visited per query: the recall / latency knob
+IVFPQ_NPROBE = int(os.environ.get('IVFPQ_NPROBE', 16))
+# Compressed-distance candidates kept per requested result for exact re-ranking
+IVFPQ_RERANK_FACTOR = int(os.environ.get('IVFPQ_RERANK_FACTOR', 10))
+# Vectors sampled to train the coarse quantiser and the codebooks
+IVFPQ_TRAIN_SAMPLE = int(os.environ.get('IVFPQ_TRAIN_SAMPLE', 100000))
+# Projects smaller than this are searched exactly; IVF-PQ needs enough rows to train on
+IVFPQ_MIN_ROWS = int(os.environ.get('IVFPQ_MIN_ROWS', 10000))
+# A trained quantiser is reused on rebuild until the project grows past this multiple of its training size
+IVFPQ_RETRAIN_GROWTH = float(os.environ.get('IVFPQ_RETRAIN_GROWTH', 2.0))
+
+# Upper bounds of a recall report's sampled queries and results per query
+RECALL_MAX_SAMPLE = int(os.environ.get('RECALL_MAX_SAMPLE', 1000))
+RECALL_MAX_K = int(os.environ.get('RECALL_MAX_K', 100))
+
+# Directory, inside a project's index directory, of the scratch files a recall report builds;
+# each report adds a random id, so concurrent reports do not remove each other's files
+REPORT_SCRATCH = '_report'
+
+ENGINE_CHROMA = 'chroma'
+ENGINE_EXACT = 'exact'
+ENGINE_IVFPQ = 'ivfpq'
+ENGINE_BINARY = 'binary'
+
+DEFAULT_INCLUDE = ('documents', 'metadatas', 'distances')
+
+
+def normalise(vectors):
+    """
+    Returns:
+        np.ndarray: float32 rows scaled to unit length (zero rows stay zero)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class IndexFiles:
+    """
+    The files of one project's index. Every build writes new, uniquely named
+    files and then atomically replaces manifest.json, so a reader (in any
+    worker process) sees either the old or the new index, never a mix.
+    """
+    # Present while the published build misses changes made to the collection
+    STALE_MARKER = 'stale'
+
+    def __init__(self, project_name, engine_name):
+        self.directory = os.path.join(INDEX_DIR, project_name, engine_name)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def new_build(self):
+        """
+        Returns:
+            str: Token to put in the file names of a new build
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        return f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+    def manifest_mtime(self):
+        try:
+            return os.stat(self.path('manifest.json')).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def mark_stale(self):
+        os.makedirs(self.directory, exist_ok=True)
+        open(self.path(self.STALE_MARKER), 'a').close()
+
+    def clear_stale(self):
+        try:
+            os.remove(self.path(self.STALE_MARKER))
+        except FileNotFoundError:
+            pass
+
+    def is_stale(self):
+        return os.path.exists(self.path(self.STALE_MARKER))
+
+    def read_manifest(self):
+        try:
+            with open(self.path('manifest.json'), 'rb') as f:
+                return orjson.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def commit(self, manifest):
+        """
+        Publishes a build and removes the files of earlier builds.
+        Processes that still map old files keep them until they unmap them.
+
+        Args:
+            manifest (dict): Build description; 'files' lists the build's file names
+        """
+        tmp_path = self.path(f"manifest.json.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(manifest))
+        os.replace(tmp_path, self.path('manifest.json'))
+        keep = set(manifest.get('files', {}).values()) | {'manifest.json', self.STALE_MARKER}
+        for name in os.listdir(self.directory):
+            if name not in keep and not name.endswith('.tmp'):
+                try:
+                    os.remove(self.path(name))
+                except OSError:
+                    pass
+
+
+def write_ids(path, ids):
+    with open(path, 'wb') as f:
+        f.write(orjson.dumps(ids))
+
+
+def read_ids(path):
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+
+def export_embeddings(collection, path, page_size=EXPORT_PAGE_SIZE, encode=None):
+    """
+    Writes a collection's embeddings, normalised, to a float16 .npy file,
+    page by page, without holding the whole matrix in memory.
+
+    Args:
+        collection: The Chroma collection
+        path (str): Destination .npy file
+        page_size (int): Records per page
+        encode (callable): If given, vectors are made by encode(documents)
+            instead of read from the collection
+
+    Returns:
+        list: Record ids, in row order of the written matrix
+    """
+    total = collection.count()
+    ids = []
+    matrix = None
+    offset = 0
+    while offset < total:
+        page = collection.get(include=['documents'] if encode else ['embeddings'], limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        vectors = normalise(encode(page['documents']) if encode else page['embeddings'])
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(path, mode='w+', dtype=np.float16, shape=(total, vectors.shape[1]))
+        rows = min(len(vectors), total - len(ids))
+        matrix[len(ids):len(ids) + rows] = vectors[:rows]
+        ids.extend(page['ids'][:rows])
+        offset += page_size
+    if matrix is None:
+        np.save(path, np.zeros((0, 0), dtype=np.float16))
+        return ids
+    matrix.flush()
+    del matrix
+    if len(ids) < total:
+        # Records were deleted while exporting; rewrite with the rows actually read
+        np.save(path, np.load(path, mmap_mode='r')[:len(ids)])
+    return ids
+
+
+def append_rows(files, name, count, rows):
+    """
+    Appends rows to a published .npy matrix of which the first count rows
+    are in use. The rows go into the file's spare room, past every row a
+    reader of the published build looks at; a full file is copied once into
+    a new one with room for as many rows again, so appends stay amortised
+    O(rows added).
+
+    Args:
+        files (IndexFiles): The index the matrix belongs to
+        name (str): File name of the matrix, '<role>-<token>.npy'
+        count (int): Rows in use
+        rows (np.ndarray): Rows to append, of the matrix's dtype and width
+
+    Returns:
+        str: File name of the matrix now holding count + len(rows) rows
+    """
+    matrix = np.load(files.path(name), mmap_mode='r+')
+    total = count + len(rows)
+    if total > matrix.shape[0]:
+        grown_name = f"{name.split('-', 1)[0]}-{files.new_build()}.npy"
+        grown = np.lib.format.open_memmap(files.path(grown_name), mode='w+', dtype=matrix.dtype,
+                                          shape=(max(total, 2 * count),) + matrix.shape[1:])
+        for start in range(0, count, EXACT_BLOCK_ROWS):
+            end = min(count, start + EXACT_BLOCK_ROWS)
+            grown[start:end] = matrix[start:end]
+        del matrix
+        matrix, name = grown, grown_name
+    matrix[count:total] = rows
+    matrix.flush()
+    del matrix
+    return name
+
+
+def load_rows(files, name, count):
+    """
+    Returns:
+        np.ndarray: The first count rows of a published matrix, memory-mapped
+    """
+    return np.load(files.path(name), mmap_mode='r')[:count]
+
+
+def blocked_top_k(n, num_queries, k, block_scores_fn, block_rows=EXACT_BLOCK_ROWS):
+    """
+    Top-k over n rows scored one block at a time, each block keeping its
+    best k with argpartition, so memory stays bounded. Ties are broken by
+    row number, so results are deterministic.
+
+    Args:
+        n (int): Number of rows
+        num_queries (int): Number of queries
+        k (int): Results per query
+        block_scores_fn (callable): (start, end) -> (num_queries, end - start) scores, higher is better
+        block_rows (int): Rows per block
+
+    Returns:
+        tuple: (indices, scores), each (num_queries, min(k, n)) and best first
+    """
+    k = min(k, n)
+    best_idx = np.empty((num_queries, 0), dtype=np.int64)
+    best_scores = np.empty((num_queries, 0), dtype=np.float32)
+    for start in range(0, n, block_rows):
+        block_scores = block_scores_fn(start, min(start + block_rows, n))
+        if block_scores.shape[1] > k:
+            part = np.argpartition(-block_scores, k - 1, axis=1)[:, :k]
+        else:
+            part = np.broadcast_to(np.arange(block_scores.shape[1]), block_scores.shape)
+        best_idx = np.concatenate([best_idx, part + start], axis=1)
+        best_scores = np.concatenate([best_scores, np.take_along_axis(block_scores, part, axis=1)], axis=1)
+        if best_idx.shape[1] > k:
+            keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_idx = np.take_along_axis(best_idx, keep, axis=1)
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+
+    # Final order: score descending, then row number ascending
+    order = np.array([np.lexsort((best_idx[q], -best_scores[q])) for q in range(num_queries)]).reshape(num_queries, -1)
+    return np.take_along_axis(best_idx, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+def top_k_dot(matrix, queries, k, block_rows=EXACT_BLOCK_ROWS):
+    """
+    Exact top-k by inner product between unit-length queries and the rows of
+    a (possibly memory-mapped) matrix, multiplied one block at a time.
+
+    Args:
+        matrix (np.ndarray): (n, d) rows, float16 or float32
+        queries (np.ndarray): (q, d) float32 unit-length queries
+        k (int): Results per query
+        block_rows (int): Rows per block
+
+    Returns:
+        tuple: (indices, scores), each (q, min(k, n)) and best first
+    """
+    def block_scores(start, end):
+        return queries @ np.asarray(matrix[start:end], dtype=np.float32).T
+    return blocked_top_k(matrix.shape[0], len(queries), k, block_scores, block_rows)
+
+
+def sign_codes(vectors):
+    """
+    Packs the sign bit of every dimension into uint64 words, padding the
+    dimension up to a multiple of 64 with zero bits.
+
+    Returns:
+        np.ndarray: (n, ceil(d / 64)) uint64 codes
+    """
+    vectors = np.asarray(vectors)
+    bits = np.packbits(vectors > 0, axis=1)
+    pad = (-bits.shape[1]) % 8
+    if pad:
+        bits = np.pad(bits, ((0, 0), (0, pad)))
+    return np.ascontiguousarray(bits).view(np.uint64)
+
+
+def top_k_hamming(codes, query_codes, k, block_rows=BINARY_BLOCK_ROWS):
+    """
+    The k codes closest to each query code by Hamming distance (popcount of XOR).
+
+    Args:
+        codes (np.ndarray): (n, w) uint64 codes
+        query_codes (np.ndarray): (q, w) uint64 codes
+        k (int): Results per query
+
+    Returns:
+        tuple: (indices, distances), each (q, min(k, n)) and closest first
+    """
+    def block_scores(start, end):
+        xor = codes[start:end][None, :, :] ^ query_codes[:, None, :]  # (q, b, w)
+        return -np.bitwise_count(xor).sum(axis=2, dtype=np.int32).astype(np.float32)
+    indices, scores = blocked_top_k(codes.shape[0], len(query_codes), k, block_scores, block_rows)
+    return indices, -scores
+
+
+def rerank(matrix, queries, candidates, k):
+    """
+    Exact re-ranking of per-query candidate rows against the stored matrix.
+
+    Args:
+        matrix (np.ndarray): (n, d) rows, float16 or float32
+        queries (np.ndarray): (q, d) float32 unit-length queries
+        candidates (np.ndarray): (q, c) candidate row numbers; negative entries are padding
+        k (int): Results per query
+
+    Returns:
+        tuple: (indices, scores) - one array per query, best first, at most k long
+    """
+    indices, scores = [], []
+    for query, row in zip(queries, candidates):
+        own = np.unique(row[row >= 0])  # sorted, so the memory map is read in order
+        own_scores = np.asarray(matrix[own], dtype=np.float32) @ query
+        order = np.lexsort((own, -own_scores))[:k]
+        indices.append(own[order])
+        scores.append(own_scores[order])
+    return indices, scores
+
+
+def results_from_rows(collection, ids, row_indices, scores, include=DEFAULT_INCLUDE):
+    """
+    Builds a Chroma-format query result from row numbers found by an index
+    engine, fetching documents and metadata of the hits in one call.
+
+    Args:
+        collection: The Chroma collection
+        ids (list): Record id of every index row
+        row_indices: Row numbers per query, best first
+        scores: Cosine similarities per query
+        include (tuple): Fields to return, as in collection.query
+
+    Returns:
+        dict: {'ids': [[...]], 'documents': [[...]], 'metadatas': [[...]], 'distances': [[...]]}
+    """
+    hit_ids = [[ids[i] for i in row] for row in row_indices]
+    wanted = [f for f in ('documents', 'metadatas') if f in include]
+    records = {}
+    unique_ids = list(dict.fromkeys(i for row in hit_ids for i in row))
+    if wanted and unique_ids:
+        fetched = collection.get(ids=unique_ids, include=wanted)
+        for n, record_id in enumerate(fetched['ids']):
+            records[record_id] = {f: fetched[f][n] for f in wanted}
+
+    if wanted:
+        # A stale index can still return records deleted since its build; they are left out
+        kept = [[n for n, record_id in enumerate(row) if record_id in records] for row in hit_ids]
+        hit_ids = [[row[n] for n in keep] for row, keep in zip(hit_ids, kept)]
+        scores = [[row[n] for n in keep] for row, keep in zip(scores, kept)]
+
+    results = {'ids': hit_ids}
+    for field in wanted:
+        results[field] = [[records.get(i, {}).get(field) for i in row] for row in hit_ids]
+    if 'distances' in include:
+        results['distances'] = [[float(1.0 - s) for s in row] for row in scores]
+    return results
+
+
+def chroma_query(collection, query_embeddings, n_results, where=None, include=DEFAULT_INCLUDE):
+    return collection.query(query_embeddings=query_embeddings, n_results=n_results, where=where, include=list(include))
+
+
+def hnsw_metadata(params):
+    """
+    Returns:
+        dict: Chroma collection metadata entries for the HNSW parameters in params
+    """
+    return {f"hnsw:{k}": int(v) for k, v in (params or {}).items() if k in ChromaEngine.params}
+
+
+def copy_collection(source, target, page_size=EXPORT_PAGE_SIZE, vectors_of=None):
+    """
+    Copies every record, with its embedding, from one collection into another.
+
+    Args:
+        vectors_of (callable): If given, maps a page (ids, documents, embeddings)
+            to the embeddings to write instead of the stored ones
+    """
+    offset = 0
+    while True:
+        page = source.get(include=['embeddings', 'documents', 'metadatas'], limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        embeddings = vectors_of(page) if vectors_of else page['embeddings']
+        target.add(ids=page['ids'], embeddings=embeddings, documents=page['documents'],
+                   metadatas=page['metadatas'])
+        offset += page_size
+
+
+def rebuild_collection(project_name, collection, metadata=None, vectors_of=None):
+    """
+    Recreates a project's collection with new metadata (HNSW build parameters
+    cannot be changed in place) or new vectors: the records are copied into a
+    new collection, which then replaces the old one under the project's name.
+    Queries made between the delete and the rename fail and are retried by
+    the caller. A sharded project is rebuilt one shard at a time. The
+    project's rebuild lock is held throughout, so no write lands in the old
+    collection after it was copied; a rebuild cut short by a crash is
+    finished or rolled back by the catalog's reconcile.
+
+    Args:
+        metadata (dict): Collection metadata entries to add or replace
+        vectors_of (callable): See copy_collection
+
+    Returns:
+        The new collection
+
+    Raises:
+        ProjectBusyError: If writes to the project do not finish in time
+    """
+    with project_rebuild_lock(project_name):
+        if isinstance(collection, ShardedCollection):
+            for name, shard in zip(shard_names(project_name, len(collection.shards)), collection.shards):
+                _rebuild_one(name, shard, metadata, vectors_of)
+            return get_project_collection(project_name)
+        return _rebuild_one(project_name, collection, metadata, vectors_of)
+
+
+def _rebuild_one(name, collection, metadata, vectors_of):
+    client = get_chroma_client()
+    temporary = f"{name}{REBUILD_SUFFIX}"
+    if client.has_collection(temporary):
+        # An earlier copy that never replaced the original (which still exists)
+        client.delete_collection(temporary)
+    rebuilt = client.create_collection(name=temporary, embedding_function=None,
+                                       metadata={**(collection.metadata or {}), **(metadata or {})})
+    copy_collection(collection, rebuilt, vectors_of=vectors_of)
+    client.delete_collection(name)
+    rebuilt.modify(name=name)
+    client.invalidate(temporary)
+    client.invalidate(name)
+    return client.get_collection(name=name)
+
+
+class SearchEngine:
+    """
+    Base class of the search engines. query() answers in Chroma's format.
+    """
+    name = None
+    # Tunable parameters and their defaults; a project's 'index_params' override them
+    params = {}
+    # Parameters only read at query time; changing them needs no rebuild
+    query_params = ()
+
+    def resolve_params(self, overrides=None):
+        return {**self.params, **{k: v for k, v in (overrides or {}).items() if k in self.params}}
+
+    def build(self, project_name, collection, params=None):
+        """
+        Rebuilds the engine's index of a project from its collection.
+        """
+
+    def apply_query_params(self, collection, params):
+        """
+        Applies query-time parameters kept in the index rather than passed per query.
+        """
+
+    def needs_scratch(self, collection, is_current, stored, params):
+        """
+        Returns:
+            bool: True if measuring params needs an index other than the live one
+        """
+        return not is_current
+
+    @contextmanager
+    def scratch(self, project_name, collection, params):
+        """
+        Builds a temporary index with params, for measurement, and removes it afterwards.
+
+        Yields:
+            tuple: (index_key, collection) to pass to query()
+        """
+        raise NotImplementedError
+        yield
+
+    def drop(self, project_name):
+        shutil.rmtree(os.path.join(INDEX_DIR, project_name, self.name), ignore_errors=True)
+
+    def query(self, project_name, collection, query_embeddings, n_results, where=None, include=DEFAULT_INCLUDE,
+              params=None):
+        raise NotImplementedError
+
+
+class ChromaEngine(SearchEngine):
+    """
+    Chroma's own HNSW index. M and construction_ef are fixed when a
+    collection is created, so changing them copies the project into a new
+    collection; search_ef is changed in place.
+    """
+    name = ENGINE_CHROMA
+    params = {
+        'M': HNSW_M,
+        'construction_ef': HNSW_CONSTRUCTION_EF,
+        'search_ef': HNSW_SEARCH_EF,
+    }
+    query_params = ('search_ef',)
+
+    def collection_params(self, collection, stored=None):
+        """
+        Returns:
+            dict: The HNSW parameters the collection runs with; search_ef set
+                after creation is only known from the stored project settings
+        """
+        metadata = collection.metadata or {}
+        params = {k: metadata.get(f"hnsw:{k}", default) for k, default in self.params.items()}
+        params.update({k: v for k, v in (stored or {}).items() if k in self.query_params})
+        return params
+
+    def build(self, project_name, collection, params=None):
+        current = self.collection_params(collection)
+        # Parameters not given keep the collection's values
+        target = {**current, **{k: v for k, v in (params or {}).items() if k in self.params}}
+        if any(target[k] != current[k] for k in self.params if k not in self.query_params):
+            started = time.perf_counter()
+            collection = rebuild_collection(project_name, collection, hnsw_metadata(target))
+            logging.info(f"Rebuilt collection '{project_name}' with HNSW {target} in {time.perf_counter() - started:.2f}s")
+        self.apply_query_params(collection, target)
+
+    def apply_query_params(self, collection, params):
+        if 'search_ef' in params:
+            collection.modify(configuration={'hnsw': {'ef_search': int(params['search_ef'])}})
+
+    def needs_scratch(self, collection, is_current, stored, params):
+        live = self.collection_params(collection, stored if is_current else None)
+        return any(live[k] != v for k, v in params.items() if k in self.params)
+
+    @contextmanager
+    def scratch(self, project_name, collection, params):
+        client = get_chroma_client()
+        name = f"{project_name}{SCRATCH_SUFFIX}{uuid.uuid4().hex[:SCRATCH_ID_LENGTH]}"
+        target = {**self.collection_params(collection), **params}
+        scratch = client.create_collection(name=name, embedding_function=None,
+                                           metadata={**(collection.metadata or {}), **hnsw_metadata(target)})
+        try:
+            copy_collection(collection, scratch)
+            yield name, scratch
+        finally:
+            client.delete_collection(name)
+
+    def drop(self, project_name):
+        pass
+
+    def query(self, project_name, collection, query_embeddings, n_results, where=None, include=DEFAULT_INCLUDE,
+              params=None):
+        return chroma_query(collection, query_embeddings, n_results, where, include)
+
+
+class MappedIndexEngine(SearchEngine):
+    """
+    Base class of engines whose index is a set of files, memory-mapped by
+    every worker process. Loaded indexes are cached per process and reloaded
+    when another process publishes a new build. Queries with a metadata
+    filter, or made before a first build exists, are answered by Chroma.
+    Added records are appended to the published build by append(); a build
+    is only 'count' rows long, its matrices may have spare room past that.
+    """
+    def __init__(self):
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def files(self, project_name):
+        return IndexFiles(project_name, self.name)
+
+    def load(self, project_name):
+        """
+        Returns:
+            dict: The loaded index, or None if it has not been built
+        """
+        files = self.files(project_name)
+        mtime = files.manifest_mtime()
+        if mtime is None:
+            return None
+        if files.is_stale():
+            # Left by a process that stopped before its rebuild finished
+            schedule_index_rebuild(project_name)
+        with self._lock:
+            cached = self._loaded.get(project_name)
+            if cached is not None and cached['mtime'] == mtime:
+                return cached
+        manifest = files.read_manifest()
+        index = self.open(files, manifest)
+        index['mtime'] = mtime
+        with self._lock:
+            self._loaded[project_name] = index
+        return index
+
+    def open(self, files, manifest):
+        """
+        Maps a published build into memory.
+
+        Returns:
+            dict: Engine-specific index contents
+        """
+        raise NotImplementedError
+
+    def drop(self, project_name):
+        with self._lock:
+            self._loaded.pop(project_name, None)
+        super().drop(project_name)
+
+    def append(self, project_name, collection, record_ids):
+        """
+        Adds newly written records to the published build, in O(records
+        added) instead of rebuilding it from the whole collection. Records
+        the build already holds are skipped.
+
+        Args:
+            project_name (str): Project name
+            collection: The project's collection, holding the records
+            record_ids (list): Ids of the added records
+
+        Returns:
+            bool: False if the build cannot take the records and needs a rebuild
+        """
+        files = self.files(project_name)
+        manifest = files.read_manifest()
+        if manifest is None or not manifest['count'] or files.is_stale():
+            return False
+        ids = read_ids(files.path(manifest['files']['ids']))
+        known = set(ids)
+        new_ids, vectors = [], []
+        record_ids = [i for i in dict.fromkeys(record_ids) if i not in known]
+        for start in range(0, len(record_ids), EXPORT_PAGE_SIZE):
+            page = collection.get(ids=record_ids[start:start + EXPORT_PAGE_SIZE], include=['embeddings'])
+            new_ids.extend(page['ids'])
+            vectors.extend(page['embeddings'])
+        if not new_ids:
+            return True
+        if not self.can_append(manifest, len(ids) + len(new_ids)):
+            return False
+        rows = normalise(vectors).astype(np.float16)
+        if rows.shape[1] != load_rows(files, manifest['files']['embeddings'], 0).shape[1]:
+            return False
+
+        token = files.new_build()
+        built = dict(manifest['files'])
+        built['embeddings'] = append_rows(files, built['embeddings'], len(ids), rows)
+        self.extend(files, manifest, built, rows, token)
+        built['ids'] = f"ids-{token}.json"
+        write_ids(files.path(built['ids']), ids + new_ids)
+        files.commit({**manifest, 'count': len(ids) + len(new_ids), 'appended_at': time.time(), 'files': built})
+        return True
+
+    def can_append(self, manifest, count):
+        """
+        Returns:
+            bool: Whether a build can grow to count rows by appending
+        """
+        return True
+
+    def extend(self, files, manifest, built, rows, token):
+        """
+        Appends the rows' entries to the engine's own files of a build,
+        updating built (role -> file name) with the files it wrote.
+        """
+
+    def needs_scratch(self, collection, is_current, stored, params):
+        return not is_current or _needs_rebuild(self, stored, params)
+
+    @contextmanager
+    def scratch(self, project_name, collection, params):
+        index_key = os.path.join(project_name, _report_scratch_name())
+        self.build(index_key, collection, params)
+        try:
+            yield index_key, collection
+        finally:
+            self.drop(index_key)
+            shutil.rmtree(os.path.join(INDEX_DIR, index_key), ignore_errors=True)
+
+    def query(self, project_name, collection, query_embeddings, n_results, where=None, include=DEFAULT_INCLUDE,
+              params=None):
+        index = self.load(project_name) if where is None else None
+        if index is None or not index['ids']:
+            return chroma_query(collection, query_embeddings, n_results, where, include)
+        row_indices, scores = self.search(index, normalise(query_embeddings), n_results, self.resolve_params(params))
+        return results_from_rows(collection, index['ids'], row_indices, scores, include)
+
+    def search(self, index, queries, n_results, params):
+        """
+        Returns:
+            tuple: (row_indices, scores) - per query, best first
+        """
+        raise NotImplementedError
+
+
+class ExactEngine(MappedIndexEngine):
+    """
+    Brute-force search over a memory-mapped float16 matrix of the project's
+    normalised embeddings: exact, deterministic, and nothing is copied into
+    process memory beyond the block being multiplied.
+    """
+    name = ENGINE_EXACT
+
+    def build(self, project_name, collection, params=None):
+        files = self.files(project_name)
+        token = files.new_build()
+        embeddings_name, ids_name = f"embeddings-{token}.npy", f"ids-{token}.json"
+        ids = export_embeddings(collection, files.path(embeddings_name))
+        write_ids(files.path(ids_name), ids)
+        files.commit({
+            'engine': self.name,
+            'count': len(ids),
+            'built_at': time.time(),
+            'files': {'embeddings': embeddings_name, 'ids': ids_name},
+        })
+
+    def open(self, files, manifest):
+        ids = read_ids(files.path(manifest['files']['ids']))
+        matrix = load_rows(files, manifest['files']['embeddings'], manifest['count'])
+        return {'ids': ids, 'matrix': matrix}
+
+    def search(self, index, queries, n_results, params):
+        return top_k_dot(index['matrix'], queries, n_results)
+
+
+def _pq_subquantisers(dim, requested):
+    """
+    Returns:
+        int: The largest divisor of dim not above the requested sub-quantiser count
+    """
+    for m in range(min(requested, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+class IVFPQEngine(MappedIndexEngine):
+    """
+    FAISS inverted-file index with product quantisation, for projects too
+    large to keep full float32 vectors and a graph in memory. Each vector is
+    held as pq_m one-byte codes in nlist clusters; a query scans the nprobe
+    closest clusters on compressed distances, then re-ranks its shortlist of
+    k x rerank_factor candidates exactly against the memory-mapped float16
+    embeddings, so only the shortlisted rows are read from disk.
+
+    Quantisers are trained on a random sample of the project and reused by
+    later rebuilds until the project outgrows them. Added records are
+    encoded with the trained quantiser and appended to the lists; once the
+    project outgrows it, or reaches IVFPQ_MIN_ROWS, the next write rebuilds.
+    Projects below IVFPQ_MIN_ROWS are not trained at all and searched exactly.
+    """
+    name = ENGINE_IVFPQ
+    params = {
+        'nlist': IVFPQ_NLIST,
+        'pq_m': IVFPQ_PQ_M,
+        'nprobe': IVFPQ_NPROBE,
+        'rerank_factor': IVFPQ_RERANK_FACTOR,
+    }
+    query_params = ('nprobe', 'rerank_factor')
+
+    def _trained_index(self, files, matrix, params):
+        """
+        Returns a trained, empty IVF-PQ index for the matrix: the previous
+        build's quantiser if it still fits, else one trained on a fresh sample.
+
+        Returns:
+            tuple: (index, trained_file_name, trained_on_rows)
+        """
+        import faiss
+
+        rows, dim = matrix.shape
+        previous = files.read_manifest() or {}
+        trained_name = previous.get('files', {}).get('trained')
+        trained_on = previous.get('trained_on', 0)
+        if (trained_name and previous.get('dim') == dim
+                and previous.get('train_params') == self._train_params(params, trained_on)
+                and rows <= trained_on * IVFPQ_RETRAIN_GROWTH):
+            return faiss.read_index(files.path(trained_name)), trained_name, previous['trained_on']
+
+        nlist, pq_m = self._train_params(params, rows)
+        sample_rows = min(rows, max(IVFPQ_TRAIN_SAMPLE, 39 * nlist))
+        sample = np.sort(np.random.default_rng(0).choice(rows, size=sample_rows, replace=False))
+        sample = np.ascontiguousarray(matrix[sample], dtype=np.float32)
+
+        quantiser = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(quantiser, dim, nlist, pq_m, 8, faiss.METRIC_INNER_PRODUCT)
+        started = time.perf_counter()
+        index.train(sample)
+        logging.info(f"Trained IVF-PQ (nlist={nlist}, pq_m={pq_m}) on {sample_rows} of {rows} vectors "
+                     f"in {time.perf_counter() - started:.2f}s")
+
+        trained_name = f"trained-{files.new_build()}.faiss"
+        faiss.write_index(index, files.path(trained_name))
+        return index, trained_name, rows
+
+    def _train_params(self, params, rows):
+        nlist = params['nlist'] or int(4 * np.sqrt(rows))
+        # k-means wants about 39 training points per cluster
+        nlist = max(1, min(nlist, rows // 39))
+        return [nlist, params['pq_m']]
+
+    def build(self, project_name, collection, params=None):
+        import faiss
+
+        params = self.resolve_params(params)
+        files = self.files(project_name)
+        token = files.new_build()
+        embeddings_name, ids_name = f"embeddings-{token}.npy", f"ids-{token}.json"
+        ids = export_embeddings(collection, files.path(embeddings_name))
+        write_ids(files.path(ids_name), ids)
+        manifest = {
+            'engine': self.name,
+            'count': len(ids),
+            'built_at': time.time(),
+            'files': {'embeddings': embeddings_name, 'ids': ids_name},
+        }
+
+        matrix = np.load(files.path(embeddings_name), mmap_mode='r')
+        if len(ids) >= IVFPQ_MIN_ROWS:
+            dim = matrix.shape[1]
+            params['pq_m'] = _pq_subquantisers(dim, params['pq_m'])
+            index, trained_name, trained_on = self._trained_index(files, matrix, params)
+            for start in range(0, len(ids), EXACT_BLOCK_ROWS):
+                index.add(np.ascontiguousarray(matrix[start:start + EXACT_BLOCK_ROWS], dtype=np.float32))
+            index_name = f"ivfpq-{token}.faiss"
+            faiss.write_index(index, files.path(index_name))
+            manifest['files'].update({'index': index_name, 'trained': trained_name})
+            manifest.update({'dim': dim, 'trained_on': trained_on, 'train_params': self._train_params(params, trained_on)})
+        del matrix
+        files.commit(manifest)
+
+    def can_append(self, manifest, count):
+        if 'index' not in manifest['files']:
+            # Searched exactly until there are enough rows to train on
+            return count < IVFPQ_MIN_ROWS
+        return count <= manifest['trained_on'] * IVFPQ_RETRAIN_GROWTH
+
+    def extend(self, files, manifest, built, rows, token):
+        if 'index' not in manifest['files']:
+            return
+        import faiss
+
+        # The inverted lists hold the codes of every row, so they are read and written whole;
+        # that is pq_m bytes per row, and no vector is read or encoded again
+        index = faiss.read_index(files.path(manifest['files']['index']))
+        index.add(np.ascontiguousarray(rows, dtype=np.float32))
+        built['index'] = f"ivfpq-{token}.faiss"
+        faiss.write_index(index, files.path(built['index']))
+
+    def open(self, files, manifest):
+        ids = read_ids(files.path(manifest['files']['ids']))
+        matrix = load_rows(files, manifest['files']['embeddings'], manifest['count'])
+        index = None
+        if 'index' in manifest['files']:
+            import faiss
+            index = faiss.read_index(files.path(manifest['files']['index']))
+        return {'ids': ids, 'matrix': matrix, 'index': index}
+
+    def search(self, index, queries, n_results, params):
+        if index['index'] is None:
+            return top_k_dot(index['matrix'], queries, n_results)
+        import faiss
+
+        shortlist = min(len(index['ids']), max(n_results, n_results * params['rerank_factor']))
+        search_params = faiss.SearchParametersIVF(nprobe=max(1, params['nprobe']))
+        _, candidates = index['index'].search(np.ascontiguousarray(queries), shortlist, params=search_params)
+        return rerank(index['matrix'], queries, candidates, n_results)
+
+
+class BinaryEngine(MappedIndexEngine):
+    """
+    One sign bit per dimension, packed into uint64 words: a 384-d embedding
+    takes 48 bytes of memory instead of 1536. Queries take a shortlist of
+    k x rerank_factor rows by Hamming distance (popcount of XOR), then
+    re-rank it exactly against the memory-mapped float16 embeddings. Signs
+    are taken after subtracting the project's mean embedding, so the bits
+    split the data instead of all agreeing on the dimensions the model
+    keeps positive. With rerank_factor 0 the float vectors are not read and
+    scores are estimated from the Hamming distance.
+    """
+    name = ENGINE_BINARY
+    params = {'rerank_factor': BINARY_RERANK_FACTOR}
+    query_params = ('rerank_factor',)
+
+    def build(self, project_name, collection, params=None):
+        files = self.files(project_name)
+        token = files.new_build()
+        embeddings_name, ids_name = f"embeddings-{token}.npy", f"ids-{token}.json"
+        codes_name, mean_name = f"codes-{token}.npy", f"mean-{token}.npy"
+        ids = export_embeddings(collection, files.path(embeddings_name))
+        write_ids(files.path(ids_name), ids)
+
+        matrix = np.load(files.path(embeddings_name), mmap_mode='r')
+        dim = matrix.shape[1] if matrix.ndim == 2 else 0
+        mean = np.zeros(dim, dtype=np.float32)
+        for start in range(0, len(ids), EXACT_BLOCK_ROWS):
+            mean += np.asarray(matrix[start:start + EXACT_BLOCK_ROWS], dtype=np.float32).sum(axis=0)
+        mean /= max(1, len(ids))
+        codes = np.lib.format.open_memmap(files.path(codes_name), mode='w+', dtype=np.uint64,
+                                          shape=(len(ids), -(-dim // 64)))
+        for start in range(0, len(ids), EXACT_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + EXACT_BLOCK_ROWS], dtype=np.float32)
+            codes[start:start + len(block)] = sign_codes(block - mean)
+        codes.flush()
+        del codes, matrix
+        np.save(files.path(mean_name), mean)
+
+        files.commit({
+            'engine': self.name,
+            'count': len(ids),
+            'dim': dim,
+            'built_at': time.time(),
+            'files': {'embeddings': embeddings_name, 'ids': ids_name, 'codes': codes_name, 'mean': mean_name},
+        })
+
+    def extend(self, files, manifest, built, rows, token):
+        # Signed against the mean of the last rebuild; appends do not move it
+        mean = np.load(files.path(manifest['files']['mean']))
+        built['codes'] = append_rows(files, built['codes'], manifest['count'],
+                                     sign_codes(np.asarray(rows, dtype=np.float32) - mean))
+
+    def open(self, files, manifest):
+        ids = read_ids(files.path(manifest['files']['ids']))
+        matrix = load_rows(files, manifest['files']['embeddings'], manifest['count'])
+        # The codes are the in-memory part of the index; the float vectors stay on disk
+        codes = np.array(load_rows(files, manifest['files']['codes'], manifest['count']))
+        mean = np.load(files.path(manifest['files']['mean']))
+        return {'ids': ids, 'matrix': matrix, 'codes': codes, 'mean': mean, 'dim': manifest['dim']}
+
+    def search(self, index, queries, n_results, params):
+        query_codes = sign_codes(queries - index['mean'])
+        if params['rerank_factor'] <= 0:
+            rows, distances = top_k_hamming(index['codes'], query_codes, n_results)
+            # Angle estimate from the fraction of differing sign bits
+            return rows, np.cos(np.pi * distances / max(1, index['dim']))
+        shortlist = max(n_results, n_results * params['rerank_factor'])
+        candidates, _ = top_k_hamming(index['codes'], query_codes, shortlist)
+        return rerank(index['matrix'], queries, candidates, n_results)
+
+
+ENGINES = {
+    ENGINE_CHROMA: ChromaEngine(),
+    ENGINE_EXACT: ExactEngine(),
+    ENGINE_IVFPQ: IVFPQEngine(),
+    ENGINE_BINARY: BinaryEngine(),
+}
+
+
+def parse_index_params(engine_name, form):
+    """
+    Reads the tunable parameters of an engine from request form fields.
+
+    Args:
+        engine_name (str): Engine the parameters are for
+        form (dict): Request form; fields not named after a parameter are ignored
+
+    Returns:
+        dict: Parameter values given in the form
+
+    Raises:
+        ValueError: If the engine is unknown or a value is not a non-negative integer
+    """
+    if engine_name not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine_name}'. Use one of {list(ENGINES)}.")
+    params = {}
+    for name in ENGINES[engine_name].params:
+        value = (form.get(name) or '').strip()
+        if not value:
+            continue
+        try:
+            params[name] = int(value)
+        except ValueError:
+            raise ValueError(f"'{name}' must be an integer")
+        if params[name] < 0:
+            raise ValueError(f"'{name}' must not be negative")
+    return params
+
+
+def project_engine(project):
+    """
+    Args:
+        project (dict): Catalog entry, or None for collections outside the catalog
+
+    Returns:
+        SearchEngine: The engine selected for the project
+    """
+    name = (project or {}).get('settings', {}).get('engine', ENGINE_CHROMA)
+    return ENGINES.get(name, ENGINES[ENGINE_CHROMA])
+
+
+def project_index_params(project):
+    return (project or {}).get('settings', {}).get('index_params', {})
+
+
+def requested_engine(project_name, form):
+    """
+    Reads the engine and engine parameters an upload form asks for. Without
+    an 'engine' field, parameters are read for the project's current engine
+    (Chroma for a new project), so tuning never switches engines by accident.
+
+    Returns:
+        tuple: (engine_name, params) - engine_name is None when the form asks for neither
+
+    Raises:
+        ValueError: If the engine is unknown or a parameter is invalid
+    """
+    engine_name = (form.get('engine') or '').strip() or None
+    effective = engine_name or project_engine(get_project_catalog().get_project(project_name)).name
+    params = parse_index_params(effective, form)
+    if engine_name is None and not params:
+        return None, {}
+    return effective, params
+
+
+def query_project(project_name, query_embeddings, n_results, where=None, include=DEFAULT_INCLUDE, project=None):
+    """
+    Answers a query with the project's engine, after passing the query
+    vectors through the project's dimensionality reduction, if it has one.
+
+    Args:
+        project_name (str): Project (collection) name
+        query_embeddings (list): Query vectors
+        n_results (int): Results per query
+        where (dict): Optional metadata filter
+        include (tuple): Fields to return
+        project (dict): Catalog entry if the caller already has it
+
+    Returns:
+        dict: Query result in Chroma's format
+    """
+    if project is None:
+        project = get_project_catalog().get_project(project_name)
+    # Imported here: reduction builds on this module
+    from reduction import reduce_vectors
+    query_embeddings = reduce_vectors(project, query_embeddings)
+    engine = project_engine(project)
+    params = project_index_params(project)
+    try:
+        return engine.query(project_name, get_project_collection(project_name, project), query_embeddings, n_results,
+                            where, include, params)
+    except Exception:
+        # The cached handle may be stale (collection recreated by another worker); retry once
+        invalidate_project_collection(project_name, project)
+        return engine.query(project_name, get_project_collection(project_name, project), query_embeddings, n_results,
+                            where, include, params)
+
+
+def project_changed(project_name, added_ids=None, wait=False):
+    """
+    Called after documents of a project were added, changed or deleted.
+    Brings the index of the project's engine, if it keeps one, up to date,
+    then bumps the project's write version so cached results are no longer
+    served. When records were only added, they are appended to the index;
+    any other change marks the index stale and it is rebuilt in the
+    background. Until then queries are answered by the stale index, minus
+    the records deleted since.
+
+    Args:
+        project_name (str): Project name
+        added_ids (list): Ids of the added records, if nothing else changed
+        wait (bool): Rebuild in the calling thread instead, for callers that
+            replace the collection themselves (the stale index would not fit it)
+    """
+    catalog = get_project_catalog()
+    project = catalog.get_project(project_name)
+    engine = project_engine(project)
+    if isinstance(engine, MappedIndexEngine):
+        if wait:
+            rebuild_project_index(project_name)
+        elif added_ids is None or not _append_to_index(engine, project_name, project, added_ids):
+            schedule_index_rebuild(project_name)
+    # Bumped once the index is current: results cached while it was updated are dropped too
+    catalog.bump_write_version(project_name)
+
+
+def _append_to_index(engine, project_name, project, added_ids):
+    try:
+        with project_index_lock(project_name, INDEX_APPEND_WAIT_SECONDS):
+            started = time.perf_counter()
+            if not engine.append(project_name, get_project_collection(project_name, project), added_ids):
+                return False
+    except ProjectBusyError:
+        return False
+    logging.info(f"Appended {len(added_ids)} records to the {engine.name} index of '{project_name}' "
+                 f"in {time.perf_counter() - started:.2f}s")
+    return True
+
+
+def rebuild_project_index(project_name, wait_seconds=PROJECT_LOCK_WAIT_SECONDS):
+    """
+    Rebuilds the index of a project's engine from its collection, if the
+    engine keeps one. Callers hold the project's write or rebuild lock.
+
+    Returns:
+        bool: True if an index was rebuilt
+
+    Raises:
+        ProjectBusyError: If another update of the index is still running after wait_seconds
+    """
+    project = get_project_catalog().get_project(project_name)
+    engine = project_engine(project)
+    if project is None or not isinstance(engine, MappedIndexEngine):
+        return False
+    with project_index_lock(project_name, wait_seconds):
+        files = engine.files(project_name)
+        # Cleared first: a write made while this build runs marks it stale again
+        files.clear_stale()
+        started = time.perf_counter()
+        engine.build(project_name, get_project_collection(project_name, project), project_index_params(project))
+        logging.info(f"Rebuilt {engine.name} index of '{project_name}' in {time.perf_counter() - started:.2f}s")
+    return True
+
+
+_rebuilds = set()
+_rebuild_failed_at = {}
+_rebuilds_lock = threading.Lock()
+
+
+def schedule_index_rebuild(project_name):
+    """
+    Marks the index of a project's engine stale and rebuilds it in a
+    background thread, unless this process already is. Every process sees
+    the mark, so a rebuild left unfinished by one is picked up by another.
+    """
+    engine = project_engine(get_project_catalog().get_project(project_name))
+    if not isinstance(engine, MappedIndexEngine):
+        return
+    engine.files(project_name).mark_stale()
+    with _rebuilds_lock:
+        if project_name in _rebuilds:
+            return
+        if time.monotonic() - _rebuild_failed_at.get(project_name, -INDEX_REBUILD_RETRY_SECONDS) < INDEX_REBUILD_RETRY_SECONDS:
+            return
+        _rebuilds.add(project_name)
+    threading.Thread(target=_rebuild_stale_index, args=(project_name,), name='index-rebuild', daemon=True).start()
+
+
+def _rebuild_stale_index(project_name):
+    catalog = get_project_catalog()
+    try:
+        while True:
+            project = catalog.get_project(project_name)
+            engine = project_engine(project)
+            if project is None or not isinstance(engine, MappedIndexEngine) or not engine.files(project_name).is_stale():
+                break
+            # Shared with ingestion, exclusive against a rebuild of the collection, which would
+            # pull it away from under the export; waits until such a rebuild is over
+            try:
+                with project_write_lock(project_name):
+                    rebuilt = rebuild_project_index(project_name, wait_seconds=INDEX_REBUILD_RETRY_SECONDS)
+            except ProjectBusyError:
+                time.sleep(INDEX_REBUILD_RETRY_SECONDS)
+                continue
+            if rebuilt:
+                catalog.bump_write_version(project_name)
+    except Exception as e:
+        logging.exception(f"Background index rebuild of '{project_name}' failed: {e}")
+        with _rebuilds_lock:
+            _rebuild_failed_at[project_name] = time.monotonic()
+            _rebuilds.discard(project_name)
+        return
+    with _rebuilds_lock:
+        _rebuilds.discard(project_name)
+    # A write may have marked the index between the last check and now, and found this thread still running
+    if project is not None and isinstance(engine, MappedIndexEngine) and engine.files(project_name).is_stale():
+        schedule_index_rebuild(project_name)
+
+
+def set_project_engine(project_name, engine_name, params=None):
+    """
+    Selects the search engine of a project, building its index first so
+    queries never switch to an engine without one. When the engine is
+    already selected and only query-time parameters change, nothing is rebuilt.
+
+    Args:
+        project_name (str): Project name
+        engine_name (str): One of ENGINES
+        params (dict): Engine parameters to store; replaces the stored ones
+
+    Raises:
+        ValueError: If the engine is unknown
+        ProjectBusyError: If writes to the project do not finish in time
+    """
+    if engine_name not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine_name}'. Use one of {list(ENGINES)}.")
+    # The engine's index and the stored settings change together, with no write in between
+    with project_rebuild_lock(project_name):
+        _set_project_engine(project_name, ENGINES[engine_name], params)
+
+
+def _set_project_engine(project_name, engine, params):
+    params = {k: v for k, v in (params or {}).items() if k in engine.params}
+    project = get_project_catalog().get_project(project_name)
+    current = project_engine(project)
+    query_only = params and all(k in engine.query_params for k in params)
+    collection = get_project_collection(project_name, project)
+    if current is not engine or not query_only:
+        params = {**(project_index_params(project) if current is engine else {}), **params}
+        with project_index_lock(project_name):
+            if isinstance(engine, MappedIndexEngine):
+                engine.files(project_name).clear_stale()
+            engine.build(project_name, collection, params)
+    else:
+        params = {**project_index_params(project), **params}
+        engine.apply_query_params(collection, params)
+    get_project_catalog().update_settings(project_name, {'engine': engine.name, 'index_params': params})
+    for other in ENGINES.values():
+        if other is not engine:
+            other.drop(project_name)
+
+
+def handle_set_engine(project_name, form):
+    """
+    Endpoint handler that switches a project's search engine or tunes it.
+    The form holds 'engine' and, optionally, engine parameters such as 'nprobe'.
+
+    Returns:
+        tuple: (response_dict, http_status_code)
+    """
+    project = get_project_catalog().get_project(project_name)
+    if project is None:
+        return {'error': f"Project '{project_name}' does not exist."}, 404
+    engine_name = (form.get('engine') or '').strip()
+    if not engine_name:
+        return {'error': "Missing 'engine'"}, 400
+    try:
+        params = parse_index_params(engine_name, form)
+        started = time.perf_counter()
+        set_project_engine(project_name, engine_name, params)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    except ProjectBusyError as e:
+        return {'error': str(e)}, 409
+    return {
+        'project_name': project_name,
+        'engine': engine_name,
+        'index_params': project_index_params(get_project_catalog().get_project(project_name)),
+        'build_seconds': round(time.perf_counter() - started, 3),
+    }, 200
+
+
+def _report_scratch_name():
+    return f"{REPORT_SCRATCH}-{uuid.uuid4().hex[:SCRATCH_ID_LENGTH]}"
+
+
+def ground_truth(project_name, collection, k, sample_size, seed=0):
+    """
+    Exports the collection to a temporary file, samples stored embeddings
+    from it as queries and finds their exact top k+1 neighbours.
+
+    Returns:
+        dict: 'query_ids', 'queries', 'truth' (ids per query, best first),
+            'exact_ms' (latency per query) and 'documents'
+    """
+    files = IndexFiles(project_name, _report_scratch_name())
+    truth_path = files.path(f"truth-{files.new_build()}.npy")
+    try:
+        ids = export_embeddings(collection, truth_path)
+        matrix = np.load(truth_path, mmap_mode='r')
+        # Sampled from the export: one read of the collection instead of a paged lookup per query
+        rows = np.sort(np.random.default_rng(seed).choice(len(ids), size=min(sample_size, len(ids)), replace=False))
+        query_ids = [ids[i] for i in rows]
+        queries = np.asarray(matrix[rows], dtype=np.float32)
+        exact_ms, truth = [], []
+        for query in queries:
+            started = time.perf_counter()
+            hits, _ = top_k_dot(matrix, query[None, :], k + 1)
+            exact_ms.append((time.perf_counter() - started) * 1000)
+            truth.append([ids[i] for i in hits[0]])
+        del matrix
+    finally:
+        shutil.rmtree(files.directory, ignore_errors=True)
+    return {'query_ids': query_ids, 'queries': queries, 'truth': truth, 'exact_ms': exact_ms, 'documents': len(ids)}
+
+
+def measure_engine(engine, index_key, collection, truth, k, params=None):
+    """
+    Runs the ground-truth queries one at a time through an engine. A query's
+    own record is left out of both result lists, so the trivial self-match
+    does not inflate recall.
+
+    Returns:
+        tuple: (recall_at_k, latency percentiles in ms)
+    """
+    latencies, hits = [], 0
+    for query_id, query, expected in zip(truth['query_ids'], truth['queries'], truth['truth']):
+        started = time.perf_counter()
+        found = engine.query(index_key, collection, [query.tolist()], k + 1, include=(), params=params)['ids'][0]
+        latencies.append((time.perf_counter() - started) * 1000)
+        expected = [i for i in expected if i != query_id][:k]
+        found = [i for i in found if i != query_id][:k]
+        hits += len(set(expected) & set(found))
+    possible = len(truth['query_ids']) * min(k, truth['documents'] - 1)
+    return round(hits / max(1, possible), 4), latency_percentiles(latencies)
+
+
+@contextmanager
+def measured_index(engine, project_name, collection, is_current, stored, params):
+    """
+    Yields the index to measure params on: the live one when it already
+    runs with them, else a scratch index removed afterwards.
+
+    Yields:
+        tuple: (index_key, collection)
+    """
+    if engine.needs_scratch(collection, is_current, stored, params):
+        with engine.scratch(project_name, collection, params) as index:
+            yield index
+    else:
+        yield project_name, collection
+
+
+def recall_report(project_name, engine_name=None, params=None, k=10, sample_size=100, seed=0):
+    """
+    Measures an engine on a project against exact search: recall@k and
+    per-query latency over stored embeddings sampled as queries. Engines or
+    parameters other than the project's own are measured on a scratch index,
+    so the live index is never touched.
+
+    Args:
+        project_name (str): Project name
+        engine_name (str): Engine to measure, defaults to the project's engine
+        params (dict): Engine parameters, defaults to the project's
+        k (int): Results per query
+        sample_size (int): Number of sampled queries
+        seed (int): Sampling seed, so reports can be compared
+
+    Returns:
+        dict: recall_at_k, latency percentiles (ms) of the engine and of exact search, and index size
+    """
+    project = get_project_catalog().get_project(project_name)
+    current = project_engine(project)
+    engine = ENGINES[engine_name] if engine_name else current
+    stored = project_index_params(project) if engine is current else {}
+    params = {**stored, **(params or {})}
+    collection = get_project_collection(project_name, project)
+
+    truth = ground_truth(project_name, collection, k, sample_size, seed)
+    with measured_index(engine, project_name, collection, engine is current, stored, params) as (index_key, measured):
+        recall, latency = measure_engine(engine, index_key, measured, truth, k, params)
+        index_size = _index_size(engine, index_key)
+
+    return {
+        'project_name': project_name,
+        'engine': engine.name,
+        'index_params': engine.resolve_params(params),
+        'k': k,
+        'queries': len(truth['query_ids']),
+        'documents': truth['documents'],
+        f'recall_at_{k}': recall,
+        'latency_ms': latency,
+        'exact_latency_ms': latency_percentiles(truth['exact_ms']),
+        'index_files_bytes': index_size,
+    }
+
+
+def latency_percentiles(values):
+    """
+    Returns:
+        dict: p50, p95 and p99 of latencies in ms
+    """
+    if not values:
+        return {}
+    return {f'p{p}': round(float(np.percentile(values, p)), 3) for p in (50, 95, 99)}
+
+
+def _needs_rebuild(engine, stored, params):
+    """
+    Returns:
+        bool: True if params change a build-time parameter of the engine
+    """
+    before, after = engine.resolve_params(stored), engine.resolve_params(params)
+    return any(before[k] != after[k] for k in engine.params if k not in engine.query_params)
+
+
+def _index_size(engine, index_key):
+    """
+    Returns:
+        dict: Size in bytes of every file of an engine's published build, None for Chroma
+    """
+    if not isinstance(engine, MappedIndexEngine):
+        return None
+    files = engine.files(index_key)
+    manifest = files.read_manifest() or {}
+    return {role: os.path.getsize(files.path(name)) for role, name in manifest.get('files', {}).items()}
+
+
+def handle_recall_report(project_name, args):
+    """
+    Endpoint handler for a project's recall report. Query arguments:
+    'engine' and engine parameters (default to the project's), 'k' (at most
+    RECALL_MAX_K) and 'sample' (at most RECALL_MAX_SAMPLE).
+
+    Returns:
+        tuple: (response_dict, http_status_code)
+    """
+    if get_project_catalog().get_project(project_name) is None:
+        return {'error': f"Project '{project_name}' does not exist."}, 404
+    try:
+        engine_name, params = requested_engine(project_name, args)
+        k = int(args.get('k') or 10)
+        sample_size = int(args.get('sample') or 100)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    if k < 1 or sample_size < 1:
+        return {'error': "'k' and 'sample' must be positive"}, 400
+    if k > RECALL_MAX_K or sample_size > RECALL_MAX_SAMPLE:
+        return {'error': f"'k' must be at most {RECALL_MAX_K} and 'sample' at most {RECALL_MAX_SAMPLE}"}, 400
+    return recall_report(project_name, engine_name, params, k, sample_size), 200
+
+
+def drop_project_indexes(project_name):
+    """
+    Removes every index file of a deleted project.
+    """
+    for engine in ENGINES.values():
+        engine.drop(project_name)
+    shutil.rmtree(os.path.join(INDEX_DIR, project_name), ignore_errors=True)
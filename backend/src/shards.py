@@ -0,0 +1,279 @@
+# shards.py
+# This module spreads very large projects over several Chroma collections.
+# A project created with N shards stores each record in the shard picked by
+# a hash of its id: shard 0 is the collection named after the project, the
+# others are '<project>__shard<i>'. Each shard has its own HNSW index, so
+# writes to different shards run in parallel and every query is answered
+# by N smaller indexes at once, whose top k are merged. ShardedCollection
+# offers the part of the collection API the ingestion and search code use,
+# so callers get a project's collection from get_project_collection() and
+# do not care how many shards it has.
+
+import os
+import zlib
+from chroma_instance import get_chroma_client, validate_project_name, SHARD_SUFFIX
+from project_catalog import get_project_catalog
+from executors import get_shard_executor
+
+# Upper bound on the shard count of a project
+MAX_SHARDS = int(os.environ.get('MAX_SHARDS', 64))
+
+# Fields a get or query result can hold besides 'ids'
+_RESULT_FIELDS = ('embeddings', 'documents', 'metadatas', 'distances')
+
+
+def shard_names(project_name, shards):
+    """
+    Returns:
+        list: Collection name of every shard, shard 0 first
+    """
+    return [project_name] + [f"{project_name}{SHARD_SUFFIX}{i}" for i in range(1, shards)]
+
+
+def shard_of(record_id, shards):
+    """
+    Returns:
+        int: The shard a record id belongs to; stable across processes and restarts
+    """
+    return zlib.crc32(record_id.encode('utf-8')) % shards
+
+
+def project_shard_count(project):
+    return int((project or {}).get('settings', {}).get('shards', 1))
+
+
+class ShardedCollection:
+    """
+    A project's shard collections behind the collection interface. Writes
+    are split by shard_of() and sent to the shards in parallel; reads and
+    queries fan out to every shard and their results are merged.
+    """
+    def __init__(self, name, shards):
+        """
+        Args:
+            name (str): Project name
+            shards (list): Shard collections, shard 0 first
+        """
+        self.name = name
+        self.shards = shards
+
+    @property
+    def metadata(self):
+        return self.shards[0].metadata
+
+    def _fan_out(self, func, shard_indexes=None):
+        """
+        Runs func(shard_index) for the given shards (all by default) on the shard pool.
+
+        Returns:
+            list: The results, in the order of shard_indexes
+        """
+        shard_indexes = list(range(len(self.shards)) if shard_indexes is None else shard_indexes)
+        if len(shard_indexes) == 1:
+            return [func(shard_indexes[0])]
+        futures = [get_shard_executor().submit(func, i) for i in shard_indexes]
+        return [future.result() for future in futures]
+
+    def _group(self, ids):
+        """
+        Returns:
+            dict: Shard index -> positions in ids of the records it holds
+        """
+        groups = {}
+        for position, record_id in enumerate(ids):
+            groups.setdefault(shard_of(record_id, len(self.shards)), []).append(position)
+        return groups
+
+    def count(self):
+        return sum(self._fan_out(lambda i: self.shards[i].count()))
+
+    def _write(self, method, ids, fields):
+        groups = self._group(ids)
+
+        def write(i):
+            positions = groups[i]
+            getattr(self.shards[i], method)(
+                ids=[ids[p] for p in positions],
+                **{name: [values[p] for p in positions] for name, values in fields.items() if values is not None}
+            )
+        self._fan_out(write, groups)
+
+    def add(self, ids, embeddings=None, documents=None, metadatas=None):
+        self._write('add', ids, {'embeddings': embeddings, 'documents': documents, 'metadatas': metadatas})
+
+    def upsert(self, ids, embeddings=None, documents=None, metadatas=None):
+        self._write('upsert', ids, {'embeddings': embeddings, 'documents': documents, 'metadatas': metadatas})
+
+    def delete(self, ids=None, where=None):
+        if ids is None:
+            self._fan_out(lambda i: self.shards[i].delete(where=where))
+            return
+        groups = self._group(ids)
+        self._fan_out(lambda i: self.shards[i].delete(ids=[ids[p] for p in groups[i]], where=where), groups)
+
+    @staticmethod
+    def _concat(results, include):
+        merged = {'ids': []}
+        fields = [f for f in _RESULT_FIELDS if f in include]
+        for field in fields:
+            merged[field] = []
+        for result in results:
+            merged['ids'].extend(result['ids'])
+            for field in fields:
+                values = result.get(field)
+                merged[field].extend(values if values is not None else [None] * len(result['ids']))
+        return merged
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=('documents', 'metadatas')):
+        include = list(include)
+        if ids is not None:
+            groups = self._group(ids)
+            results = self._fan_out(
+                lambda i: self.shards[i].get(ids=[ids[p] for p in groups[i]], where=where, include=include), groups)
+            return self._concat(results, include)
+        if limit is None and not offset:
+            return self._concat(self._fan_out(lambda i: self.shards[i].get(where=where, include=include)), include)
+        if where is not None:
+            merged = self._concat(self._fan_out(lambda i: self.shards[i].get(where=where, include=include)), include)
+            end = None if limit is None else (offset or 0) + limit
+            return {field: values[offset or 0:end] for field, values in merged.items()}
+
+        # Pages run through the shards in order, as if they were one collection
+        offset = offset or 0
+        results = []
+        for shard in self.shards:
+            if limit is not None and limit <= 0:
+                break
+            size = shard.count()
+            if offset >= size:
+                offset -= size
+                continue
+            page = shard.get(limit=limit, offset=offset, include=include)
+            results.append(page)
+            offset = 0
+            if limit is not None:
+                limit -= len(page['ids'])
+        return self._concat(results, include)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=('documents', 'metadatas', 'distances')):
+        include = list(include)
+        # Distances are needed to merge, even if the caller does not want them
+        shard_include = include if 'distances' in include else include + ['distances']
+        results = self._fan_out(lambda i: self.shards[i].query(
+            query_embeddings=query_embeddings, n_results=n_results, where=where, include=shard_include))
+
+        fields = [f for f in _RESULT_FIELDS if f in include]
+        merged = {'ids': [], **{field: [] for field in fields}}
+        for q in range(len(query_embeddings)):
+            candidates = []
+            for shard_result in results:
+                for n, record_id in enumerate(shard_result['ids'][q]):
+                    candidates.append((shard_result['distances'][q][n], record_id, shard_result, n))
+            candidates.sort(key=lambda c: (c[0], c[1]))
+            best = candidates[:n_results]
+            merged['ids'].append([c[1] for c in best])
+            for field in fields:
+                merged[field].append([c[2][field][q][c[3]] if c[2].get(field) is not None else None for c in best])
+        return merged
+
+    def modify(self, name=None, metadata=None, configuration=None):
+        if name is not None:
+            raise ValueError("A sharded project cannot be renamed")
+        self._fan_out(lambda i: self.shards[i].modify(metadata=metadata, configuration=configuration))
+
+
+def create_project_collection(project_name, metadata, shards=1):
+    """
+    Creates the collection, or the shard collections, of a new project.
+
+    Args:
+        project_name (str): Project name
+        metadata (dict): Collection metadata, given to every shard
+        shards (int): Number of shards
+
+    Returns:
+        The collection, or a ShardedCollection when shards > 1
+
+    Raises:
+        ValueError: If the name is reserved for internal collections, see validate_project_name
+    """
+    validate_project_name(project_name)
+    client = get_chroma_client()
+    if shards <= 1:
+        return client.create_collection(name=project_name, embedding_function=None, metadata=metadata)
+    metadata = {**metadata, 'shards': shards}
+    return ShardedCollection(project_name, [
+        client.create_collection(name=name, embedding_function=None, metadata=metadata)
+        for name in shard_names(project_name, shards)
+    ])
+
+
+def get_project_collection(project_name, project=None):
+    """
+    Returns a project's collection, sharded or not.
+
+    Args:
+        project_name (str): Project name
+        project (dict): Catalog entry if the caller already has it
+
+    Returns:
+        The collection, or a ShardedCollection for a sharded project
+    """
+    if project is None:
+        project = get_project_catalog().get_project(project_name)
+    shards = project_shard_count(project)
+    client = get_chroma_client()
+    if shards <= 1:
+        return client.get_collection(name=project_name)
+    return ShardedCollection(project_name, [client.get_collection(name=name) for name in shard_names(project_name, shards)])
+
+
+def invalidate_project_collection(project_name, project=None):
+    """
+    Drops the cached handles of a project's collections.
+    """
+    client = get_chroma_client()
+    for name in shard_names(project_name, project_shard_count(project)):
+        client.invalidate(name)
+
+
+def delete_project_collections(project_name, project=None):
+    """
+    Deletes the collection of a project and any extra shards.
+    """
+    if project is None:
+        project = get_project_catalog().get_project(project_name)
+    client = get_chroma_client()
+    for name in shard_names(project_name, project_shard_count(project)):
+        if client.has_collection(name):
+            client.delete_collection(name)
+
+
+def requested_shards(form, project=None):
+    """
+    Reads the optional 'shards' field of a project creation form.
+
+    Args:
+        form (dict): Request form
+        project (dict): Catalog entry of the project if it exists
+
+    Returns:
+        int: Number of shards for the project
+
+    Raises:
+        ValueError: If the value is not between 1 and MAX_SHARDS, or differs
+            from the shard count of an existing project
+    """
+    value = (form.get('shards') or '').strip()
+    if not value:
+        return project_shard_count(project)
+    try:
+        shards = int(value)
+    except ValueError:
+        raise ValueError("'shards' must be an integer")
+    if not 1 <= shards <= MAX_SHARDS:
+        raise ValueError(f"'shards' must be between 1 and {MAX_SHARDS}")
+    if project is not None and shards != project_shard_count(project):
+        raise ValueError(f"Project '{project['name']}' has {project_shard_count(project)} shards; "
+                         f"the shard count is fixed at creation")
+    return shards
@@ -0,0 +1,177 @@
+# single_flight.py
+# This module coalesces identical work that is in flight at the same time.
+# The first caller for a key runs the computation; callers arriving with
+# the same key before it finishes wait for it and get the same result (or
+# exception) instead of repeating it. Nothing is kept once the computation
+# is done: caching finished results is the result cache's job. SingleFlight
+# serves threads (Flask, gunicorn), AsyncSingleFlight coroutines on one
+# event loop (the ASGI server); there, if the leading request is cancelled,
+# a waiting one takes over the computation.
+
+import copy
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _LeaderCancelled(Exception):
+    """
+    Set on a shared call whose leader was cancelled; its waiters retry.
+    """
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def count(self, leader):
+        with self._lock:
+            if leader:
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: Computations run, and calls that waited for one instead of running their own
+        """
+        with self._lock:
+            calls = self.executions + self.coalesced
+            return {
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'coalesced_rate': round(self.coalesced / calls, 4) if calls else 0.0,
+            }
+
+
+class SingleFlight(_Counters):
+    """
+    Coalesces concurrent calls with the same key across threads.
+    """
+    def __init__(self):
+        super().__init__()
+        self._calls = {}
+        self._calls_lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        """
+        Runs func(*args), unless a call with the same key is already running,
+        in which case its outcome is awaited and shared.
+
+        Args:
+            key: Hashable identity of the computation
+            func (callable): The computation
+
+        Returns:
+            The result of func; waiters get their own copy
+        """
+        with self._calls_lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        self.count(leader)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = func(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._calls_lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight(_Counters):
+    """
+    Coalesces concurrent coroutine calls with the same key on one event loop.
+    """
+    def __init__(self):
+        super().__init__()
+        self._calls = {}
+
+    async def do(self, key, func, *args):
+        """
+        Awaits func(*args), unless a call with the same key is already
+        running, in which case its outcome is awaited and shared.
+
+        Args:
+            key: Hashable identity of the computation
+            func (callable): Coroutine function doing the computation
+
+        Returns:
+            The result of func; waiters get their own copy
+        """
+        waited = False
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                self.count(True)
+                break
+            if not waited:
+                self.count(False)
+                waited = True
+            try:
+                # Shielded: a waiter that is cancelled must not cancel the leader's computation
+                return copy.deepcopy(await asyncio.shield(future))
+            except _LeaderCancelled:
+                # The leader's own request went away; the first waiter to get here runs it instead
+                continue
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await func(*args)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            # Not future.cancel(): that would cancel the waiters along with it
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieved here so an exception nobody waited for is not reported as lost
+            future.exception()
+            raise
+        finally:
+            del self._calls[key]
+
+
+_single_flight = None
+_async_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
+
+
+def get_async_single_flight():
+    global _async_single_flight
+    if _async_single_flight is None:
+        with _single_flight_lock:
+            if _async_single_flight is None:
+                _async_single_flight = AsyncSingleFlight()
+    return _async_single_flight
@@ -0,0 +1,32 @@
+# sqlite_store.py
+# Base class for the small SQLite-backed stores (results, project catalog).
+# SQLite gives every worker process on the host the same view of the data.
+
+import os
+import sqlite3
+import threading
+
+
+class SqliteStore:
+    """
+    Holds one SQLite connection per thread and process.
+    Connections are never shared across threads or carried over a fork.
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Location of the SQLite database file
+        """
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection().execute('PRAGMA journal_mode=WAL')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
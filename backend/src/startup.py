@@ -0,0 +1,147 @@
+# startup.py
+# This module times application startup and tracks readiness. Importing the
+# app only loads light modules; the embedding model, the Chroma database and
+# the project catalog are brought up by warm_up(), in a background thread
+# for the development server or before forking under gunicorn. /health says
+# the process is alive, /ready says the warm-up has finished.
+
+import os
+import time
+import logging
+import threading
+import datetime
+from contextlib import contextmanager
+
+# 'background' warms up in a thread after import, 'sync' before import returns
+WARMUP_MODE = os.environ.get('WARMUP_MODE', 'background')
+
+
+class StartupReport:
+    """
+    Records how long each startup phase took and whether startup has finished.
+    """
+    def __init__(self):
+        self.started_at = datetime.datetime.now().isoformat()
+        self.phases = {}
+        self.error = None
+        self._starts = {}
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, phase):
+        with self._lock:
+            self._starts[phase] = time.perf_counter()
+
+    def finish(self, phase):
+        with self._lock:
+            started = self._starts.pop(phase, None)
+            if started is not None:
+                self.phases[phase] = round(time.perf_counter() - started, 3)
+
+    @contextmanager
+    def phase(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.finish(name)
+
+    def mark_ready(self):
+        self._ready.set()
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'ready': self.is_ready(),
+                'started_at': self.started_at,
+                'phases_seconds': dict(self.phases),
+                'pending': sorted(self._starts),
+                'error': self.error,
+            }
+
+    def readiness(self):
+        """
+        Endpoint handler for /ready.
+
+        Returns:
+            tuple: (response_dict, http_status_code) - 200 once warmed up, 503 before
+        """
+        report = self.to_dict()
+        return report, 200 if report['ready'] else 503
+
+
+startup_report = StartupReport()
+
+
+def warm_up_encoder():
+    """
+    Runs one encode, which initialises the tokenizer and torch's thread pool.
+    Only in a process that serves requests: a gunicorn master must not start
+    thread pools its forked workers would inherit. A failure is logged; the
+    first query then pays for the initialisation instead.
+    """
+    try:
+        with startup_report.phase('encoder_warm_up'):
+            from embeddings import get_embedding_model
+            get_embedding_model().encode(['warm-up'])
+    except Exception as e:
+        logging.exception(f"Encoder warm-up failed: {e}")
+
+
+def warm_up(serving=True):
+    """
+    Loads the embedding model, opens the vector store and reconciles the
+    project catalog, recording the time of each phase.
+
+    Args:
+        serving (bool): Whether this process serves requests itself. If so,
+            the encoder is warmed up and stale projections are refitted once
+            ready; a gunicorn master only loads the model, and its workers do
+            the rest after fork (main.post_fork)
+    """
+    try:
+        with startup_report.phase('model_load'):
+            from embeddings import get_embedding_model
+            get_embedding_model()
+        if serving:
+            warm_up_encoder()
+
+        with startup_report.phase('db_open'):
+            from chroma_instance import get_chroma_client
+            chroma_client = get_chroma_client()
+            chroma_client.list_collection_names()
+
+        with startup_report.phase('catalog_reconcile'):
+            from project_catalog import get_project_catalog
+            # Catalog any collection the project catalog does not know yet
+            get_project_catalog().reconcile(chroma_client)
+
+        startup_report.mark_ready()
+        logging.info(f"Startup complete: {startup_report.phases}", extra={"startup": startup_report.to_dict()})
+
+        if serving:
+            from reduction import start_stale_reprojection
+            start_stale_reprojection()
+    except Exception as e:
+        startup_report.error = str(e)
+        logging.exception(f"Warm-up failed: {e}")
+
+
+def start_warm_up(mode=WARMUP_MODE):
+    """
+    Runs warm_up() in the background, or in the calling thread when mode is
+    'sync'. A sync warm-up runs in the gunicorn master, so the encoder warm-up
+    and stale projections are left for the workers (main.post_fork).
+
+    Returns:
+        threading.Thread: The warm-up thread, or None when run synchronously
+    """
+    if mode == 'sync':
+        warm_up(serving=False)
+        return None
+    thread = threading.Thread(target=warm_up, name='warm-up', daemon=True)
+    thread.start()
+    return thread
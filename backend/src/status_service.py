@@ -1,5 +1,6 @@
 import logging
 from flask import request, jsonify
+from responses import json_response
 
 def handle_status(request_id, results_dict, results_lock):
     try:
@@ -9,7 +10,7 @@ def handle_status(request_id, results_dict, results_lock):
             logging.warning(f"Invalid request_id {request_id} requested",
                             extra={"request_id": getattr(request, 'request_id', 'unknown')})
             return jsonify({'error': 'Invalid request_id'}), 404
-        return jsonify(result)
+        return json_response(result)
     except Exception as e:
         logging.exception(f"Error in /status: {e}",
                          extra={"request_id": getattr(request, 'request_id', 'unknown')})
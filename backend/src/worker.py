@@ -70,9 +70,12 @@ class Worker:
                         'match_percentage': result['match_percentage'], 
                         'llm_user_id': result['user_id']
                     })
-                    # Update progress after each comparison
+                    # Update progress after each comparison. The entry is written back
+                    # as a whole, since a shared results store hands out copies.
                     with self.RESULTS_LOCK:
-                        self.RESULTS[request_id]['progress'] = int(((idx + 1) / total) * 100)
+                        entry = self.RESULTS[request_id]
+                        entry['progress'] = int(((idx + 1) / total) * 100)
+                        self.RESULTS[request_id] = entry
                 # Only keep the top 5 matches
                 top_matches = sorted(results, key=lambda x: x['match_percentage'], reverse=True)[:5]
 
@@ -90,12 +93,14 @@ class Worker:
 
                 # Store the result in the shared dictionary, protected by a lock
                 with self.RESULTS_LOCK:
-                    self.RESULTS[request_id].update({
+                    entry = self.RESULTS[request_id]
+                    entry.update({
                         'top_matches': top_matches, 
                         'user_id': user_id, 
                         'status': 'done',
                         'progress': 100
                     })
+                    self.RESULTS[request_id] = entry
             except Exception as e:
                 logging.exception(f"Error processing request {req}: {e}")
                 with self.RESULTS_LOCK:
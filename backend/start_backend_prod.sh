@@ -0,0 +1,26 @@
+#!/bin/bash
+set -e
+
+# Change to backend directory (in case script is run from elsewhere)
+cd "$(dirname "$0")"
+
+# Activate venv if it exists, otherwise create it
+if [ -d "backend_venv" ]; then
+    echo "Activating virtual environment..."
+    source backend_venv/bin/activate
+else
+    echo "Creating virtual environment..."
+    python3 -m venv backend_venv
+    source backend_venv/bin/activate
+    echo "Installing dependencies..."
+    pip install -r requirements.txt
+fi
+
+# Worker processes and threads per worker (defaults: one process per core, 4 threads)
+export WEB_WORKERS=${WEB_WORKERS:-$(nproc)}
+export WEB_THREADS=${WEB_THREADS:-4}
+export PYTHONPATH=$(pwd)/src
+
+echo "Starting production backend on http://0.0.0.0:8000 ($WEB_WORKERS workers x $WEB_THREADS threads)"
+cd src
+exec gunicorn -c gunicorn.conf.py